@@ -0,0 +1,311 @@
+import sys
+import pathlib
+import logging
+import argparse
+import gzip
+import concurrent.futures
+
+import numpy
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+import alert_index
+
+_logger = logging.getLogger(__name__)
+if not _logger.hasHandlers():
+    _logout = logging.StreamHandler( sys.stderr )
+    _logger.addHandler( _logout )
+    _formatter = logging.Formatter( f'[%(asctime)s - %(levelname)s] - %(message)s',
+                                    datefmt='%Y-%m-%d %H:%M:%S' )
+    _logout.setFormatter( _formatter )
+_logger.setLevel( logging.INFO )
+
+# Bump this if the layout of the container or its index changes
+_container_version = 2
+
+# A night's tarball NITE{n}.tar.gz is repacked into NITE{n}.alerts, with
+#   an index NITE{n}.alerts.index.npz next to it.
+#
+# NITE{n}.alerts is the (not individually gzipped) schemaless Avro
+#   alerts concatenated together, one block per exposure, in order of
+#   exposure MJD.  With compression 'zstd', each exposure's block is one
+#   zstd frame; with compression 'none', the blocks are just the bytes.
+#   Either way, reading an exposure is one read (and maybe one
+#   decompression) of a contiguous piece of the file.
+#
+# The index has per-alert arrays, sorted by name (i.e. by MJD):
+#
+#     name      -- the alert's member name in the original tarball
+#     mjd       -- MJD of the alert's exposure
+#     objectId  -- diaObjectId
+#     sourceId  -- diaSourceId
+#     exposure  -- which exposure block the alert is in
+#     offset    -- byte offset of the alert within its (decompressed) exposure block
+#     size      -- size in bytes of the alert
+#
+#   and per-exposure arrays exposure_mjd, exposure_offset,
+#   exposure_size (where the block is in the file), and
+#   exposure_rawsize (size of the decompressed block); plus the scalars
+#   version, compression, datasize (size of NITE{n}.alerts), and
+#   tarname, tarsize, tarmtime (name, size and st_mtime_ns of the tarball
+#   it was repacked from).  An index whose datasize doesn't match the
+#   container, or whose tarball is still there but has a different size
+#   or mtime, is ignored (and repack_tarball will rewrite it).
+
+
+def container_path( tarpath ):
+    """The path of the container that tarball tarpath is repacked into."""
+    tarpath = pathlib.Path( tarpath )
+    name = tarpath.name
+    for ext in ( ".tar.gz", ".tar" ):
+        if name.endswith( ext ):
+            name = name[ :-len(ext) ]
+            break
+    return tarpath.parent / f"{name}.alerts"
+
+
+def container_index_path( path ):
+    """The path of the index file of container path."""
+    path = pathlib.Path( path )
+    return path.parent / f"{path.name}.index.npz"
+
+
+def repack_tarball( tarpath, outpath=None, compression='zstd', level=3, overwrite=False ):
+    """Repack one alert tarball into a container.
+
+    Parameters
+    ----------
+      tarpath : Path
+        The NITE{n}.tar.gz file
+
+      outpath : Path
+        The container to write; defaults to container_path( tarpath )
+
+      compression : str
+        'zstd' or 'none'
+
+      level : int
+        zstd compression level
+
+      overwrite : bool
+        If False, don't rewrite a container that's already there and
+        up to date with its index and tarpath
+
+    Returns
+    -------
+      The number of alerts repacked, or None if the container was
+      already there.
+
+    """
+    if compression not in ( 'zstd', 'none' ):
+        raise ValueError( f"Unknown compression {compression}; must be 'zstd' or 'none'" )
+    if ( compression == 'zstd' ) and ( zstandard is None ):
+        raise RuntimeError( "Writing zstd-compressed alert containers needs the zstandard package" )
+
+    tarpath = pathlib.Path( tarpath )
+    outpath = container_path( tarpath ) if outpath is None else pathlib.Path( outpath )
+    if ( not overwrite ) and ( read_container_index( outpath, tarpath ) is not None ):
+        return None
+    tarstat = tarpath.stat()
+
+    index = alert_index.read_index( tarpath )
+    if index is None:
+        index = alert_index.index_tarball( tarpath )
+    members = alert_index.read_indexed_members( tarpath, index )
+
+    # The index is sorted by MJD, so each exposure is a contiguous range of it
+    nalerts = len( index['name'] )
+    mjd = index['mjd']
+    starts = numpy.flatnonzero( numpy.concatenate( [ [ True ], mjd[1:] != mjd[:-1] ] ) ) if nalerts > 0 else \
+        numpy.array( [], dtype=numpy.int64 )
+    ends = numpy.concatenate( [ starts[1:], [ nalerts ] ] ).astype( numpy.int64 )
+    nexps = len( starts )
+
+    offsets = numpy.zeros( nalerts, dtype=numpy.int64 )
+    sizes = numpy.zeros( nalerts, dtype=numpy.int64 )
+    exposure_offset = numpy.zeros( nexps, dtype=numpy.int64 )
+    exposure_size = numpy.zeros( nexps, dtype=numpy.int64 )
+    exposure_rawsize = numpy.zeros( nexps, dtype=numpy.int64 )
+    compressor = zstandard.ZstdCompressor( level=level ) if compression == 'zstd' else None
+
+    idxpath = container_index_path( outpath )
+    tmppath = outpath.parent / f".{outpath.name}.tmp"
+    tmpidxpath = idxpath.parent / f".{idxpath.name}.tmp.npz"
+    try:
+        pos = 0
+        with open( tmppath, "wb" ) as ofp:
+            for e, ( i0, i1 ) in enumerate( zip( starts, ends ) ):
+                payloads = [ gzip.decompress( members[i] ) for i in range( i0, i1 ) ]
+                sizes[i0:i1] = [ len( p ) for p in payloads ]
+                offsets[i0:i1] = numpy.cumsum( sizes[i0:i1] ) - sizes[i0:i1]
+                block = b''.join( payloads )
+                exposure_rawsize[e] = len( block )
+                if compressor is not None:
+                    block = compressor.compress( block )
+                ofp.write( block )
+                exposure_offset[e] = pos
+                exposure_size[e] = len( block )
+                pos += len( block )
+
+        numpy.savez_compressed( tmpidxpath, version=_container_version, compression=compression, datasize=pos,
+                                tarname=tarpath.name, tarsize=tarstat.st_size, tarmtime=tarstat.st_mtime_ns,
+                                name=index['name'], mjd=mjd, objectId=index['objectId'], sourceId=index['sourceId'],
+                                exposure=numpy.repeat( numpy.arange( nexps, dtype=numpy.int64 ), ends - starts ),
+                                offset=offsets, size=sizes, exposure_mjd=mjd[starts], exposure_offset=exposure_offset,
+                                exposure_size=exposure_size, exposure_rawsize=exposure_rawsize )
+        # The index is checked against the data size, so a crash between these leaves nothing usable
+        tmppath.replace( outpath )
+        tmpidxpath.replace( idxpath )
+    finally:
+        tmppath.unlink( missing_ok=True )
+        tmpidxpath.unlink( missing_ok=True )
+
+    return nalerts
+
+
+def read_container_index( path, tarpath=None ):
+    """Read the index of container path.
+
+    Parameters
+    ----------
+      path : Path
+        The NITE{n}.alerts file
+
+      tarpath : Path
+        The tarball the container was repacked from; defaults to the
+        tarball named in the index, in the same directory as path.  If
+        the tarball exists and its size or mtime isn't what the index
+        recorded, the container is stale.  (If it doesn't exist, the
+        container is used as is.)
+
+    Returns a dict of name -> numpy array (or scalar, for version,
+    compression, datasize, tarname, tarsize, and tarmtime), or None if
+    there's no usable, up to date container at path.
+
+    """
+    path = pathlib.Path( path )
+    idxpath = container_index_path( path )
+    if ( not path.is_file() ) or ( not idxpath.is_file() ):
+        return None
+    try:
+        with numpy.load( idxpath ) as npz:
+            index = { k: npz[k] for k in npz.files }
+    except Exception as ex:
+        _logger.warning( f"Failed to read {idxpath}, ignoring it: {ex}" )
+        return None
+    index['version'] = int( index['version'] )
+    if index['version'] != _container_version:
+        _logger.warning( f"{idxpath} is an old version, ignoring it." )
+        return None
+    index['compression'] = str( index['compression'] )
+    index['datasize'] = int( index['datasize'] )
+    index['tarname'] = str( index['tarname'] )
+    index['tarsize'] = int( index['tarsize'] )
+    index['tarmtime'] = int( index['tarmtime'] )
+    if index['datasize'] != path.stat().st_size:
+        _logger.warning( f"{idxpath} is out of date with {path.name}, ignoring it." )
+        return None
+    tarpath = path.parent / index['tarname'] if tarpath is None else pathlib.Path( tarpath )
+    if tarpath.is_file():
+        tarstat = tarpath.stat()
+        if ( tarstat.st_size != index['tarsize'] ) or ( tarstat.st_mtime_ns != index['tarmtime'] ):
+            _logger.warning( f"{path.name} is out of date with {tarpath}, ignoring it." )
+            return None
+    if ( index['compression'] == 'zstd' ) and ( zstandard is None ):
+        _logger.warning( f"Can't read {path}, it's zstd-compressed and the zstandard package isn't installed." )
+        return None
+    return index
+
+
+def iter_exposures( path, index=None ):
+    """Read the alerts from container path one exposure at a time.
+
+    Yields ( mjd, names, payloads ) for each exposure in order of MJD,
+    where names is a list of the alerts' names in the original tarball,
+    and payloads is a list of the schemaless Avro bytes of the alerts.
+
+    """
+    path = pathlib.Path( path )
+    if index is None:
+        index = read_container_index( path )
+        if index is None:
+            raise ValueError( f"{path} is not a usable alert container" )
+
+    nexps = len( index['exposure_mjd'] )
+    counts = numpy.bincount( index['exposure'], minlength=nexps )
+    ends = numpy.cumsum( counts )
+    starts = ends - counts
+    names = index['name'].tolist()
+    offsets = index['offset'].tolist()
+    sizes = index['size'].tolist()
+    decompressor = zstandard.ZstdDecompressor() if index['compression'] == 'zstd' else None
+
+    with open( path, "rb" ) as ifp:
+        for e in range( nexps ):
+            ifp.seek( int( index['exposure_offset'][e] ) )
+            block = ifp.read( int( index['exposure_size'][e] ) )
+            if decompressor is not None:
+                block = decompressor.decompress( block, max_output_size=int( index['exposure_rawsize'][e] ) )
+            i0 = int( starts[e] )
+            i1 = int( ends[e] )
+            payloads = [ block[ o : o+s ] for o, s in zip( offsets[i0:i1], sizes[i0:i1] ) ]
+            yield float( index['exposure_mjd'][e] ), names[i0:i1], payloads
+
+
+def read_container( path, index=None ):
+    """Read all the alerts from container path.
+
+    Returns a list of ( name, schemaless Avro bytes ), sorted by name
+    (i.e. by MJD).
+
+    """
+    alerts = []
+    for mjd, names, payloads in iter_exposures( path, index ):
+        alerts.extend( zip( names, payloads ) )
+    return alerts
+
+
+def main():
+    parser = argparse.ArgumentParser( description="Repack ELAsTiCC alert tarballs into indexed alert containers "
+                                      "(NITE{n}.alerts next to each NITE{n}.tar.gz).",
+                                      formatter_class=argparse.ArgumentDefaultsHelpFormatter )
+    parser.add_argument( "paths", nargs='+',
+                         help="NITE*.tar.gz files, or directories to search (recursively) for them" )
+    parser.add_argument( "-z", "--compression", default="zstd", choices=[ 'zstd', 'none' ],
+                         help="How to compress each exposure's block of alerts" )
+    parser.add_argument( "-l", "--level", type=int, default=3, help="zstd compression level" )
+    parser.add_argument( "-n", "--processes", type=int, default=1, help="Number of tarballs to repack at once" )
+    parser.add_argument( "--overwrite", action='store_true', default=False,
+                         help="Rewrite containers that are already there and up to date" )
+    args = parser.parse_args()
+
+    tarpaths = alert_index.find_tarballs( args.paths )
+    _logger.info( f"Repacking {len(tarpaths)} tarballs" )
+    failed = []
+    with concurrent.futures.ProcessPoolExecutor( max_workers=max( args.processes, 1 ) ) as pool:
+        futures = { pool.submit( repack_tarball, tarpath, compression=args.compression, level=args.level,
+                                 overwrite=args.overwrite ): tarpath
+                    for tarpath in tarpaths }
+        for future in concurrent.futures.as_completed( futures ):
+            tarpath = futures[future]
+            try:
+                nalerts = future.result()
+                if nalerts is None:
+                    _logger.info( f"{tarpath} already repacked" )
+                else:
+                    _logger.info( f"Repacked {nalerts} alerts from {tarpath} into {container_path( tarpath )}" )
+            except Exception as ex:
+                _logger.exception( f"Failed repacking {tarpath}: {ex}" )
+                failed.append( tarpath )
+
+    if len( failed ) > 0:
+        _logger.error( f"Failed to repack {len(failed)} tarballs" )
+        sys.exit( 1 )
+
+
+# ======================================================================
+if __name__ == "__main__":
+    main()
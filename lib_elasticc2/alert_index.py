@@ -0,0 +1,200 @@
+import sys
+import re
+import pathlib
+import logging
+import argparse
+import gzip
+import tarfile
+import concurrent.futures
+
+import numpy
+
+_logger = logging.getLogger(__name__)
+if not _logger.hasHandlers():
+    _logout = logging.StreamHandler( sys.stderr )
+    _logger.addHandler( _logout )
+    _formatter = logging.Formatter( f'[%(asctime)s - %(levelname)s] - %(message)s',
+                                    datefmt='%Y-%m-%d %H:%M:%S' )
+    _logout.setFormatter( _formatter )
+_logger.setLevel( logging.INFO )
+
+_nameparse = re.compile( r'alert_mjd([0-9]+\.[0-9]+)_obj([0-9]+)_src([0-9]+).avro.gz' )
+
+# Bump this if the contents of the index files change
+_index_version = 2
+
+# An index of NITE{n}.tar.gz is written next to it as NITE{n}.tar.gz.index.npz.
+#   It has arrays, one element per alert file in the tarball:
+#
+#     name      -- member name in the tarball
+#     offset    -- byte offset of the member's data in the (uncompressed) tar stream
+#     size      -- size in bytes of the member's data (the still-gzipped alert)
+#     mjd       -- MJD of the alert's exposure
+#     objectId  -- diaObjectId
+#     sourceId  -- diaSourceId
+#
+#   sorted by name, which is the same as sorting by MJD.  There are also
+#   the scalars version, tarsize and tarmtime (the size and st_mtime_ns of
+#   the tarball when the index was built); an index whose tarsize or
+#   tarmtime doesn't match the tarball is ignored.
+
+
+def index_path( tarpath ):
+    """The path of the index file for tarball tarpath."""
+    tarpath = pathlib.Path( tarpath )
+    return tarpath.parent / f"{tarpath.name}.index.npz"
+
+
+def index_tarball( tarpath ):
+    """Index one alert tarball without writing anything.
+
+    Returns a dict of column name -> numpy array, as in the index file
+    (see the top of this file).
+
+    """
+    names = []
+    offsets = []
+    sizes = []
+    mjds = []
+    objids = []
+    srcids = []
+    with tarfile.open( tarpath, "r" ) as tar:
+        for member in tar:
+            match = _nameparse.search( member.name )
+            if ( not member.isfile() ) or ( not match ):
+                continue
+            names.append( member.name )
+            offsets.append( member.offset_data )
+            sizes.append( member.size )
+            mjds.append( float( match.group(1) ) )
+            objids.append( int( match.group(2) ) )
+            srcids.append( int( match.group(3) ) )
+
+    names = numpy.array( names, dtype=str )
+    dex = numpy.argsort( names, kind='stable' )
+    return { 'name': names[dex],
+             'offset': numpy.array( offsets, dtype=numpy.int64 )[dex],
+             'size': numpy.array( sizes, dtype=numpy.int64 )[dex],
+             'mjd': numpy.array( mjds, dtype=numpy.float64 )[dex],
+             'objectId': numpy.array( objids, dtype=numpy.int64 )[dex],
+             'sourceId': numpy.array( srcids, dtype=numpy.int64 )[dex] }
+
+
+def build_index( tarpath, overwrite=False ):
+    """Write the index file for one alert tarball.
+
+    Returns the number of alerts indexed, or None if the index was
+    already there (and overwrite is False).
+
+    """
+    tarpath = pathlib.Path( tarpath )
+    idxpath = index_path( tarpath )
+    if ( not overwrite ) and ( read_index( tarpath ) is not None ):
+        return None
+
+    index = index_tarball( tarpath )
+    tmppath = idxpath.parent / f".{idxpath.name}.tmp.npz"
+    tarstat = tarpath.stat()
+    try:
+        numpy.savez( tmppath, version=_index_version, tarsize=tarstat.st_size, tarmtime=tarstat.st_mtime_ns,
+                     **index )
+        tmppath.replace( idxpath )
+    finally:
+        tmppath.unlink( missing_ok=True )
+    return len( index['name'] )
+
+
+def read_index( tarpath ):
+    """Read the index of tarball tarpath.
+
+    Returns a dict of column name -> numpy array (see the top of this
+    file), or None if there's no usable index for the tarball.
+
+    """
+    tarpath = pathlib.Path( tarpath )
+    idxpath = index_path( tarpath )
+    if not idxpath.is_file():
+        return None
+    try:
+        tarstat = tarpath.stat()
+        with numpy.load( idxpath ) as npz:
+            if ( ( int( npz['version'] ) != _index_version )
+                 or ( int( npz['tarsize'] ) != tarstat.st_size )
+                 or ( int( npz['tarmtime'] ) != tarstat.st_mtime_ns ) ):
+                _logger.warning( f"{idxpath} is out of date with {tarpath.name}, ignoring it." )
+                return None
+            return { k: npz[k] for k in ( 'name', 'offset', 'size', 'mjd', 'objectId', 'sourceId' ) }
+    except Exception as ex:
+        _logger.warning( f"Failed to read {idxpath}, ignoring it: {ex}" )
+        return None
+
+
+def read_indexed_members( tarpath, index ):
+    """Read the data of the members of tarball tarpath listed in index.
+
+    Seeks straight to each member instead of walking the tar headers.
+    The members are read in the order they are in the tarball, so a
+    compressed tarball is still only decompressed once, front to back.
+
+    Returns a list of bytes, in the same order as the index.
+
+    """
+    data = [ None ] * len( index['name'] )
+    order = numpy.argsort( index['offset'], kind='stable' )
+    tarpath = pathlib.Path( tarpath )
+    opener = gzip.open if tarpath.name.endswith( ".gz" ) else open
+    with opener( tarpath, "rb" ) as fileobj:
+        for i in order:
+            fileobj.seek( int( index['offset'][i] ) )
+            data[i] = fileobj.read( int( index['size'][i] ) )
+    return data
+
+
+def find_tarballs( paths ):
+    """NITE*.tar.gz files in paths, which are files or directories to search recursively."""
+    tarpaths = []
+    for path in paths:
+        path = pathlib.Path( path )
+        if path.is_dir():
+            tarpaths.extend( sorted( path.glob( "**/NITE*.tar.gz" ) ) )
+        else:
+            tarpaths.append( path )
+    return tarpaths
+
+
+def main():
+    parser = argparse.ArgumentParser( description="Write index files for ELAsTiCC alert tarballs, "
+                                      "so that stream-to-zads.py doesn't have to list them.",
+                                      formatter_class=argparse.ArgumentDefaultsHelpFormatter )
+    parser.add_argument( "paths", nargs='+',
+                         help="NITE*.tar.gz files, or directories to search (recursively) for them" )
+    parser.add_argument( "-n", "--processes", type=int, default=1, help="Number of tarballs to index at once" )
+    parser.add_argument( "--overwrite", action='store_true', default=False,
+                         help="Rewrite indexes that are already there and up to date" )
+    args = parser.parse_args()
+
+    tarpaths = find_tarballs( args.paths )
+    _logger.info( f"Indexing {len(tarpaths)} tarballs" )
+    failed = []
+    with concurrent.futures.ProcessPoolExecutor( max_workers=max( args.processes, 1 ) ) as pool:
+        futures = { pool.submit( build_index, tarpath, args.overwrite ): tarpath for tarpath in tarpaths }
+        for future in concurrent.futures.as_completed( futures ):
+            tarpath = futures[future]
+            try:
+                nindexed = future.result()
+                if nindexed is None:
+                    _logger.info( f"{tarpath} already indexed" )
+                else:
+                    _logger.info( f"Indexed {nindexed} alerts in {tarpath}" )
+            except Exception as ex:
+                _logger.exception( f"Failed indexing {tarpath}: {ex}" )
+                failed.append( tarpath )
+
+    if len( failed ) > 0:
+        _logger.error( f"Failed to index {len(failed)} tarballs" )
+        sys.exit( 1 )
+
+
+# ======================================================================
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,76 @@
+# Compare reading a PHOT file with astropy (the old path) against the
+#   native FITSBinTable reader.  By default writes a synthetic PHOT
+#   file about the size of one of the bigger ELAsTiCC2 PHOT files; pass
+#   --photfile to time an actual file instead.
+#
+# Run from the lib_elasticc2 directory with
+#   PYTHONPATH=$PWD:$PYTHONPATH python benchmarks/bench_fits_decode.py
+
+import time
+import gzip
+import shutil
+import pathlib
+import argparse
+import tempfile
+
+import numpy
+from astropy.table import Table
+
+from read_snana import _read_phot_file
+
+
+def write_synthetic_phot( path, nrows, seed=42 ):
+    rng = numpy.random.default_rng( seed )
+    tab = Table()
+    tab['MJD'] = rng.uniform( 60796., 61896., nrows )
+    tab['BAND'] = rng.choice( [ b'u ', b'g ', b'r ', b'i ', b'z ', b'Y ' ], nrows ).astype( 'S2' )
+    tab['CCDNUM'] = numpy.zeros( nrows, dtype=numpy.int16 )
+    tab['FIELD'] = numpy.full( nrows, b'VOID', dtype='S4' )
+    tab['PHOTFLAG'] = rng.choice( [ 0, 4096, 4096|2048 ], nrows ).astype( numpy.int32 )
+    for col in [ 'PHOTPROB', 'FLUXCAL', 'FLUXCALERR', 'PSF_SIG1', 'PSF_SIG2', 'PSF_RATIO', 'SKY_SIG',
+                 'SKY_SIG_T', 'RDNOISE', 'ZEROPT', 'ZEROPT_ERR', 'GAIN', 'XPIX', 'YPIX', 'SIM_MAGOBS' ]:
+        tab[col] = rng.normal( 1., 0.1, nrows ).astype( numpy.float32 )
+    tab.write( path, overwrite=True )
+
+
+def main():
+    parser = argparse.ArgumentParser( description="Benchmark PHOT file decoding",
+                                      formatter_class=argparse.ArgumentDefaultsHelpFormatter )
+    parser.add_argument( "-n", "--nrows", type=int, default=5000000, help="Rows in the synthetic PHOT file" )
+    parser.add_argument( "-p", "--photfile", default=None, help="Time this PHOT file instead of a synthetic one" )
+    parser.add_argument( "-z", "--gzip", action='store_true', default=False, help="gzip the synthetic file" )
+    parser.add_argument( "-r", "--repeats", type=int, default=3, help="Number of times to time each method" )
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+        if args.photfile is not None:
+            photfile = pathlib.Path( args.photfile )
+        else:
+            photfile = pathlib.Path( tmpdir ) / "SYNTHETIC_PHOT.FITS"
+            print( f"Writing synthetic PHOT file with {args.nrows} rows..." )
+            write_synthetic_phot( photfile, args.nrows )
+            if args.gzip:
+                with open( photfile, 'rb' ) as ifp, gzip.open( f'{photfile}.gz', 'wb' ) as ofp:
+                    shutil.copyfileobj( ifp, ofp )
+                photfile.unlink()
+                photfile = pathlib.Path( f'{photfile}.gz' )
+        print( f"{photfile.name}: {photfile.stat().st_size/1024/1024:.1f} MiB" )
+
+        times = {}
+        results = {}
+        for reader in [ 'astropy', 'native' ]:
+            dts = []
+            for i in range( args.repeats ):
+                t0 = time.perf_counter()
+                results[reader] = _read_phot_file( photfile, fits_reader=reader )
+                dts.append( time.perf_counter() - t0 )
+            times[reader] = min( dts )
+            print( f"{reader:>8s}: {times[reader]:.3f} s (best of {args.repeats})" )
+
+        assert results['astropy'].equals( results['native'] )
+        print( f"Speedup: {times['astropy']/times['native']:.1f}x" )
+
+
+# ======================================================================
+if __name__ == "__main__":
+    main()
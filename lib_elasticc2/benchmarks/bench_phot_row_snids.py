@@ -0,0 +1,76 @@
+# Compare the old per-object python loop for assigning SNIDs to PHOT
+#   rows against the vectorized _phot_row_snids.  Uses a synthetic PHOT
+#   file layout (objects separated by one -777 row each, like SNANA
+#   writes), so it doesn't need any of the actual ELAsTiCC2 data.
+#
+# Run from the lib_elasticc2 directory with
+#   PYTHONPATH=$PWD:$PYTHONPATH python benchmarks/bench_phot_row_snids.py
+
+import time
+import argparse
+
+import numpy
+import polars
+
+from read_snana import _phot_row_snids
+
+
+def synthetic_head( nobj, meanobs, seed=42 ):
+    rng = numpy.random.default_rng( seed )
+    nobs = rng.integers( meanobs // 2, 3 * meanobs // 2, size=nobj )
+    # Each object is followed by one separator row
+    ptrmin = numpy.cumsum( numpy.concatenate( [ [1], nobs[:-1] + 1 ] ) )
+    ptrmax = ptrmin + nobs - 1
+    snids = rng.permutation( nobj ).astype( numpy.int64 ) * 10 + 1000000
+    head = polars.DataFrame( { 'SNID': snids, 'PTROBS_MIN': ptrmin.astype( numpy.int32 ),
+                               'PTROBS_MAX': ptrmax.astype( numpy.int32 ) } )
+    nrows = int( ptrmax[-1] ) + 1
+    return head, nrows
+
+
+def old_loop( head ):
+    snids = []
+    for row in head.iter_rows( named=True ):
+        ptrmin = row['PTROBS_MIN'] - 1
+        ptrmax = row['PTROBS_MAX']
+        snids.extend( [row['SNID']] * (ptrmax-ptrmin) )
+        snids.append( -999 )
+    return polars.Series( name='SNID', values=snids )
+
+
+def vectorized( head, nrows ):
+    return polars.Series( name='SNID', values=_phot_row_snids( nrows, head['PTROBS_MIN'].to_numpy(),
+                                                               head['PTROBS_MAX'].to_numpy(),
+                                                               head['SNID'].to_numpy() ) )
+
+
+def main():
+    parser = argparse.ArgumentParser( description="Benchmark SNID assignment for one PHOT file",
+                                      formatter_class=argparse.ArgumentDefaultsHelpFormatter )
+    parser.add_argument( "-n", "--nobj", type=int, default=50000, help="Number of objects in the file" )
+    parser.add_argument( "-m", "--meanobs", type=int, default=200, help="Mean number of points per object" )
+    parser.add_argument( "-r", "--repeats", type=int, default=3, help="Number of times to time each method" )
+    args = parser.parse_args()
+
+    head, nrows = synthetic_head( args.nobj, args.meanobs )
+    print( f"Synthetic PHOT file: {args.nobj} objects, {nrows} rows" )
+
+    times = {}
+    results = {}
+    for name, func in [ ( 'loop', lambda: old_loop( head ) ),
+                        ( 'vectorized', lambda: vectorized( head, nrows ) ) ]:
+        dts = []
+        for i in range( args.repeats ):
+            t0 = time.perf_counter()
+            results[name] = func()
+            dts.append( time.perf_counter() - t0 )
+        times[name] = min( dts )
+        print( f"{name:>12s}: {times[name]:.4f} s (best of {args.repeats})" )
+
+    assert ( results['loop'] == results['vectorized'] ).all()
+    print( f"Speedup: {times['loop']/times['vectorized']:.1f}x" )
+
+
+# ======================================================================
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,166 @@
+# Time the main elasticc2_snana_reader read paths (get_head,
+#   get_object_truth, get_ltcv, get_all_ltcvs with and without agg) on
+#   synthetic data written by synthetic_snana.py, so that performance
+#   regressions can be caught without the actual ELAsTiCC2 files.  By
+#   default, does it for both gzipped and uncompressed files.  Pass
+#   --datadir to time an existing directory of SNANA files instead.
+#
+# Use --save to write the timings to a JSON file, and --compare to check
+#   against a file saved earlier; with --compare, the exit status is 1 if
+#   anything got slower by more than --tolerance.
+#
+# Run from the lib_elasticc2 directory with
+#   PYTHONPATH=$PWD:$PYTHONPATH python benchmarks/bench_read_snana.py
+
+import sys
+import json
+import time
+import logging
+import pathlib
+import argparse
+import tempfile
+
+import numpy
+import polars
+
+from read_snana import elasticc2_snana_reader, _logger
+import fits_bintable
+from synthetic_snana import write_dataset
+
+
+def best_time( func, repeats ):
+    """Run func repeats times; return ( best time in seconds, last return value )."""
+    dts = []
+    for i in range( repeats ):
+        t0 = time.perf_counter()
+        ret = func()
+        dts.append( time.perf_counter() - t0 )
+    return min( dts ), ret
+
+
+def run_benchmarks( datadir, dir_prefix, obj_class_name, repeats, nltcv ):
+    """Time each read path on one class; returns a dictionary of name -> seconds."""
+    times = {}
+
+    def reader( **kwargs ):
+        return elasticc2_snana_reader( datadir, dir_prefix=dir_prefix, parquet_dir=None, **kwargs )
+
+    # Fresh readers, so nothing is cached
+    times['get_head'], head = best_time( lambda: reader().get_head( obj_class_name ), repeats )
+    times['get_object_truth'], truth = best_time( lambda: reader().get_object_truth( obj_class_name ), repeats )
+    with tempfile.TemporaryDirectory() as cachedir:
+        reader( head_cache_dir=cachedir ).get_head( obj_class_name )
+        times['get_head (disk cache)'], _ = best_time(
+            lambda: reader( head_cache_dir=cachedir ).get_head( obj_class_name ), repeats )
+
+    # One reader from here on, with the HEAD table and SNID index already loaded
+    #   (and gzip indexes built), to time the steady state
+    esr = reader()
+    if fits_bintable.indexed_gzip is not None:
+        esr.build_gzip_indexes( obj_class_name )
+    rng = numpy.random.default_rng( 42 )
+    snids = rng.choice( head['SNID'].to_numpy(), size=min( nltcv, len( head ) ), replace=False )
+    esr.get_ltcv( obj_class_name, snids[0] )
+
+    # Objects in the order they are in the files, like a viewer stepping through them
+    insorted = head.filter( polars.col('SNID').is_in( snids ) )['SNID'].to_list()
+    dt, _ = best_time( lambda: [ esr.get_ltcv( obj_class_name, s ) for s in insorted ], repeats )
+    times['get_ltcv (per object, file order)'] = dt / len( insorted )
+    dt, _ = best_time( lambda: [ esr.get_ltcv( obj_class_name, s ) for s in snids ], repeats )
+    times['get_ltcv (per object, random)'] = dt / len( snids )
+    times['get_ltcvs'], _ = best_time( lambda: esr.get_ltcvs( obj_class_name, snids ), repeats )
+
+    times['get_all_ltcvs'], ltcvs = best_time( lambda: esr.get_all_ltcvs( obj_class_name ), repeats )
+    times['get_all_ltcvs (agg)'], _ = best_time( lambda: esr.get_all_ltcvs( obj_class_name, agg=True ), repeats )
+    times['get_all_ltcvs (agg, header, truth)'], _ = best_time(
+        lambda: esr.get_all_ltcvs( obj_class_name, agg=True, include_header=True, include_truth=True ), repeats )
+    times['get_all_ltcvs (4 columns)'], _ = best_time(
+        lambda: esr.get_all_ltcvs( obj_class_name, columns=[ 'MJD', 'BAND', 'FLUXCAL', 'FLUXCALERR' ] ), repeats )
+
+    # Make sure we timed something sensible
+    snid = int( snids[0] )
+    one = esr.get_ltcv( obj_class_name, snid ).sort( [ 'BAND', 'MJD' ] )
+    assert one.equals( ltcvs.filter( polars.col('SNID') == snid ).drop( 'SNID' ).select( one.columns ) )
+    assert len( ltcvs ) == head['NOBS'].sum()
+    assert len( truth ) == len( head )
+
+    return times
+
+
+def main():
+    parser = argparse.ArgumentParser( description="Benchmark elasticc2_snana_reader read paths",
+                                      formatter_class=argparse.ArgumentDefaultsHelpFormatter )
+    parser.add_argument( "-d", "--datadir", default=None,
+                         help="Time this directory of SNANA files instead of writing synthetic ones" )
+    parser.add_argument( "-p", "--dir-prefix", default="ELASTICC2_FINAL_", help="Prefix of the class directories" )
+    parser.add_argument( "-c", "--obj-class", default=None,
+                         help="Class to time (default: the first one with --datadir, CART for synthetic data)" )
+    parser.add_argument( "-f", "--files", type=int, default=4, help="Synthetic PHOT files in the class" )
+    parser.add_argument( "-n", "--objects-per-file", type=int, default=2500, help="Synthetic objects per file" )
+    parser.add_argument( "-m", "--mean-points", type=int, default=100,
+                         help="Average synthetic lightcurve points per object" )
+    parser.add_argument( "--formats", nargs='+', default=[ 'gzip', 'plain' ], choices=[ 'gzip', 'plain' ],
+                         help="Synthetic file formats to time" )
+    parser.add_argument( "-l", "--nltcv", type=int, default=200, help="Number of objects for get_ltcv(s)" )
+    parser.add_argument( "-r", "--repeats", type=int, default=3, help="Number of times to time each thing" )
+    parser.add_argument( "-s", "--save", default=None, help="Save timings to this JSON file" )
+    parser.add_argument( "--compare", default=None, help="Compare timings to this JSON file (from --save)" )
+    parser.add_argument( "-t", "--tolerance", type=float, default=0.25,
+                         help="With --compare, fractional slowdown that counts as a regression" )
+    args = parser.parse_args()
+
+    _logger.setLevel( logging.WARNING )
+
+    results = {}
+    with tempfile.TemporaryDirectory() as tmpdir:
+        if args.datadir is not None:
+            esr = elasticc2_snana_reader( args.datadir, dir_prefix=args.dir_prefix, parquet_dir=None )
+            cls = args.obj_class if args.obj_class is not None else esr.obj_class_names[0]
+            datasets = { 'data': ( pathlib.Path( args.datadir ), cls ) }
+        else:
+            cls = args.obj_class if args.obj_class is not None else 'CART'
+            datasets = {}
+            for fmt in args.formats:
+                datadir = pathlib.Path( tmpdir ) / fmt
+                print( f"Writing synthetic {fmt} data to {datadir}..." )
+                write_dataset( datadir, classes=[ cls ], nfiles=args.files, objects_per_file=args.objects_per_file,
+                               mean_points=args.mean_points, gzip_files=( fmt == 'gzip' ),
+                               dir_prefix=args.dir_prefix )
+                datasets[fmt] = ( datadir, cls )
+
+        for name, ( datadir, cls ) in datasets.items():
+            print( f"Timing {name} ({cls})..." )
+            times = run_benchmarks( datadir, args.dir_prefix, cls, args.repeats, args.nltcv )
+            for key, dt in times.items():
+                results[ f"{name}: {key}" ] = dt
+
+    baseline = None
+    if args.compare is not None:
+        with open( args.compare ) as ifp:
+            baseline = json.load( ifp )
+
+    width = max( len( k ) for k in results.keys() )
+    regressions = []
+    for key, dt in results.items():
+        line = f"{key:<{width}s} {dt*1000:10.2f} ms"
+        if ( baseline is not None ) and ( key in baseline ):
+            ratio = dt / baseline[key]
+            line += f"   {ratio:5.2f}x baseline"
+            if ratio > 1. + args.tolerance:
+                line += "  SLOWER"
+                regressions.append( key )
+        print( line )
+
+    if args.save is not None:
+        with open( args.save, "w" ) as ofp:
+            json.dump( results, ofp, indent=2 )
+        print( f"Saved timings to {args.save}" )
+
+    if len( regressions ) > 0:
+        print( f"{len(regressions)} timings are more than {args.tolerance:.0%} slower than {args.compare}" )
+        sys.exit( 1 )
+
+
+# ======================================================================
+if __name__ == "__main__":
+    main()
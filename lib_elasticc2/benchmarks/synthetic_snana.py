@@ -0,0 +1,264 @@
+# Write synthetic ELAsTiCC2-like SNANA files (HEAD, PHOT, and DUMP) so
+#   the readers can be exercised and timed without the actual data.
+#
+# The layout matches what elasticc2_snana_reader expects:
+#
+#   {outdir}/{dir_prefix}{class}/{dir_prefix}NONIaMODEL0-{num}_HEAD.FITS[.gz]
+#   {outdir}/{dir_prefix}{class}/{dir_prefix}NONIaMODEL0-{num}_PHOT.FITS[.gz]
+#   {outdir}/{dir_prefix}{class}/{dir_prefix}{class}.DUMP
+#
+# PHOT files have every object's points followed by a separator row with
+#   MJD=-777, and HEAD files point at them with 1-offset PTROBS_MIN and
+#   PTROBS_MAX, the way SNANA writes them.  SNIDs are fixed-width strings
+#   in HEAD files, and objects aren't in SNID order.  The lightcurves are
+#   a gaussian bump on top of noise, with PHOTFLAG detect bits set where
+#   the S/N is above 5, a trigger bit on the first detection of each
+#   object, and the occasional saturated point.  The DUMP file has
+#   comment lines, a VARNAMES line, and one SN: line per object.
+#
+# Run from the lib_elasticc2 directory with
+#   PYTHONPATH=$PWD:$PYTHONPATH python benchmarks/synthetic_snana.py -o <outdir>
+
+import gzip
+import shutil
+import pathlib
+import argparse
+
+import numpy
+from astropy.table import Table
+
+
+# A few of the actual ELAsTiCC2 class names, used in order
+class_names = [ 'AGN', 'CART', 'Cepheid', 'EB', 'ILOT', 'KN_B19', 'Mdwarf-flare', 'PISN-MOSFIT',
+                'SLSN-I+host', 'SNIa-SALT3', 'SNII-Templates', 'TDE' ]
+
+_bands = [ 'u', 'g', 'r', 'i', 'z', 'Y' ]
+
+# Extra float32 PHOT columns, in the order SNANA writes them
+_phot_float_columns = [ 'PSF_SIG1', 'PSF_SIG2', 'PSF_RATIO', 'SKY_SIG', 'SKY_SIG_T', 'RDNOISE', 'ZEROPT',
+                        'ZEROPT_ERR', 'GAIN', 'XPIX', 'YPIX' ]
+
+
+def _write_fits( tab, path, gzip_files ):
+    if gzip_files:
+        tmppath = path.parent / f"{path.name}.tmp"
+        tab.write( tmppath, format='fits', overwrite=True )
+        with open( tmppath, 'rb' ) as ifp, gzip.open( f"{path}.gz", 'wb', compresslevel=6 ) as ofp:
+            shutil.copyfileobj( ifp, ofp )
+        tmppath.unlink()
+    else:
+        tab.write( path, format='fits', overwrite=True )
+
+
+def _make_file( rng, snids, mean_points, sim_type_index ):
+    """Make the HEAD and PHOT tables for one pair of files.  Returns ( head, phot, truth dict )."""
+    nobj = len( snids )
+    nobs = rng.integers( max( mean_points // 2, 1 ), 3 * mean_points // 2 + 1, size=nobj )
+    # Each object's points are followed by one separator row
+    ptrmin = numpy.cumsum( numpy.concatenate( [ [ 1 ], nobs[:-1] + 1 ] ) )
+    ptrmax = ptrmin + nobs - 1
+    nrows = int( ptrmax[-1] ) + 1
+
+    obj = numpy.repeat( numpy.arange( nobj ), nobs + 1 )
+    pos = numpy.arange( nrows ) - numpy.repeat( ptrmin - 1, nobs + 1 )
+    sep = pos == numpy.repeat( nobs, nobs + 1 )
+
+    # Points at a roughly regular cadence, so MJD increases within each object
+    cadence = rng.uniform( 1., 5., nobj )
+    start = rng.uniform( 60796., 61896. - ( cadence * nobs ).clip( max=1000. ), nobj )
+    mjd = start[ obj ] + pos * cadence[ obj ] + rng.uniform( 0., 0.5, nrows )
+    peakmjd = start + rng.uniform( 0.2, 0.8, nobj ) * cadence * nobs
+    width = rng.uniform( 10., 60., nobj )
+    amp = 10 ** rng.uniform( 1.5, 4.5, nobj )
+    model = amp[ obj ] * numpy.exp( -0.5 * ( ( mjd - peakmjd[ obj ] ) / width[ obj ] ) ** 2 )
+    fluxerr = rng.uniform( 5., 25., nrows )
+    flux = model + rng.normal( 0., 1., nrows ) * fluxerr
+
+    detect = ( flux / fluxerr > 5. ) & ~sep
+    photflag = numpy.where( detect, 4096, 0 )
+    detrows = numpy.nonzero( detect )[0]
+    _, first = numpy.unique( obj[ detrows ], return_index=True )
+    photflag[ detrows[ first ] ] |= 2048
+    photflag[ detect & ( rng.random( nrows ) < 0.002 ) ] |= 1024
+
+    band = numpy.array( _bands )[ rng.integers( 0, len( _bands ), nrows ) ]
+    simmag = numpy.where( model > 1e-3, 27.5 - 2.5 * numpy.log10( numpy.maximum( model, 1e-3 ) ), 99. )
+
+    mjd[ sep ] = -777.
+    band[ sep ] = '-'
+    flux[ sep ] = 0.
+    fluxerr[ sep ] = 0.
+    photflag[ sep ] = 0
+    simmag[ sep ] = 0.
+
+    phot = Table()
+    phot['MJD'] = mjd
+    phot['BAND'] = numpy.char.ljust( band, 2 ).astype( 'S2' )
+    phot['CCDNUM'] = numpy.where( sep, 0, rng.integers( 1, 190, nrows ) ).astype( numpy.int16 )
+    phot['FIELD'] = numpy.full( nrows, b'VOID', dtype='S20' )
+    phot['PHOTFLAG'] = photflag.astype( numpy.int32 )
+    phot['PHOTPROB'] = numpy.zeros( nrows, dtype=numpy.float32 )
+    phot['FLUXCAL'] = flux.astype( numpy.float32 )
+    phot['FLUXCALERR'] = fluxerr.astype( numpy.float32 )
+    for col in _phot_float_columns:
+        phot[col] = numpy.where( sep, 0., rng.normal( 1., 0.1, nrows ) ).astype( numpy.float32 )
+    phot['SIM_MAGOBS'] = simmag.astype( numpy.float32 )
+
+    redshift = rng.uniform( 0.01, 1.5, nobj )
+    ra = rng.uniform( 0., 360., nobj )
+    dec = numpy.degrees( numpy.arcsin( rng.uniform( -1., 0.05, nobj ) ) )
+    mwebv = rng.uniform( 0., 0.2, nobj )
+    peakmag = { b: 27.5 - 2.5 * numpy.log10( amp ) + rng.normal( 0., 0.3, nobj ) for b in _bands }
+
+    head = Table()
+    head['SNID'] = numpy.char.ljust( snids.astype( str ), 16 ).astype( 'S16' )
+    head['IAUC'] = numpy.full( nobj, b'NULL', dtype='S16' )
+    head['FAKE'] = numpy.full( nobj, 2, dtype=numpy.int16 )
+    head['RA'] = ra
+    head['DEC'] = dec
+    head['PIXSIZE'] = numpy.full( nobj, 0.2, dtype=numpy.float32 )
+    head['NXPIX'] = numpy.full( nobj, -9, dtype=numpy.int16 )
+    head['NYPIX'] = numpy.full( nobj, -9, dtype=numpy.int16 )
+    head['SNTYPE'] = numpy.zeros( nobj, dtype=numpy.int32 )
+    head['NOBS'] = nobs.astype( numpy.int32 )
+    head['PTROBS_MIN'] = ptrmin.astype( numpy.int32 )
+    head['PTROBS_MAX'] = ptrmax.astype( numpy.int32 )
+    head['MWEBV'] = mwebv.astype( numpy.float32 )
+    head['MWEBV_ERR'] = ( 0.16 * mwebv ).astype( numpy.float32 )
+    head['REDSHIFT_HELIO'] = redshift.astype( numpy.float32 )
+    head['REDSHIFT_HELIO_ERR'] = numpy.full( nobj, -9., dtype=numpy.float32 )
+    head['REDSHIFT_FINAL'] = redshift.astype( numpy.float32 )
+    head['REDSHIFT_FINAL_ERR'] = numpy.full( nobj, -9., dtype=numpy.float32 )
+    head['HOSTGAL_OBJID'] = ( snids * 10 + 1 ).astype( numpy.int64 )
+    head['HOSTGAL_PHOTOZ'] = ( redshift + rng.normal( 0., 0.05, nobj ) ).astype( numpy.float32 )
+    head['HOSTGAL_PHOTOZ_ERR'] = numpy.full( nobj, 0.05, dtype=numpy.float32 )
+    head['HOSTGAL_SNSEP'] = rng.uniform( 0., 5., nobj ).astype( numpy.float32 )
+    for b in _bands:
+        head[f'HOSTGAL_MAG_{b}'] = rng.uniform( 20., 27., nobj ).astype( numpy.float32 )
+    head['SEARCH_TYPE'] = numpy.full( nobj, -9, dtype=numpy.int32 )
+    head['SIM_MODEL_NAME'] = numpy.full( nobj, b'NONIaMODEL0', dtype='S32' )
+    head['SIM_TYPE_INDEX'] = numpy.full( nobj, sim_type_index, dtype=numpy.int32 )
+    head['SIM_LIBID'] = rng.integers( 1, 100000, nobj ).astype( numpy.int32 )
+    head['SIM_REDSHIFT_CMB'] = redshift.astype( numpy.float32 )
+    head['SIM_RA'] = ra
+    head['SIM_DEC'] = dec
+    head['SIM_MWEBV'] = mwebv.astype( numpy.float32 )
+    head['SIM_PEAKMJD'] = peakmjd.astype( numpy.float32 )
+    for b in _bands:
+        head[f'SIM_PEAKMAG_{b}'] = peakmag[b].astype( numpy.float32 )
+
+    truth = { 'CID': snids, 'GENTYPE': numpy.full( nobj, sim_type_index ), 'ZCMB': redshift,
+              'RA': ra, 'DEC': dec, 'MWEBV': mwebv, 'PEAKMJD': peakmjd, 'NOBS': nobs,
+              **{ f'PEAKMAG_{b}': peakmag[b] for b in _bands } }
+    return head, phot, truth
+
+
+def write_class( outdir, obj_class_name, nfiles=4, objects_per_file=1000, mean_points=100, gzip_files=True,
+                 dir_prefix='ELASTICC2_FINAL_', seed=42, first_snid=1000 ):
+    """Write the HEAD, PHOT, and DUMP files for one synthetic class.
+
+    Parameters
+    ----------
+      outdir : str or Path
+        The top directory (elasticc2_snana_dir for the reader).  The
+        class subdirectory is made in here.
+
+      obj_class_name : str
+        Name of the class
+
+      nfiles : int
+        Number of HEAD/PHOT file pairs
+
+      objects_per_file : int
+        Number of objects in each file pair
+
+      mean_points : int
+        Average number of lightcurve points per object; each object has
+        between half and one and a half times this.
+
+      gzip_files : bool
+        Write .FITS.gz files (as the ELAsTiCC2 release does) instead of
+        .FITS
+
+      dir_prefix : str
+        Prefix of the class subdirectory and of the files
+
+      seed : int
+        Random seed
+
+      first_snid : int
+        SNIDs of this class are first_snid up to (but not including)
+        first_snid + nfiles * objects_per_file
+
+    Returns
+    -------
+      The number of objects written
+
+    """
+    rng = numpy.random.default_rng( seed )
+    classdir = pathlib.Path( outdir ) / f"{dir_prefix}{obj_class_name}"
+    classdir.mkdir( parents=True, exist_ok=True )
+
+    truths = []
+    for num in range( 1, nfiles + 1 ):
+        # Objects aren't written in SNID order
+        snids = rng.permutation( numpy.arange( objects_per_file ) ) + first_snid + ( num - 1 ) * objects_per_file
+        head, phot, truth = _make_file( rng, snids, mean_points, 10 + class_names.index( obj_class_name )
+                                        if obj_class_name in class_names else 99 )
+        base = f"{dir_prefix}NONIaMODEL0-{num:04d}"
+        _write_fits( head, classdir / f"{base}_HEAD.FITS", gzip_files )
+        _write_fits( phot, classdir / f"{base}_PHOT.FITS", gzip_files )
+        truths.append( truth )
+
+    varnames = list( truths[0].keys() )
+    with open( classdir / f"{dir_prefix}{obj_class_name}.DUMP", "w" ) as ofp:
+        ofp.write( f"# Synthetic {obj_class_name} truth file\n" )
+        ofp.write( "#   written by synthetic_snana.py\n\n" )
+        ofp.write( f"VARNAMES: {' '.join( varnames )}\n" )
+        for truth in truths:
+            for i in range( len( truth['CID'] ) ):
+                vals = [ f"{truth[v][i]:d}" if numpy.issubdtype( truth[v].dtype, numpy.integer )
+                         else f"{truth[v][i]:.5f}" for v in varnames ]
+                ofp.write( f"SN:  {'  '.join( vals )}\n" )
+
+    return nfiles * objects_per_file
+
+
+def write_dataset( outdir, classes=None, nfiles=4, objects_per_file=1000, mean_points=100, gzip_files=True,
+                   dir_prefix='ELASTICC2_FINAL_', seed=42 ):
+    """Write several synthetic classes (see write_class); classes defaults to the first three of class_names.
+
+    Returns the total number of objects written.
+
+    """
+    classes = class_names[ :3 ] if classes is None else classes
+    nobj = 0
+    for i, cls in enumerate( classes ):
+        nobj += write_class( outdir, cls, nfiles=nfiles, objects_per_file=objects_per_file,
+                             mean_points=mean_points, gzip_files=gzip_files, dir_prefix=dir_prefix,
+                             seed=seed + i, first_snid=1000 + nobj )
+    return nobj
+
+
+def main():
+    parser = argparse.ArgumentParser( description="Write synthetic ELAsTiCC2 SNANA files",
+                                      formatter_class=argparse.ArgumentDefaultsHelpFormatter )
+    parser.add_argument( "-o", "--outdir", required=True, help="Directory to write to" )
+    parser.add_argument( "-c", "--classes", nargs='+', default=class_names[ :3 ], help="Classes to write" )
+    parser.add_argument( "-f", "--files", type=int, default=4, help="HEAD/PHOT file pairs per class" )
+    parser.add_argument( "-n", "--objects-per-file", type=int, default=1000, help="Objects per file" )
+    parser.add_argument( "-m", "--mean-points", type=int, default=100, help="Average lightcurve points per object" )
+    parser.add_argument( "-p", "--dir-prefix", default="ELASTICC2_FINAL_", help="Prefix of directories and files" )
+    parser.add_argument( "--no-gzip", action='store_true', default=False, help="Write .FITS instead of .FITS.gz" )
+    parser.add_argument( "-s", "--seed", type=int, default=42, help="Random seed" )
+    args = parser.parse_args()
+
+    nobj = write_dataset( args.outdir, classes=args.classes, nfiles=args.files,
+                          objects_per_file=args.objects_per_file, mean_points=args.mean_points,
+                          gzip_files=not args.no_gzip, dir_prefix=args.dir_prefix, seed=args.seed )
+    print( f"Wrote {nobj} objects in {len(args.classes)} classes to {args.outdir}" )
+
+
+# ======================================================================
+if __name__ == "__main__":
+    main()
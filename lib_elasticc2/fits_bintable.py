@@ -0,0 +1,327 @@
+import os
+import re
+import gzip
+import pathlib
+import threading
+
+import numpy
+import pyarrow
+
+try:
+    import indexed_gzip
+except ImportError:
+    indexed_gzip = None
+
+# Uncompressed bytes between seek points in a gzip index.  Reading any
+#   range of rows inflates at most this much more than the rows
+#   themselves; the index itself is about 1/32 of the uncompressed size.
+_gzip_index_spacing = 1024 * 1024
+
+
+def build_gzip_index( path, index_path, spacing=_gzip_index_spacing ):
+    """Build a random-access index for a gzipped file and save it to index_path.
+
+    This has to inflate the whole file once.  After that, FITSBinTable
+    (given gzip_index=index_path) can read any range of rows by only
+    inflating the bit of the file that covers them.  Requires the
+    indexed_gzip package.  The index is written to a temporary file and
+    renamed into place, so a reader never sees a partial index.
+
+    """
+    if indexed_gzip is None:
+        raise RuntimeError( "Building a gzip index requires the indexed_gzip package" )
+    index_path = pathlib.Path( index_path )
+    tmppath = index_path.parent / f".{index_path.name}.{os.getpid()}.tmp"
+    try:
+        with indexed_gzip.IndexedGzipFile( str( path ), spacing=spacing ) as ifp:
+            ifp.build_full_index()
+            ifp.export_index( str( tmppath ) )
+        os.replace( tmppath, index_path )
+    finally:
+        tmppath.unlink( missing_ok=True )
+
+
+class FITSBinTable:
+    """Direct read access to the first BINTABLE extension of a FITS file.
+
+    This is a minimal replacement for astropy.io.fits for the one thing
+    the SNANA reader needs: getting columns of the binary table in a
+    HEAD or PHOT file into Arrow arrays.  The data unit is viewed as a
+    numpy structured array (memory-mapped if the file isn't gzipped),
+    and each requested column is byteswapped to native order in a single
+    vectorized copy.  Fixed-width string columns have their padding
+    stripped and are turned into Arrow string arrays without any
+    per-row Python.
+
+    A gzipped file is normally inflated into memory in its entirety.
+    If it has a random-access index (see build_gzip_index), reading a
+    range of rows only inflates the part of the file that holds them.
+
+    Several threads can read from the same FITSBinTable at once.
+
+    Only the TFORM types that show up in SNANA files (L, B, I, J, K, A,
+    E, D, with repeat counts) are supported, and TSCAL/TZERO aren't.
+    The constructor raises NotImplementedError for anything else, so
+    callers can fall back to astropy.
+
+    """
+
+    _blocksize = 2880
+    _tformre = re.compile( r'^\s*(?P<repeat>\d*)(?P<code>[LXBIJKAEDCMPQ])' )
+    _codes = { 'L': 'i1', 'B': 'u1', 'I': '>i2', 'J': '>i4', 'K': '>i8', 'E': '>f4', 'D': '>f8' }
+
+    def __init__( self, path, gzip_index=None, stream=False ):
+        """Open a FITS file.
+
+        Parameters
+        ----------
+          path : str or Path
+            The file to read.  If it ends in .gz, it's decompressed
+            into memory; otherwise, it's memory-mapped.
+
+          gzip_index : str or Path or None
+            An index file written by build_gzip_index for path.  If
+            given (and path is gzipped), the file isn't decompressed
+            up front; instead, each read seeks to and inflates only the
+            rows asked for.  Needs the indexed_gzip package.
+
+          stream : bool, default False
+            If True (and path is gzipped, without a gzip_index), the
+            file isn't decompressed up front either; it's read as a
+            gzip stream, so opening it only inflates the headers.
+            Reads work, but each one inflates the file from the start
+            up to the rows asked for, so this is for when you just want
+            the header or the columns.
+
+        """
+        self.path = pathlib.Path( path )
+        self._buffer = None
+        self._file = None
+        # Seeking and reading the gzip file has to happen together
+        self._file_lock = threading.Lock()
+        if self.path.name.endswith( '.gz' ):
+            if gzip_index is not None:
+                if indexed_gzip is None:
+                    raise RuntimeError( "Reading with a gzip index requires the indexed_gzip package" )
+                self._file = indexed_gzip.IndexedGzipFile( str( self.path ), spacing=_gzip_index_spacing,
+                                                           index_file=str( gzip_index ), auto_build=False,
+                                                           drop_handles=False )
+            elif stream:
+                self._file = gzip.open( self.path, 'rb' )
+            else:
+                with gzip.open( self.path, 'rb' ) as ifp:
+                    self._buffer = numpy.frombuffer( ifp.read(), dtype=numpy.uint8 )
+        else:
+            self._buffer = numpy.memmap( self.path, dtype=numpy.uint8, mode='r' )
+
+        # Skip the primary HDU
+        offset = 0
+        header, offset = self._read_header( offset )
+        offset += self._padded( self._data_size( header ) )
+
+        # The first extension needs to be the table
+        header, offset = self._read_header( offset )
+        if header.get( 'XTENSION' ) != 'BINTABLE':
+            raise ValueError( f"First extension of {self.path} is {header.get('XTENSION')}, not BINTABLE" )
+        self.header = header
+        self.nrows = int( header['NAXIS2'] )
+        rowbytes = int( header['NAXIS1'] )
+
+        names = []
+        formats = []
+        offsets = []
+        self._strcols = set()
+        self._boolcols = set()
+        pos = 0
+        for i in range( 1, int( header['TFIELDS'] ) + 1 ):
+            if ( f'TSCAL{i}' in header ) or ( f'TZERO{i}' in header ):
+                raise NotImplementedError( f"TSCAL/TZERO not supported (column {i} of {self.path})" )
+            name = header[ f'TTYPE{i}' ]
+            match = self._tformre.search( header[ f'TFORM{i}' ] )
+            if match is None:
+                raise ValueError( f"Can't parse TFORM{i}={header[f'TFORM{i}']} in {self.path}" )
+            repeat = int( match.group('repeat') ) if len( match.group('repeat') ) > 0 else 1
+            code = match.group('code')
+            if code == 'A':
+                fmt = f'S{repeat}'
+                nbytes = repeat
+                self._strcols.add( name )
+            elif code in self._codes:
+                fmt = self._codes[code] if repeat == 1 else ( self._codes[code], ( repeat, ) )
+                nbytes = numpy.dtype( self._codes[code] ).itemsize * repeat
+                if code == 'L':
+                    self._boolcols.add( name )
+            else:
+                raise NotImplementedError( f"TFORM code {code} not supported (column {name} of {self.path})" )
+            names.append( name )
+            formats.append( fmt )
+            offsets.append( pos )
+            pos += nbytes
+        if pos != rowbytes:
+            raise ValueError( f"Columns add up to {pos} bytes, but NAXIS1={rowbytes} in {self.path}" )
+
+        self.columns = names
+        self.dtype = numpy.dtype( { 'names': names, 'formats': formats, 'offsets': offsets,
+                                    'itemsize': rowbytes } )
+        self._dataoffset = offset
+        if self._buffer is not None:
+            self.data = self._buffer[ offset : offset + rowbytes * self.nrows ].view( self.dtype )
+        else:
+            self.data = None
+
+    def _read_bytes( self, offset, nbytes ):
+        """Return nbytes of the (uncompressed) file starting at offset; may be short at EOF."""
+        if self._file is not None:
+            with self._file_lock:
+                self._file.seek( offset )
+                return self._file.read( nbytes )
+        return self._buffer[ offset : offset + nbytes ].tobytes()
+
+    def _read_header( self, offset ):
+        """Parse the header starting at byte offset.  Returns ( dict, offset of the data unit )."""
+        header = {}
+        while True:
+            block = self._read_bytes( offset, self._blocksize )
+            if len( block ) < self._blocksize:
+                raise ValueError( f"Ran out of file looking for END in {self.path}" )
+            block = block.decode( 'ascii' )
+            offset += self._blocksize
+            for i in range( 0, self._blocksize, 80 ):
+                card = block[ i : i+80 ]
+                key = card[ :8 ].strip()
+                if key == 'END':
+                    return header, offset
+                if card[ 8:10 ] != '= ':
+                    continue
+                val = card[ 10: ]
+                if val.lstrip().startswith( "'" ):
+                    # String value; '' is an escaped quote
+                    match = re.match( r"\s*'((?:[^']|'')*)'", val )
+                    header[ key ] = match.group(1).replace( "''", "'" ).rstrip()
+                else:
+                    header[ key ] = val.split( '/' )[0].strip()
+
+    def _data_size( self, header ):
+        naxis = int( header.get( 'NAXIS', 0 ) )
+        if naxis == 0:
+            return 0
+        size = abs( int( header['BITPIX'] ) ) // 8
+        for i in range( 1, naxis + 1 ):
+            size *= int( header[ f'NAXIS{i}' ] )
+        return int( header.get( 'GCOUNT', 1 ) ) * ( int( header.get( 'PCOUNT', 0 ) ) + size )
+
+    def _padded( self, nbytes ):
+        return ( ( nbytes + self._blocksize - 1 ) // self._blocksize ) * self._blocksize
+
+    @staticmethod
+    def _strings_to_arrow( arr ):
+        """Convert a numpy fixed-width bytes array to an Arrow string array, stripping spaces and NULs."""
+        n = len( arr )
+        width = arr.dtype.itemsize
+        if ( n == 0 ) or ( width == 0 ):
+            return pyarrow.array( [ '' ] * n, type=pyarrow.string() )
+        chars = numpy.ascontiguousarray( arr ).view( numpy.uint8 ).reshape( n, width )
+        notpad = ( chars != 0x20 ) & ( chars != 0x00 )
+        anychars = notpad.any( axis=1 )
+        starts = numpy.where( anychars, numpy.argmax( notpad, axis=1 ), 0 )
+        ends = numpy.where( anychars, width - numpy.argmax( notpad[ :, ::-1 ], axis=1 ), 0 )
+        pos = numpy.arange( width )
+        keep = ( pos[ numpy.newaxis, : ] >= starts[ :, numpy.newaxis ] ) & ( pos[ numpy.newaxis, : ] < ends[ :, numpy.newaxis ] )
+        data = chars[ keep ]
+        offsets = numpy.zeros( n+1, dtype=numpy.int32 )
+        numpy.cumsum( ends - starts, out=offsets[1:] )
+        return pyarrow.StringArray.from_buffers( n, pyarrow.py_buffer( offsets ), pyarrow.py_buffer( data ) )
+
+    def _read_rows( self, ptrmin=None, ptrmax=None, rows=None ):
+        """Read rows out of a gzip-indexed (or streamed) file as a structured array.
+
+        Only the span of rows from the lowest to the highest one asked
+        for is inflated.
+
+        """
+        if ptrmin is not None:
+            span = range( self.nrows )[ ptrmin:ptrmax ]
+            lo, hi = span.start, max( span.start, span.stop )
+        elif rows is not None:
+            rows = numpy.asarray( rows, dtype=numpy.int64 )
+            rows = numpy.where( rows < 0, rows + self.nrows, rows )
+            if len( rows ) == 0:
+                lo, hi = 0, 0
+            else:
+                lo, hi = int( rows.min() ), int( rows.max() ) + 1
+                if ( lo < 0 ) or ( hi > self.nrows ):
+                    raise IndexError( f"Row out of range for {self.nrows} rows in {self.path}" )
+        else:
+            lo, hi = 0, self.nrows
+
+        nbytes = ( hi - lo ) * self.dtype.itemsize
+        buf = self._read_bytes( self._dataoffset + lo * self.dtype.itemsize, nbytes )
+        if len( buf ) != nbytes:
+            raise ValueError( f"Ran out of file reading rows {lo}:{hi} of {self.path}" )
+        data = numpy.frombuffer( buf, dtype=self.dtype )
+        return data if rows is None else data[ rows - lo ]
+
+    def read_column( self, name, ptrmin=None, ptrmax=None, rows=None ):
+        """Read one column as an Arrow array.
+
+        Reads rows ptrmin:ptrmax (0-offset, python slice), or the row
+        numbers in array rows, or (if all are None) every row.
+
+        """
+        if self._file is not None:
+            return self._to_arrow( name, self._read_rows( ptrmin, ptrmax, rows )[ name ] )
+        col = self.data[ name ]
+        if ptrmin is not None:
+            col = col[ ptrmin:ptrmax ]
+        elif rows is not None:
+            col = col[ rows ]
+        return self._to_arrow( name, col )
+
+    def _to_arrow( self, name, col ):
+        """Convert numpy column col (of column name) to an Arrow array."""
+        if name in self._strcols:
+            return self._strings_to_arrow( col )
+        if name in self._boolcols:
+            return pyarrow.array( col == ord('T') )
+        if col.ndim > 1:
+            flat = col.astype( col.dtype.newbyteorder( '=' ) ).reshape( -1 )
+            return pyarrow.FixedSizeListArray.from_arrays( pyarrow.array( flat ), col.shape[1] )
+        # One pass that both copies out of the (strided) table and byteswaps
+        return pyarrow.array( col.astype( col.dtype.newbyteorder( '=' ) ) )
+
+    def read( self, columns=None, ptrmin=None, ptrmax=None, rows=None ):
+        """Read columns into an Arrow Table.
+
+        Parameters
+        ----------
+          columns : list of str or None
+            The columns to read, in order.  None means all of them.
+
+          ptrmin, ptrmax, rows
+            See read_column.
+
+        """
+        columns = self.columns if columns is None else list( columns )
+        for col in columns:
+            if col not in self.columns:
+                raise KeyError( f"No column {col} in {self.path}" )
+        if self._file is not None:
+            # Inflate the rows once, not once per column
+            data = self._read_rows( ptrmin, ptrmax, rows )
+            return pyarrow.table( { col: self._to_arrow( col, data[col] ) for col in columns } )
+        return pyarrow.table( { col: self.read_column( col, ptrmin=ptrmin, ptrmax=ptrmax, rows=rows )
+                                for col in columns } )
+
+    def close( self ):
+        self.data = None
+        self._buffer = None
+        with self._file_lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+
+    def __enter__( self ):
+        return self
+
+    def __exit__( self, *args ):
+        self.close()
@@ -2,7 +2,15 @@ import sys
 import os
 import pathlib
 import re
+import io
+import json
+import time
 import logging
+import collections
+import contextlib
+import threading
+import multiprocessing
+import concurrent.futures
 import warnings
 
 import numpy
@@ -10,9 +18,19 @@ import pyarrow
 import pandas
 import polars
 
+# polars marks IO plugins as unstable; without them, get_all_ltcvs(return_format='lazy')
+#   reads FITS files when the LazyFrame is built instead of when it's collected
+try:
+    from polars.io.plugins import register_io_source as _register_io_source
+except ImportError:
+    _register_io_source = None
+
 from astropy.io import fits
 import astropy.table
 
+import fits_bintable
+from fits_bintable import FITSBinTable, build_gzip_index
+
 # _default_log_level = logging.INFO
 _default_log_level = logging.DEBUG
 
@@ -25,11 +43,965 @@ _logout.setFormatter( _formatter )
 _logger.propagate = False
 _logger.setLevel( _default_log_level )
 
+def _phot_row_snids( nrows, ptrmin, ptrmax, snids, fill=-999 ):
+    """Figure out which object each row of a PHOT file belongs to.
+
+    Parameters
+    ----------
+      nrows : int
+        The number of rows in the PHOT file.
+
+      ptrmin, ptrmax : array of int
+        The PTROBS_MIN and PTROBS_MAX columns from the HEAD file for all
+        objects in the PHOT file.  These are 1-offset and inclusive
+        (FITS convention).
+
+      snids : array of int
+        The SNID column from the HEAD file, in the same order as ptrmin
+        and ptrmax.
+
+      fill : int, default -999
+        The value to use for rows that aren't part of any object (e.g. the
+        separator rows with MJD=-777).
+
+    Returns
+    -------
+      numpy array of int64 with nrows elements, the SNID for each row.
+
+    """
+    ptrmin = numpy.asarray( ptrmin, dtype=numpy.int64 ) - 1
+    ptrmax = numpy.asarray( ptrmax, dtype=numpy.int64 )
+    snids = numpy.asarray( snids, dtype=numpy.int64 )
+    if len( snids ) == 0:
+        return numpy.full( nrows, fill, dtype=numpy.int64 )
+
+    # The HEAD file is usually already in PTROBS order, but don't count on it
+    order = numpy.argsort( ptrmin, kind='stable' )
+    ptrmin = ptrmin[ order ]
+    ptrmax = ptrmax[ order ]
+    snids = snids[ order ]
+
+    # Think of the file as alternating segments: (gap, object, gap, object, ..., object, gap),
+    #   where the gaps are the separator rows (usually one row, but could be zero or more).
+    #   Then a single numpy.repeat builds the whole column.
+    nobj = len( snids )
+    vals = numpy.full( 2*nobj + 1, fill, dtype=numpy.int64 )
+    vals[1::2] = snids
+    lens = numpy.empty( 2*nobj + 1, dtype=numpy.int64 )
+    lens[1::2] = ptrmax - ptrmin
+    lens[0] = ptrmin[0]
+    lens[2:-1:2] = ptrmin[1:] - ptrmax[:-1]
+    lens[-1] = nrows - ptrmax[-1]
+    if ( lens < 0 ).any():
+        raise ValueError( "PTROBS_MIN/PTROBS_MAX ranges overlap or run past the end of the PHOT file" )
+    return numpy.repeat( vals, lens )
+
+
+# The PHOT file columns meaningful for ELAsTiCC
+_phot_columns = [ 'MJD', 'BAND', 'PHOTFLAG', 'PHOTPROB', 'FLUXCAL', 'FLUXCALERR',
+                  'PSF_SIG1', 'SKY_SIG', 'RDNOISE', 'ZEROPT', 'ZEROPT_ERR', 'GAIN', 'SIM_MAGOBS' ]
+
+
+def _check_phot_columns( columns ):
+    """Validate a columns argument; returns the list of PHOT columns to read."""
+    if columns is None:
+        return list( _phot_columns )
+    if isinstance( columns, str ):
+        columns = [ columns ]
+    columns = list( columns )
+    unknown = [ c for c in columns if c not in _phot_columns ]
+    if len( unknown ) > 0:
+        raise ValueError( f"Unknown PHOT column{'s' if len(unknown) > 1 else ''} {', '.join(unknown)}" )
+    if len( columns ) == 0:
+        raise ValueError( "Must read at least one PHOT column" )
+    return columns
+
+
+def _phot_sort_columns( columns ):
+    """The columns to sort lightcurve points by: SNID, then BAND and MJD if they were read."""
+    return [ 'SNID' ] + [ c for c in ( 'BAND', 'MJD' ) if c in columns ]
+
+
+def _read_phot_file( photfile, ptrmin=None, ptrmax=None, rows=None, columns=None, fits_reader='native',
+                     gzip_index=None, pool=None, stats=None, stream=False ):
+    """Read a PHOT file into a polars DataFrame.
+
+    Reads rows ptrmin:ptrmax (0-offset, python slice), or the row
+    numbers in array rows, or (if all are None) the whole file.  Only
+    the columns meaningful for ELAsTiCC are kept; if columns is not
+    None, only those columns (which must be a subset of _phot_columns)
+    are read at all.
+
+    fits_reader is 'native' to use FITSBinTable, or 'astropy' to use
+    astropy.io.fits.  (If FITSBinTable can't handle the file, astropy
+    is used anyway.)  gzip_index and stream are passed on to
+    FITSBinTable (stream only when there's no pool).  If pool
+    (a _PhotFilePool) is not None, the native reader gets the file from
+    there instead of opening it.  If stats (a _ReadStats) is not None,
+    the time spent in the open and decode stages is added to it.
+
+    This is a module-level function (rather than a method of
+    elasticc2_snana_reader) so that it can be sent to worker processes.
+
+    """
+    columns = _phot_columns if columns is None else columns
+    stats = _ReadStats() if stats is None else stats
+
+    if fits_reader == 'native':
+        try:
+            with contextlib.ExitStack() as stack:
+                with stats.stage( 'open' ):
+                    if pool is None:
+                        tab = stack.enter_context( FITSBinTable( photfile, gzip_index=gzip_index, stream=stream ) )
+                    else:
+                        tab = stack.enter_context( pool.open( photfile, gzip_index=gzip_index ) )
+                # FITSBinTable byteswaps as it copies each column out, so this is decode and byteswap
+                with stats.stage( 'decode' ) as stage:
+                    df = polars.from_arrow( tab.read( columns=columns, ptrmin=ptrmin, ptrmax=ptrmax, rows=rows ) )
+                    stage.count( df )
+                return df
+        except NotImplementedError as ex:
+            _logger.debug( f"Falling back to astropy for {photfile}: {ex}" )
+
+    with stats.stage( 'open' ), fits.open( photfile, memmap=True ) as phothdu:
+        if ptrmin is not None:
+            photrows = phothdu[1].data[ ptrmin:ptrmax ]
+        elif rows is not None:
+            photrows = phothdu[1].data[ rows ]
+        else:
+            photrows = phothdu[1].data
+
+    with stats.stage( 'decode' ) as stage:
+        # Convert to polars DataFrame, byteswapping as necessary.  Only convert
+        #   the columns we want; ignore the ones we don't care about.
+        dtypes = [ photrows[c].dtype if photrows[c].dtype.isnative else photrows[c].dtype.name
+                   for c in columns ]
+        df = polars.from_dict( { c: polars.Series( photrows[c].astype(d) )
+                                 for c, d in zip( columns, dtypes ) } )
+        # Because FITS has fixed-width strings, strip the meaningless spaces from
+        #   the end of the BAND field
+        if 'BAND' in columns:
+            df = df.with_columns( polars.col('BAND').str.strip_chars() )
+        stage.count( df )
+
+    return df
+
+
+def _phot_snid_rows( nrows, ptrmin, ptrmax, snids ):
+    """Row numbers of a PHOT file that put its objects in order of SNID.
+
+    ptrmin, ptrmax, and snids are as in _phot_row_snids.  Returns
+    ( rows, snids, lens ): taking rows of the PHOT file gives the points
+    of each object together (in the order they are in the file), with
+    the objects in order of SNID and without the separator rows; the
+    object with the i-th smallest SNID, snids[i], has lens[i] points.
+
+    """
+    ptrmin = numpy.asarray( ptrmin, dtype=numpy.int64 ) - 1
+    ptrmax = numpy.asarray( ptrmax, dtype=numpy.int64 )
+    snids = numpy.asarray( snids, dtype=numpy.int64 )
+    byptr = numpy.argsort( ptrmin, kind='stable' )
+    if ( ( len( snids ) > 0 ) and
+         ( ( ptrmax < ptrmin ).any() or ( ptrmin[ byptr[1:] ] < ptrmax[ byptr[:-1] ] ).any()
+           or ( ptrmin.min() < 0 ) or ( ptrmax.max() > nrows ) ) ):
+        raise ValueError( "PTROBS_MIN/PTROBS_MAX ranges overlap or run past the end of the PHOT file" )
+
+    order = numpy.argsort( snids, kind='stable' )
+    starts = ptrmin[ order ]
+    lens = ptrmax[ order ] - starts
+    offsets = numpy.cumsum( lens ) - lens
+    rows = numpy.arange( lens.sum(), dtype=numpy.int64 ) + numpy.repeat( starts - offsets, lens )
+    return rows, snids[ order ], lens
+
+
+def _sort_within_objects( df, lens ):
+    """Sort each object's points by BAND, MJD, without moving the objects.
+
+    df has the points of a run of objects, each object's points
+    together: the first lens[0] rows are the first object, and so on.
+    Only the columns of BAND and MJD that are in df are sorted on.
+
+    SNANA writes each object's points in time order, so this is usually
+    just a stable grouping of each object's points by band: one integer
+    argsort, rather than sorting every row of the file on three
+    columns.  If MJD turns out not to be in order within an object's
+    band, df is sorted by SNID, BAND, MJD instead (so df must have SNID
+    and the objects must be in order of SNID).
+
+    """
+    if ( 'BAND' not in df.columns ) and ( 'MJD' not in df.columns ):
+        return df
+    key = numpy.repeat( numpy.arange( len( lens ), dtype=numpy.int64 ), lens )
+    if 'BAND' in df.columns:
+        band = df['BAND'].cast( polars.Categorical )
+        cats = band.cat.get_categories().to_numpy()
+        # Categorical codes are in order of appearance; make them alphabetical
+        code = numpy.argsort( numpy.argsort( cats ) )[ band.to_physical().to_numpy() ]
+        key = key * max( len( cats ), 1 ) + code
+        order = numpy.argsort( key, kind='stable' )
+        key = key[ order ]
+        df = df[ order ]
+    if 'MJD' in df.columns:
+        mjd = df['MJD'].to_numpy()
+        if not ( ( numpy.diff( mjd ) >= 0 ) | ( numpy.diff( key ) != 0 ) ).all():
+            _logger.debug( "Points aren't in time order within objects; doing a full sort" )
+            df = df.sort( _phot_sort_columns( df.columns ) )
+    return df
+
+
+def _read_tagged_phot_file( photfile, ptrmin, ptrmax, snids, columns=None, fits_reader='native', sort=False,
+                            pool=None, stats=None ):
+    """Read a whole PHOT file, add the SNID column, and drop the separator rows.
+
+    ptrmin, ptrmax, and snids are the PTROBS_MIN, PTROBS_MAX, and SNID
+    columns of the HEAD file that goes with photfile.  If sort is True,
+    sort the points by SNID, BAND, MJD (see _phot_sort_columns);
+    otherwise, they're in the order they are in the file.  pool and
+    stats are passed on to _read_phot_file; stats also gets the tag and
+    sort stages.
+
+    Sorting doesn't sort the whole file: PTROBS_MIN/PTROBS_MAX keep each
+    object's points together, so the objects are put in order of SNID
+    (from the HEAD file) as the SNID column is added, and then only the
+    points within each object are sorted (see _sort_within_objects).
+
+    """
+    stats = _ReadStats() if stats is None else stats
+    df = _read_phot_file( photfile, columns=columns, fits_reader=fits_reader, pool=pool, stats=stats )
+    if sort:
+        with stats.stage( 'tag' ) as stage:
+            rows, snids, lens = _phot_snid_rows( len(df), ptrmin, ptrmax, snids )
+            df = df[ rows ].with_columns( polars.Series( name='SNID', values=numpy.repeat( snids, lens ) ) )
+            stage.count( df )
+        with stats.stage( 'sort' ) as stage:
+            df = _sort_within_objects( df, lens )
+            stage.count( df )
+        return df
+
+    with stats.stage( 'tag' ) as stage:
+        df = df.with_columns( polars.Series( name='SNID',
+                                             values=_phot_row_snids( len(df), ptrmin, ptrmax, snids ) ) )
+        # The phot file will have had a bunch of "separator" rows where (among other things)
+        #   MJD was -777.  Those should all have SNID=-999; trim them out.
+        df = df.filter( polars.col('SNID') >= 0 )
+        stage.count( df )
+    return df
+
+
+def _scan_tagged_phot_file( photfile, ptrmin, ptrmax, snids, columns=None, fits_reader='native', pool=None,
+                            stats=None ):
+    """A LazyFrame version of _read_tagged_phot_file( ..., sort=True ).
+
+    Nothing is read until the LazyFrame is collected, and then only the
+    columns the query uses (plus BAND and MJD, to sort by) are decoded.
+    Filters on the result are applied as the file is read.  The schema
+    comes from reading no rows of photfile, which (with the native
+    reader) only inflates its header.
+
+    This needs polars' (unstable) IO plugin interface.  If the installed
+    polars doesn't have it, the whole file is read right away and the
+    result is just the eager frame made lazy.
+
+    """
+    columns = _phot_columns if columns is None else columns
+    if _register_io_source is None:
+        return _read_tagged_phot_file( photfile, ptrmin, ptrmax, snids, columns=columns, fits_reader=fits_reader,
+                                       sort=True, pool=pool, stats=stats ).lazy().set_sorted( 'SNID' )
+    schema = dict( _read_phot_file( photfile, rows=numpy.array( [], dtype=numpy.int64 ), columns=columns,
+                                    fits_reader=fits_reader, stream=True ).schema )
+    schema['SNID'] = polars.Series( snids[:0] ).dtype
+
+    def source( with_columns, predicate, n_rows, batch_size ):
+        want = list( schema.keys() ) if with_columns is None else with_columns
+        readcols = [ c for c in columns if ( c in want ) or ( c in ( 'BAND', 'MJD' ) ) ]
+        df = _read_tagged_phot_file( photfile, ptrmin, ptrmax, snids, columns=readcols, fits_reader=fits_reader,
+                                     sort=True, pool=pool, stats=stats )
+        if predicate is not None:
+            df = df.filter( predicate )
+        if n_rows is not None:
+            df = df.head( n_rows )
+        yield df.select( want )
+
+    return _register_io_source( source, schema=schema ).set_sorted( 'SNID' )
+
+
+def _collapse_whitespace( text ):
+    """Turn every run of spaces, tabs, and CRs in bytes text into one space, and drop them at the ends of lines."""
+    chars = numpy.frombuffer( text.translate( _whitespace_to_space ), dtype=numpy.uint8 )
+    if len( chars ) == 0:
+        return text
+    space = chars == 0x20
+    # Keep the first space of each run
+    keep = ~space
+    keep[1:] |= ~space[:-1]
+    chars = chars[ keep ]
+    space = chars == 0x20
+    newline = chars == 0x0a
+    # Now runs are single spaces; drop the ones at the start or end of a line
+    drop = numpy.empty( len(chars), dtype=bool )
+    drop[0] = space[0]
+    numpy.logical_and( space[1:], newline[:-1], out=drop[1:] )
+    drop[:-1] |= space[:-1] & newline[1:]
+    drop[-1] |= space[-1]
+    return chars[ ~drop ].tobytes()
+
+_whitespace_to_space = bytes.maketrans( b'\t\r', b'  ' )
+
+# The strings pandas.read_csv reads as missing values by default
+_pandas_na_values = [ '', '#N/A', '#N/A N/A', '#NA', '-1.#IND', '-1.#QNAN', '-NaN', '-nan', '1.#IND', '1.#QNAN',
+                      '<NA>', 'N/A', 'NA', 'NULL', 'NaN', 'None', 'n/a', 'nan', 'null' ]
+
+
+def _read_dump_file( dumpfile ):
+    """Read an SNANA .DUMP (truth) file into a polars DataFrame.
+
+    The file has a "VARNAMES: col col ..." line, and then one "SN: val
+    val ..." line per object, with values separated by any amount of
+    whitespace; blank lines and comments are ignored.  The whitespace is
+    collapsed to single spaces with numpy, and the result is parsed with
+    polars' (multithreaded) CSV reader.  The result is the same as
+    polars.from_pandas of what pandas.read_csv would make of the file:
+    the same missing values (nan, NA, etc., and the end of a short
+    line) come back as null, an integer column with any of those is
+    Float64, and lines that don't start with "SN:" are still rows.
+    CID is renamed to SNID to match the HEAD table.  Like
+    pandas.read_csv, a line with more fields than VARNAMES is an error
+    (ValueError).
+
+    """
+    with open( dumpfile, 'rb' ) as ifp:
+        text = ifp.read()
+    if b'#' in text:
+        text = re.sub( rb'#[^\n]*', b'', text )
+    text = _collapse_whitespace( text )
+    if text.startswith( b'VARNAMES:' ):
+        start = 0
+    else:
+        start = text.find( b'\nVARNAMES:' ) + 1
+        if start == 0:
+            raise ValueError( f"No VARNAMES line in {dumpfile}" )
+    firstline = text.count( b'\n', 0, start ) + 1
+    text = text[ start: ]
+
+    # Fields are now separated by single spaces, so count spaces on each line
+    chars = numpy.frombuffer( text, dtype=numpy.uint8 )
+    lineno = numpy.cumsum( chars == 0x0a )
+    nspaces = numpy.bincount( lineno[ chars == 0x20 ], minlength=lineno[-1] + 1 if len( lineno ) > 0 else 1 )
+    bad = numpy.flatnonzero( nspaces > nspaces[0] )
+    if len( bad ) > 0:
+        line = text.split( b'\n' )[ bad[0] ].decode( errors='replace' )
+        raise ValueError( f"Line {firstline + bad[0]} of {dumpfile} has {nspaces[bad[0]] + 1} fields, "
+                          f"but VARNAMES has {nspaces[0] + 1}: {line[:200]}" )
+    text = io.BytesIO( text )
+
+    try:
+        df = polars.read_csv( text, separator=' ', null_values=_pandas_na_values )
+    except polars.exceptions.ComputeError:
+        # Probably a column that looked like ints for the rows polars
+        #   inferred types from, but has floats later; look at everything.
+        text.seek( 0 )
+        df = polars.read_csv( text, separator=' ', null_values=_pandas_na_values, infer_schema_length=None )
+    # Blank lines come through as rows of nulls
+    df = df.filter( polars.col('VARNAMES:').is_not_null() ).drop( 'VARNAMES:' )
+    # pandas has no integer null, so it makes integer columns with missing values float
+    df = df.with_columns( [ polars.col(c).cast( polars.Float64 ) for c, t in df.schema.items()
+                            if t.is_integer() and ( df[c].null_count() > 0 ) ] )
+    # Principle of least surprise: in the HEAD file, the object id is SNID,
+    #   whereas it's CID in the truth file.  Rename.
+    return df.rename( { 'CID': 'SNID' }, strict=False )
+
+
+def _merge_by_snid( dfs ):
+    """Combine frames that are each sorted by SNID into one sorted by SNID.
+
+    dfs is a list of polars DataFrames or LazyFrames (all the same kind,
+    with the same columns).  No SNID may be in more than one of them
+    (which is true of different PHOT files), so the order of rows within
+    an object is kept.
+
+    For DataFrames whose SNID ranges don't overlap, this is just a
+    concatenation in the right order.  Otherwise, it's a k-way merge done
+    as rounds of pairwise merge_sorted.  Either way, it's a lot cheaper
+    than sorting everything again.
+
+    """
+    if isinstance( dfs[0], polars.DataFrame ):
+        nonempty = [ d for d in dfs if len(d) > 0 ]
+        if len( nonempty ) == 0:
+            return dfs[0]
+        dfs = sorted( nonempty, key=lambda d: d['SNID'][0] )
+        if all( dfs[i]['SNID'][-1] < dfs[i+1]['SNID'][0] for i in range( len(dfs) - 1 ) ):
+            df = polars.concat( dfs ) if len(dfs) > 1 else dfs[0]
+            return df.set_sorted( 'SNID' )
+    while len( dfs ) > 1:
+        merged = [ dfs[i].merge_sorted( dfs[i+1], key='SNID' ) for i in range( 0, len(dfs) - 1, 2 ) ]
+        if len( dfs ) % 2 == 1:
+            merged.append( dfs[-1] )
+        dfs = merged
+    return dfs[0]
+
+
+# For ELAsTiCC2, PHOTFLAG has the following definitions:
+#
+#   PHOTFLAG_SATURATE:    1024   0x0400
+#   PHOTFLAG_TRIGGER:     2048   0x0800
+#   PHOTFLAG_DETECT:      4096   0x1000
+_photflag_saturate = 0x0400
+_photflag_trigger = 0x0800
+_photflag_detect = 0x1000
+
+_bands = [ 'u', 'g', 'r', 'i', 'z', 'Y' ]
+
+# The PHOT columns that _ltcv_features needs
+_feature_phot_columns = [ 'MJD', 'BAND', 'PHOTFLAG', 'FLUXCAL', 'FLUXCALERR' ]
+
+# Bump this when _ltcv_features changes, so cached feature tables get remade
+_features_version = 1
+
+
+def _ltcv_features( df ):
+    """Compute per-object lightcurve summaries.
+
+    df is a DataFrame of lightcurve points (with at least SNID and the
+    columns in _feature_phot_columns), sorted by SNID.  Returns one row
+    per object, sorted by SNID, with columns:
+
+      LC_NPOINTS : number of points
+      LC_NDET : number of detections (PHOTFLAG has the detect bit)
+      LC_NDET_{band} : number of detections in each band (0 if none)
+      LC_FLUXCAL_MAX : highest FLUXCAL
+      LC_FLUXCAL_MAX_{band} : highest FLUXCAL in each band (null if no points)
+      LC_MJD_FLUXCAL_MAX : MJD of the highest FLUXCAL
+      LC_SNR_MAX : highest FLUXCAL/FLUXCALERR
+      LC_MJD_FIRST, LC_MJD_LAST : MJD of the first and last point
+      LC_MJD_FIRST_DET, LC_MJD_LAST_DET : MJD of the first and last detection (null if none)
+      LC_DET_SPAN : LC_MJD_LAST_DET - LC_MJD_FIRST_DET (null if no detections)
+      LC_MJD_TRIGGER : MJD of the point with the trigger bit (null if none)
+      LC_NSATURATED : number of saturated points
+
+    (The LC_ prefix keeps these from colliding with HEAD and truth
+    columns, some of which are similar.)
+
+    """
+    det = ( polars.col('PHOTFLAG') & _photflag_detect ) != 0
+    trigger = ( polars.col('PHOTFLAG') & _photflag_trigger ) != 0
+    saturated = ( polars.col('PHOTFLAG') & _photflag_saturate ) != 0
+    band = polars.col('BAND')
+    exprs = [ polars.len().cast( polars.Int32 ).alias( 'LC_NPOINTS' ),
+              det.sum().cast( polars.Int32 ).alias( 'LC_NDET' ) ]
+    exprs.extend( ( det & ( band == b ) ).sum().cast( polars.Int32 ).alias( f'LC_NDET_{b}' ) for b in _bands )
+    exprs.append( polars.col('FLUXCAL').max().alias( 'LC_FLUXCAL_MAX' ) )
+    exprs.extend( polars.col('FLUXCAL').filter( band == b ).max().alias( f'LC_FLUXCAL_MAX_{b}' ) for b in _bands )
+    exprs.extend( [ polars.col('MJD').get( polars.col('FLUXCAL').arg_max() ).alias( 'LC_MJD_FLUXCAL_MAX' ),
+                    ( polars.col('FLUXCAL') / polars.col('FLUXCALERR') ).max().alias( 'LC_SNR_MAX' ),
+                    polars.col('MJD').min().alias( 'LC_MJD_FIRST' ),
+                    polars.col('MJD').max().alias( 'LC_MJD_LAST' ),
+                    polars.col('MJD').filter( det ).min().alias( 'LC_MJD_FIRST_DET' ),
+                    polars.col('MJD').filter( det ).max().alias( 'LC_MJD_LAST_DET' ),
+                    polars.col('MJD').filter( trigger ).min().alias( 'LC_MJD_TRIGGER' ),
+                    saturated.sum().cast( polars.Int32 ).alias( 'LC_NSATURATED' ) ] )
+    features = df.group_by( 'SNID', maintain_order=True ).agg( exprs )
+    span = ( polars.col('LC_MJD_LAST_DET') - polars.col('LC_MJD_FIRST_DET') ).alias( 'LC_DET_SPAN' )
+    return features.with_columns( span )
+
+
+def _read_file_features( readfunc, *args, stats=None ):
+    """Read one PHOT file with readfunc( *args, stats=stats ) and return _ltcv_features of it.
+
+    This is so that features can be computed in worker processes without
+    sending all the points back.
+
+    """
+    stats = _ReadStats() if stats is None else stats
+    df = readfunc( *args, stats=stats )
+    with stats.stage( 'features' ) as stage:
+        df = _ltcv_features( df )
+        stage.count( df )
+    return df
+
+
+def _call_with_stats( func, *args ):
+    """Return ( func( *args, stats=stats ), stats ), where stats is a new _ReadStats.
+
+    For reads done by _ordered_map: a worker process can't add to the
+    reader's stats, so each read collects its own, and the reader
+    merges them in.
+
+    """
+    stats = _ReadStats()
+    return func( *args, stats=stats ), stats
+
+
+def _ordered_map( func, arglist, workers=None, processes=False, max_in_flight=None ):
+    """Yield func( *args ) for each args in arglist, in order, possibly running several at once.
+
+    Parameters
+    ----------
+      func : callable
+        The function to call.  If processes is True, this must be
+        picklable (i.e. a module-level function).
+
+      arglist : iterable of tuples
+        Arguments for each call to func.
+
+      workers : int or None
+        Number of calls to run at once.  If None or 1, just call func
+        for each element of arglist in the current thread.
+
+      processes : bool, default False
+        If True, use a pool of worker processes; otherwise, use threads.
+
+      max_in_flight : int or None
+        The most calls that will have been started (or finished but not
+        yet yielded) at once.  This limits how many results are in
+        memory waiting to be consumed.  Defaults to workers.
+
+    """
+    if ( workers is None ) or ( workers <= 1 ):
+        for args in arglist:
+            yield func( *args )
+        return
+
+    max_in_flight = workers if max_in_flight is None else max( max_in_flight, 1 )
+    if processes:
+        # polars doesn't like being forked, so spawn fresh interpreters
+        pool = concurrent.futures.ProcessPoolExecutor( max_workers=workers,
+                                                       mp_context=multiprocessing.get_context( 'spawn' ) )
+    else:
+        pool = concurrent.futures.ThreadPoolExecutor( max_workers=workers )
+    with pool:
+        pending = collections.deque()
+        for args in arglist:
+            if len( pending ) >= max_in_flight:
+                yield pending.popleft().result()
+            pending.append( pool.submit( func, *args ) )
+        while len( pending ) > 0:
+            yield pending.popleft().result()
+
+
+class _LRUCache:
+    """A least-recently-used cache with an optional budget on the total size of what's in it.
+
+    The most recently added entry is always kept, even if it alone is
+    bigger than the budget.  So, a budget of 0 means "only keep the last
+    thing".
+
+    """
+
+    def __init__( self, max_bytes=None, sizeof=None ):
+        """Create a cache.
+
+        Parameters
+        ----------
+          max_bytes : int or None
+            The total size budget for the cache.  None means unlimited.
+
+          sizeof : callable or None
+            Function that returns the size (in bytes) of a value.  If
+            None, every value counts as 0 bytes.
+
+        """
+        self.max_bytes = max_bytes
+        self.sizeof = sizeof if sizeof is not None else ( lambda val: 0 )
+        self._entries = collections.OrderedDict()
+        self._sizes = {}
+        self._lock = threading.Lock()
+        self.nbytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __len__( self ):
+        return len( self._entries )
+
+    def __contains__( self, key ):
+        return key in self._entries
+
+    def peek( self, key, default=None ):
+        """Return a cached value without counting a hit or miss or making it more recently used."""
+        return self._entries.get( key, default )
+
+    def get( self, key, default=None ):
+        with self._lock:
+            if key in self._entries:
+                self.hits += 1
+                self._entries.move_to_end( key )
+                return self._entries[ key ]
+            self.misses += 1
+            return default
+
+    def put( self, key, val ):
+        size = self.sizeof( val )
+        with self._lock:
+            if key in self._entries:
+                self.nbytes -= self._sizes[ key ]
+            self._entries[ key ] = val
+            self._entries.move_to_end( key )
+            self._sizes[ key ] = size
+            self.nbytes += size
+            if self.max_bytes is not None:
+                while ( self.nbytes > self.max_bytes ) and ( len( self._entries ) > 1 ):
+                    oldkey, oldval = self._entries.popitem( last=False )
+                    self.nbytes -= self._sizes.pop( oldkey )
+                    self.evictions += 1
+
+    def clear( self ):
+        with self._lock:
+            self._entries.clear()
+            self._sizes.clear()
+            self.nbytes = 0
+
+    @property
+    def stats( self ):
+        """A dictionary with hits, misses, evictions, entries, and bytes."""
+        return { 'hits': self.hits, 'misses': self.misses, 'evictions': self.evictions,
+                 'entries': len( self._entries ), 'bytes': self.nbytes }
+
+
+class _ReadStats:
+    """Wall time, number of calls, rows, and bytes, added up for each stage of reading.
+
+    Use as
+
+      with stats.stage( 'decode' ) as stage:
+          df = ...
+          stage.count( df )
+
+    count is optional; it records the rows and (estimated) bytes of a
+    DataFrame or Arrow table that the stage produced.  Stages that
+    nothing calls count for have rows and bytes of None.
+
+    """
+
+    class _Stage:
+        def __init__( self ):
+            self.rows = None
+            self.nbytes = None
+
+        def count( self, df ):
+            self.rows = ( self.rows or 0 ) + len( df )
+            self.nbytes = ( ( self.nbytes or 0 )
+                            + ( df.estimated_size() if isinstance( df, polars.DataFrame ) else df.nbytes ) )
+
+    def __init__( self ):
+        self._stages = {}
+        self._lock = threading.Lock()
+
+    def __getstate__( self ):
+        # So that it can come back from worker processes (locks can't be pickled)
+        return { 'stages': self.as_dict() }
+
+    def __setstate__( self, state ):
+        self._stages = state['stages']
+        self._lock = threading.Lock()
+
+    @contextlib.contextmanager
+    def stage( self, name ):
+        stage = self._Stage()
+        t0 = time.perf_counter()
+        try:
+            yield stage
+        finally:
+            self.add( name, time.perf_counter() - t0, rows=stage.rows, nbytes=stage.nbytes )
+
+    def add( self, name, seconds, rows=None, nbytes=None, calls=1 ):
+        with self._lock:
+            rec = self._stages.setdefault( name, { 'calls': 0, 'seconds': 0., 'rows': None, 'bytes': None } )
+            rec['calls'] += calls
+            rec['seconds'] += seconds
+            if rows is not None:
+                rec['rows'] = ( rec['rows'] or 0 ) + rows
+            if nbytes is not None:
+                rec['bytes'] = ( rec['bytes'] or 0 ) + nbytes
+
+    def merge( self, other ):
+        """Add everything in another _ReadStats to this one."""
+        for name, rec in other.as_dict().items():
+            self.add( name, rec['seconds'], rows=rec['rows'], nbytes=rec['bytes'], calls=rec['calls'] )
+
+    def clear( self ):
+        with self._lock:
+            self._stages.clear()
+
+    def as_dict( self ):
+        """A dictionary of stage name -> { 'calls', 'seconds', 'rows', 'bytes' }."""
+        with self._lock:
+            return { name: dict( rec ) for name, rec in self._stages.items() }
+
+
+class _PhotFilePool:
+    """Open PHOT files (as FITSBinTables), kept around for reuse, least recently used closed first.
+
+    Opening a PHOT file means parsing its headers and setting up a
+    memory map (or, for a gzipped file with an index, opening it and
+    loading the index).  Keeping recently used files open means that
+    repeated reads from the same file skip all that.  Only files that
+    are cheap to keep open are pooled: uncompressed (memory-mapped)
+    files, and gzipped files read with an index.  A gzipped file
+    without an index would hold its whole inflated contents in memory,
+    so those are opened and closed for every read.
+
+    Use as
+
+      with pool.open( photfile, gzip_index ) as tab:
+          ...
+
+    A file that gets evicted while it's in use is closed when the last
+    user is done with it.  A pooled file that has changed size or
+    modification time on disk is reopened.
+
+    """
+
+    def __init__( self, max_files=16 ):
+        """Create a pool that keeps at most max_files files open (0 means don't pool)."""
+        self.max_files = max_files
+        self._entries = collections.OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __len__( self ):
+        return len( self._entries )
+
+    def _evict( self, key ):
+        """Remove an entry; call with the lock held."""
+        entry = self._entries.pop( key )
+        entry['evicted'] = True
+        self.evictions += 1
+        if entry['users'] == 0:
+            entry['tab'].close()
+
+    @contextlib.contextmanager
+    def open( self, photfile, gzip_index=None ):
+        """Context manager that gives an open FITSBinTable for photfile (see FITSBinTable for gzip_index)."""
+        if ( self.max_files <= 0 ) or ( ( gzip_index is None ) and pathlib.Path( photfile ).name.endswith( '.gz' ) ):
+            with FITSBinTable( photfile, gzip_index=gzip_index ) as tab:
+                yield tab
+            return
+
+        key = ( str( photfile ), None if gzip_index is None else str( gzip_index ) )
+        st = os.stat( photfile )
+        stamp = ( st.st_size, st.st_mtime_ns )
+        with self._lock:
+            entry = self._entries.get( key )
+            if ( entry is not None ) and ( entry['stamp'] != stamp ):
+                self._evict( key )
+                entry = None
+            if entry is not None:
+                self.hits += 1
+                self._entries.move_to_end( key )
+                entry['users'] += 1
+            else:
+                self.misses += 1
+
+        if entry is None:
+            # Open outside the lock so other files can be read meanwhile
+            entry = { 'tab': FITSBinTable( photfile, gzip_index=gzip_index ), 'stamp': stamp,
+                      'users': 1, 'evicted': False }
+            with self._lock:
+                if key in self._entries:
+                    # Another thread opened it first; just use this one once
+                    entry['evicted'] = True
+                else:
+                    self._entries[ key ] = entry
+                    while len( self._entries ) > self.max_files:
+                        self._evict( next( iter( self._entries ) ) )
+
+        try:
+            yield entry['tab']
+        finally:
+            with self._lock:
+                entry['users'] -= 1
+                done = entry['evicted'] and ( entry['users'] == 0 )
+            if done:
+                entry['tab'].close()
+
+    def clear( self ):
+        """Close (or, for ones in use, mark for closing) all pooled files."""
+        with self._lock:
+            for key in list( self._entries.keys() ):
+                self._evict( key )
+
+    @property
+    def stats( self ):
+        """A dictionary with hits, misses, evictions, and entries."""
+        return { 'hits': self.hits, 'misses': self.misses, 'evictions': self.evictions,
+                 'entries': len( self._entries ) }
+
+
+class _SNIDIndex:
+    """A sorted SNID -> ( file_num, PTROBS_MIN, PTROBS_MAX ) lookup table for one object class.
+
+    Lookups are binary searches, so they don't have to scan the whole
+    HEAD table.
+
+    """
+
+    def __init__( self, snids, file_nums, ptrmin, ptrmax ):
+        """Build an index.
+
+        Parameters
+        ----------
+          snids : array of int
+            SNID of each object
+
+          file_nums : array of str
+            The file_num (e.g. '0001') of the HEAD/PHOT file each object is in
+
+          ptrmin, ptrmax : array of int
+            PTROBS_MIN and PTROBS_MAX of each object (1-offset, inclusive)
+
+        """
+        snids = numpy.asarray( snids, dtype=numpy.int64 )
+        order = numpy.argsort( snids, kind='stable' )
+        self.snids = snids[ order ]
+        # Store the file_num strings just once, and a small int code for each object
+        self.file_nums, filedex = numpy.unique( numpy.asarray( file_nums, dtype=str ), return_inverse=True )
+        self.filedex = filedex.astype( numpy.int16 )[ order ]
+        self.ptrmin = numpy.asarray( ptrmin, dtype=numpy.int64 )[ order ]
+        self.ptrmax = numpy.asarray( ptrmax, dtype=numpy.int64 )[ order ]
+
+    @classmethod
+    def from_head( cls, head ):
+        """Build an index from a DataFrame returned by elasticc2_snana_reader.get_head"""
+        return cls( head['SNID'].to_numpy(), head['file_num'].to_numpy(),
+                    head['PTROBS_MIN'].to_numpy(), head['PTROBS_MAX'].to_numpy() )
+
+    def __len__( self ):
+        return len( self.snids )
+
+    def lookup( self, snids ):
+        """Find objects.
+
+        Parameters
+        ----------
+          snids : array of int
+            The SNIDs to look for.
+
+        Returns
+        -------
+          count, file_num, ptrmin, ptrmax
+
+          All are arrays with the same length as snids.  count is the
+          number of objects in the index with that SNID (so, 0 if it's
+          not there).  file_num is a str array, and ptrmin and ptrmax
+          are PTROBS_MIN and PTROBS_MAX (1-offset, inclusive).  If count
+          isn't 1, the other three are not meaningful for that SNID.
+
+        """
+        snids = numpy.asarray( snids, dtype=numpy.int64 )
+        if len( self.snids ) == 0:
+            zeros = numpy.zeros( len(snids), dtype=numpy.int64 )
+            return zeros, numpy.full( len(snids), '', dtype=str ), zeros, zeros
+        left = numpy.searchsorted( self.snids, snids, side='left' )
+        right = numpy.searchsorted( self.snids, snids, side='right' )
+        dex = numpy.minimum( left, len( self.snids ) - 1 )
+        return right - left, self.file_nums[ self.filedex[ dex ] ], self.ptrmin[ dex ], self.ptrmax[ dex ]
+
+    def save( self, path, stamp ):
+        """Write the index to a .npz file, along with a stamp (any JSON-serializable thing) to validate it."""
+        numpy.savez( path, snids=self.snids, file_nums=self.file_nums, filedex=self.filedex,
+                     ptrmin=self.ptrmin, ptrmax=self.ptrmax, stamp=numpy.array( json.dumps( stamp ) ) )
+
+    @classmethod
+    def load( cls, path, stamp ):
+        """Read an index written by save().  Returns None if the stamp doesn't match."""
+        with numpy.load( path ) as npz:
+            if json.loads( str( npz['stamp'] ) ) != stamp:
+                return None
+            index = cls.__new__( cls )
+            index.snids = npz['snids']
+            index.file_nums = npz['file_nums']
+            index.filedex = npz['filedex']
+            index.ptrmin = npz['ptrmin']
+            index.ptrmax = npz['ptrmax']
+        return index
+
+
+def _read_parquet_phot_file( photfile, columns=None, snids=None, sort=False, stats=None ):
+    """Read one PHOT file of the parquet dataset written by write_snana_parquet.py.
+
+    Returns the same thing as _read_tagged_phot_file (the columns, plus
+    SNID), but with the points already sorted by SNID.  If snids is not
+    None, only read the points of those objects; since the file is
+    sorted by SNID and has row group statistics, only the row groups
+    that can hold them get decompressed.  sort and stats are as in
+    _read_tagged_phot_file.
+
+    """
+    columns = _phot_columns if columns is None else columns
+    stats = _ReadStats() if stats is None else stats
+    lf = polars.scan_parquet( photfile ).select( list( columns ) + [ 'SNID' ] )
+    if snids is not None:
+        snids = numpy.asarray( snids, dtype=numpy.int64 )
+        if len( snids ) == 0:
+            return lf.head( 0 ).collect()
+        # The range check is what lets row groups get skipped based on their min/max
+        lf = lf.filter( polars.col('SNID').is_between( int( snids.min() ), int( snids.max() ) )
+                        & polars.col('SNID').is_in( snids ) )
+    with stats.stage( 'decode' ) as stage:
+        df = lf.collect()
+        stage.count( df )
+    if sort:
+        with stats.stage( 'sort' ) as stage:
+            # The file is already in order of SNID
+            lens = numpy.diff( numpy.flatnonzero( numpy.diff( df['SNID'].to_numpy(), prepend=-1, append=-1 ) ) )
+            df = _sort_within_objects( df, lens )
+            stage.count( df )
+    return df
+
+
+class _ParquetBackend:
+    """Where to find things in the parquet dataset written by write_snana_parquet.py.
+
+    The layout is {parquet_dir}/{phot,head}/class={class}/file_num={num}/data.parquet
+    and {parquet_dir}/truth/class={class}/data.parquet.  A class is only
+    used once its conversion has finished, which is marked by
+    {parquet_dir}/complete/class={class}.
+
+    """
+
+    def __init__( self, parquet_dir ):
+        self.parquet_dir = pathlib.Path( parquet_dir )
+        self._warned = set()
+
+    def has_class( self, obj_class_name ):
+        if ( self.parquet_dir / "complete" / f"class={obj_class_name}" ).is_file():
+            return True
+        if ( ( obj_class_name not in self._warned )
+             and ( self.parquet_dir / "head" / f"class={obj_class_name}" ).is_dir() ):
+            _logger.warning( f"The parquet conversion of {obj_class_name} in {self.parquet_dir} isn't complete; "
+                             f"reading the FITS files instead." )
+            self._warned.add( obj_class_name )
+        return False
+
+    def phot_file( self, obj_class_name, file_num ):
+        return self.parquet_dir / "phot" / f"class={obj_class_name}" / f"file_num={file_num}" / "data.parquet"
+
+    def head( self, obj_class_name ):
+        """The HEAD table, in the same form (row order included) as read from the FITS files."""
+        head = polars.scan_parquet( self.parquet_dir / "head" / f"class={obj_class_name}" / "*" / "*.parquet",
+                                    hive_partitioning=True,
+                                    hive_schema={ 'class': polars.String, 'file_num': polars.String } )
+        head = head.drop( 'class' ).collect().sort( 'file_num', maintain_order=True )
+        cols = [ c for c in head.columns if c not in ( 'file_num', 'head_filename' ) ]
+        return head.select( cols + [ 'file_num', 'head_filename' ] )
+
+    def truth( self, obj_class_name ):
+        truthfile = self.parquet_dir / "truth" / f"class={obj_class_name}" / "data.parquet"
+        if not truthfile.is_file():
+            raise FileNotFoundError( f"Can't find truth file {truthfile}" )
+        return polars.read_parquet( truthfile )
+
+
 class elasticc2_snana_reader:
     """A class for reading the ELAsTiCC2 SNANA FITS files in to Pandas data frames."""
 
     def __init__( self, elasticc2_snana_dir=pathlib.Path( os.getenv('TD', "/global/cfs/cdirs/desc-td") ) / "ELASTICC2",
-                  dir_prefix='ELASTICC2_FINAL_', waste_memory_on_heads=False, logger=None ):
+                  dir_prefix='ELASTICC2_FINAL_', waste_memory_on_heads=False, logger=None,
+                  head_cache_bytes=0, head_cache_dir=None, fits_reader='native', gzip_index=True,
+                  gzip_index_dir=None, parquet_dir=os.getenv( 'ELASTICC2_PARQUET' ), max_open_phot_files=16 ):
         """Create a reader.
 
         Parameters
@@ -48,15 +1020,91 @@ class elasticc2_snana_reader:
             ELAsTiCC2 training set (with, of course, elasticc2_snana_dir
             pointing at directory with the training files.)
         
+          head_cache_bytes : int or None, default 0
+            HEAD tables that have been read are kept in memory in a
+            least-recently-used cache so that next time you need them
+            it will be fast.  This is the memory budget (in bytes, as
+            estimated by polars) for that cache; when it's exceeded, the
+            least recently used classes are thrown out.  The most
+            recently used class is always kept, so the default of 0
+            means that only the last accessed HEAD file data is cached.
+            As long as you're working with a single class at a time,
+            that should still be good enough.  None means no limit.
+            The object types with larger numbers of objects (SNIa, SNII,
+            etc.) use 1-2GB of memory each for the head table.  See
+            head_cache_stats to tune this.  Truth tables (see
+            get_object_truth) are kept in a separate cache with the same
+            budget, as are feature tables (see get_features).
+
           waste_memory_on_heads : bool, default False
-            If True, whenever you read the HEAD files for a new object,
-            it will cache that head file so that next time you need to
-            access it, it will be fast.  This can eat up a lot of
-            memory; the object types with larger numbers of objects
-            (SNIa, SNII, etc.) will use 1-2GB of memory to store the
-            head file.  If False, only the last accessed HEAD file data
-            is cached.  As long as you're working with a single class at
-            a time, this should still be good enough.
+            If True, the same as head_cache_bytes=None: every HEAD table
+            read is kept in memory forever.  This can eat up a lot of
+            memory.  (Kept for backwards compatibility.)
+
+          head_cache_dir : str or Path, default None
+            If not None, a directory where decoded HEAD tables are saved
+            (as Arrow IPC files, one per object class) the first time
+            they're read.  Later readers (including ones in other
+            processes) pointed at the same directory will memory-map
+            the saved table instead of reading and decoding all of the
+            HEAD FITS files, as long as none of the HEAD files have
+            changed size or modification time since the cache was
+            written.  The directory is created if it doesn't exist.
+            The SNID indexes used by get_ltcv are saved here too, so
+            that a single-object lookup in a new reader doesn't have to
+            load the HEAD table at all.  So are the parsed truth tables
+            and the feature tables.
+
+          fits_reader : str, default 'native'
+            How to read the HEAD and PHOT FITS files.  'native' uses
+            FITSBinTable (in fits_bintable.py), which maps the FITS
+            binary table straight into Arrow arrays and is a lot faster
+            and lighter on memory.  'astropy' uses astropy.io.fits.  If
+            the native reader finds something in a file it doesn't
+            understand, it falls back to astropy for that file.
+
+          gzip_index : bool, default True
+            Only matters for gzipped PHOT files read with the native
+            FITS reader, and only if the indexed_gzip package is
+            installed.  If True, when part of a PHOT file is read (by
+            get_ltcv or get_ltcvs) and the file has an up-to-date
+            random-access index ({PHOT file}.gzidx, in gzip_index_dir,
+            in head_cache_dir, or next to the PHOT file), reading one
+            object only inflates the part of the file around its rows
+            instead of the whole file.  Reads never build indexes;
+            building one takes as long as reading the whole file once,
+            so do that ahead of time with build_gzip_indexes.
+
+          gzip_index_dir : str or Path, default None
+            A (writable) directory where build_gzip_indexes saves gzip
+            indexes, and the first place reads look for them.  If None,
+            build_gzip_indexes uses head_cache_dir, or if that's None
+            too, the directory of each PHOT file.
+
+          parquet_dir : str or Path or None
+            The top of a parquet copy of the data written by
+            write_snana_parquet.py.  Defaults to the ELASTICC2_PARQUET
+            env var if that's set.  For every class that's in there,
+            HEAD, truth, and lightcurve data are read from the parquet
+            files instead of the FITS files; everything comes back the
+            same, just faster.  (Lightcurve reads only decompress the
+            columns asked for, and single-object reads only the row
+            groups holding the object.)  Classes that aren't in the
+            parquet dataset, or whose conversion hasn't finished, are
+            read from the FITS files.
+
+          max_open_phot_files : int, default 16
+            With the native FITS reader, PHOT files that have been read
+            from are kept open (memory-mapped, or for gzipped files,
+            with their gzip index loaded) so that reading more from the
+            same file doesn't have to open and parse it again.  This is
+            the most files kept open; when there are more, the least
+            recently used one is closed.  0 means close every file after
+            reading it.  (Gzipped files without an index are always
+            closed, as keeping them open would mean keeping the whole
+            inflated file in memory.)  Used by get_ltcv, get_ltcvs, and
+            by get_all_ltcvs and friends when they read with threads.
+            See phot_file_pool_stats.
 
         """
 
@@ -85,37 +1133,118 @@ class elasticc2_snana_reader:
         #   memory usage.  As such, by default, just cache the
         #   last head file read.  For most usage, that should
         #   provide the speedup we want.
-        self.waste_memory_on_heads = waste_memory_on_heads
-        if self.waste_memory_on_heads:
-            self._heads_cache = {}
-        else:
-            self._head_cache_class = None
-            self._head_cache = None
+        if waste_memory_on_heads:
+            head_cache_bytes = None
+        self._head_cache = _LRUCache( max_bytes=head_cache_bytes, sizeof=lambda df: df.estimated_size() )
+        # Truth tables get their own cache with the same budget
+        self._truth_cache = _LRUCache( max_bytes=head_cache_bytes, sizeof=lambda df: df.estimated_size() )
+        self._feature_cache = _LRUCache( max_bytes=head_cache_bytes, sizeof=lambda df: df.estimated_size() )
+
+        if fits_reader not in ( 'native', 'astropy' ):
+            raise ValueError( f"Unknown fits_reader {fits_reader}" )
+        self.fits_reader = fits_reader
+
+        self.head_cache_dir = None if head_cache_dir is None else pathlib.Path( head_cache_dir )
+        self._snid_indices = {}
+
+        if gzip_index and ( fits_bintable.indexed_gzip is None ):
+            self.logger.debug( "indexed_gzip isn't installed; gzipped PHOT files will be read in full" )
+        self.gzip_index = bool( gzip_index ) and ( fits_bintable.indexed_gzip is not None )
+        self.gzip_index_dir = None if gzip_index_dir is None else pathlib.Path( gzip_index_dir )
+        self._phot_pool = _PhotFilePool( max_files=max_open_phot_files )
+        self._stats = _ReadStats()
+
+        self._parquet = None
+        if parquet_dir is not None:
+            if not pathlib.Path( parquet_dir ).is_dir():
+                raise RuntimeError( f"Can't open parquet directory {parquet_dir}" )
+            self._parquet = _ParquetBackend( parquet_dir )
 
         self.phots = {}
 
 
+    def _use_parquet( self, obj_class_name ):
+        """True if obj_class_name should be read from the parquet dataset rather than FITS files."""
+        return ( self._parquet is not None ) and self._parquet.has_class( obj_class_name )
+
+
     @property
     def obj_class_names( self ):
         """A list of all the object class names known."""
         return self._obj_class_names
 
 
-    # For ELAsTiCC2, PHOTFLAG has the following definitions:
-    #
-    #   PHOTFLAG_SATURATE:    1024   0x0400
-    #   PHOTFLAG_TRIGGER:     2048   0x0800
-    #   PHOTFLAG_DETECT:      4096   0x1000
+    @property
+    def head_cache_stats( self ):
+        """Statistics for the in-memory HEAD cache.
+
+        A dictionary with keys hits, misses, evictions (counts since the
+        reader was created), entries (number of classes currently
+        cached), and bytes (estimated memory used by the cached tables).
+
+        """
+        return self._head_cache.stats
+
+
+    @property
+    def phot_file_pool_stats( self ):
+        """Statistics for the pool of open PHOT files (see max_open_phot_files in the constructor).
+
+        A dictionary with keys hits, misses, evictions (counts since the
+        reader was created), and entries (number of files open now).
+
+        """
+        return self._phot_pool.stats
+
+
+    def close_phot_files( self ):
+        """Close all PHOT files the reader is keeping open."""
+        self._phot_pool.clear()
+
+
+    @property
+    def read_stats( self ):
+        """Where the reader has spent its time, by stage, since it was created (or reset_read_stats).
+
+        A dictionary of stage -> { 'calls', 'seconds', 'rows', 'bytes' }.
+        seconds is total wall time (so with several workers, it can add
+        up to more than the elapsed time); rows and bytes are the size
+        of what the stage produced (None for stages where that isn't
+        meaningful).  Stages that haven't happened aren't there.  The
+        stages are:
+
+          head : reading and decoding HEAD tables (not from cache)
+          truth : reading and parsing truth tables (not from cache)
+          open : opening PHOT files (parsing headers, memory-mapping;
+                 for gzipped files without an index, decompressing
+                 the whole file)
+          decode : getting PHOT columns out of the files, including
+                   decompressing and byteswapping
+          tag : assigning SNIDs to points and dropping separator rows
+          sort : sorting points by SNID, BAND, MJD
+          concat : merging per-file results
+          features : computing get_features summaries
+          agg : grouping points into one row per object
+          join : joining HEAD, truth, and feature tables to lightcurves
+
+        """
+        return self._stats.as_dict()
+
+
+    def reset_read_stats( self ):
+        """Zero read_stats."""
+        self._stats.clear()
+
 
     @property
     def photflag_saturate( self ):
         """Bitwise AND the PHOTFLAG field with this to find saturated points."""
-        return 0x0400
+        return _photflag_saturate
 
     @property
     def photflag_trigger( self ):
         """Bitwise AND the PHOTFLAG field with this to find the first point of each object that triggered dtection."""
-        return 0x0800
+        return _photflag_trigger
 
     @property
     def photflag_detect( self ):
@@ -124,7 +1253,7 @@ class elasticc2_snana_reader:
         (Including all points simulates forced photometry.)
 
         """
-        return 0x1000
+        return _photflag_detect
 
 
     def get_object_truth( self, obj_class_name, return_format='polars' ):
@@ -146,6 +1275,8 @@ class elasticc2_snana_reader:
         -------
           polars DataFrame or pandas DataFrame
 
+          The table is cached (see head_cache_bytes and head_cache_dir
+          in the constructor), so asking again is fast.
 
         """
         if obj_class_name not in self.subdirs:
@@ -153,22 +1284,224 @@ class elasticc2_snana_reader:
         if return_format not in ('polars', 'pandas'):
             raise ValueError( f"Unknown return_format {return_format}" )
 
-        dumpfile = self.elasticc2_snana_dir / self.subdirs[obj_class_name] / f"{self.dir_prefix}{obj_class_name}.DUMP"
-        if not dumpfile.is_file():
-            raise FileNotFoundError( f"Can't find truth file {dumpfile}" )
-        self.logger.info( f"Reading {dumpfile}" )
-        # polars read_csv is not as functional as the pandas version, sadly.
-        # pandas just ignores blank lines, which is what we need for the DUMP file.
-        pandas_df = pandas.read_csv( dumpfile, sep=r'\s+', header=0, comment='#' )
-        pandas_df.drop( 'VARNAMES:', inplace=True, axis=1 )
-        # Principle of least surprise: in the HEAD file, the object id is SNID,
-        #   whereas it's CID in the truth file.  Rename.
-        pandas_df.rename( { 'CID': 'SNID' }, axis='columns', inplace=True )
+        df = self._truth_cache.get( obj_class_name )
+
+        if df is None:
+            if self._use_parquet( obj_class_name ):
+                df = self._parquet.truth( obj_class_name )
+            else:
+                dumpfile = ( self.elasticc2_snana_dir / self.subdirs[obj_class_name]
+                             / f"{self.dir_prefix}{obj_class_name}.DUMP" )
+                if not dumpfile.is_file():
+                    raise FileNotFoundError( f"Can't find truth file {dumpfile}" )
+                stamp = self._files_stamp( { 'DUMP': dumpfile } )
+                df = self._read_disk_cache( obj_class_name, 'TRUTH', stamp )
+                if df is None:
+                    self.logger.info( f"Reading {dumpfile}" )
+                    with self._stats.stage( 'truth' ) as stage:
+                        df = _read_dump_file( dumpfile )
+                        stage.count( df )
+                    self._write_disk_cache( obj_class_name, 'TRUTH', stamp, df )
+            self._truth_cache.put( obj_class_name, df )
 
         if return_format == 'polars':
-            return polars.from_pandas( pandas_df )
+            return df
         else:
-            return pandas_df
+            return df.to_pandas()
+
+
+    def _find_head_files( self, obj_class_name ):
+        """Find all the HEAD files for a class, and fill in self.phots for that class.
+
+        Returns a dictionary of file_num (as a zero-padded str) -> Path of the HEAD file.
+
+        """
+        headparsere = re.compile( r'^(?P<base>.*)-(?P<num>\d+)_HEAD\.FITS(?P<gz>\.gz)?$' )
+
+        foundheads = {}
+        self.phots[ obj_class_name ] = {}
+        # First, look for non-gzipped files
+        headfiles = self.subdirs[obj_class_name].glob( "*HEAD.FITS" )
+        for headfile in headfiles:
+            match = headparsere.search( headfile.name )
+            if match is None:
+                raise ValueError( f"Error parsing HEAD filename {headfile.name}" )
+            foundheads[match.group('num')] = headfile
+            self.phots[obj_class_name][match.group('num')] = (
+                headfile.parent / f"{match.group('base')}-{match.group('num')}_PHOT.FITS" )
+        # Now, look for gzipped files
+        headfiles = self.subdirs[obj_class_name].glob( "*HEAD.FITS.gz" )
+        for headfile in headfiles:
+            match = headparsere.search( headfile.name )
+            if match is None:
+                raise ValueError( f"Error parsing HEAD filename {headfile.name}" )
+            if match.group('num') not in foundheads.keys():
+                foundheads[match.group('num')] = headfile
+                self.phots[obj_class_name][match.group('num')] = (
+                    headfile.parent / f"{match.group('base')}-{match.group('num')}_PHOT.FITS.gz" )
+
+        return foundheads
+
+
+    def _read_head_files( self, obj_class_name, foundheads ):
+        """Read and decode the HEAD files found by _find_head_files into one polars DataFrame."""
+
+        self.logger.info( f"Reading HEAD files from {self.subdirs[obj_class_name]}" )
+
+        # Read all the heads in order
+        heads = []
+        nums = list( foundheads.keys() )
+        nums.sort()
+        for num in nums:
+            df = None
+            if self.fits_reader == 'native':
+                try:
+                    with FITSBinTable( foundheads[num] ) as tab:
+                        df = polars.from_arrow( tab.read() )
+                except NotImplementedError as ex:
+                    self.logger.debug( f"Falling back to astropy for {foundheads[num]}: {ex}" )
+            if df is None:
+                atab = astropy.table.Table.read( foundheads[num] )
+                # Convert to polars DataFrame, also byteswapping as necessary.
+                # (FITS files are big-endian, and astropy just reads them as such.
+                # X86 Linux, at least, is little-endian.)
+                dtypes = [ atab[c].dtype if atab[c].dtype.isnative else  atab[c].dtype.name  for c in atab.columns ]
+                df = polars.from_dict( { c: polars.Series( atab[c].astype(d) )
+                                         for c, d in zip( atab.columns, dtypes ) } )
+
+            # SNID comes in as a b-string, convert it to an int (Polars cast chokes on the spaces)
+            df = df.with_columns( polars.col("SNID").cast( str ) )
+            df = df.with_columns( polars.col("SNID").str.strip_chars() )
+            df = df.with_columns( polars.col("SNID").cast( polars.Int64 ) )
+
+            # Convert all other "Binary" fields to strings, as that's what they really are
+            for col in [ c for c in df.columns if df[c].dtype == polars.Binary ]:
+                df = df.with_columns( polars.col(col).cast( str ) )
+                df = df.with_columns( polars.col(col).str.strip_chars() )
+
+            # Drop some columns that don't contain useful information
+            #  (Either it's null, or always the same because ELAsTiCC2 is
+            #  a catalog-based simulation, not a pixel-based simulation.)
+            df.drop_in_place( 'IAUC' )
+            df.drop_in_place( 'FAKE' )
+            df.drop_in_place( 'PIXSIZE' )
+            df.drop_in_place( 'NXPIX' )
+            df.drop_in_place( 'NYPIX' )
+            df.drop_in_place( 'SEARCH_TYPE' )
+
+            # Add the file_num and head_filename because we'll need that later
+            df = df.with_columns( file_num=polars.lit(num), head_filename=polars.lit(foundheads[num].name) )
+
+            heads.append( df )
+
+        return polars.concat( heads )
+
+
+    def _disk_cache_files( self, obj_class_name, kind ):
+        """Return ( arrow file, stamp file ) for the on-disk cache of a class's kind ('HEAD', 'TRUTH', 'FEATURES') table."""
+        base = self.head_cache_dir / f"{self.dir_prefix}{obj_class_name}_{kind}"
+        return base.parent / f"{base.name}.arrow", base.parent / f"{base.name}.json"
+
+
+    def _files_stamp( self, files ):
+        """A description of some files that changes if any of them change.
+
+        files is a dictionary of key -> Path (e.g. what _find_head_files
+        returns).  The stamp is a list of [ key, absolute path, size,
+        mtime in ns ], sorted by key.
+
+        """
+        stamp = []
+        for key in sorted( files.keys() ):
+            st = files[key].stat()
+            stamp.append( [ key, str( files[key].resolve() ), st.st_size, st.st_mtime_ns ] )
+        return stamp
+
+
+    def _read_disk_cache( self, obj_class_name, kind, stamp ):
+        """Return the cached kind DataFrame for a class, or None if there isn't one made from files matching stamp."""
+        if self.head_cache_dir is None:
+            return None
+
+        arrowfile, stampfile = self._disk_cache_files( obj_class_name, kind )
+        if not ( arrowfile.is_file() and stampfile.is_file() ):
+            return None
+        try:
+            with open( stampfile ) as ifp:
+                cachestamp = json.load( ifp )
+        except Exception as ex:
+            self.logger.warning( f"Failed to read {kind} cache stamp {stampfile}: {ex}" )
+            return None
+        if cachestamp != stamp:
+            self.logger.info( f"{kind} cache {arrowfile} is out of date" )
+            return None
+
+        self.logger.info( f"Reading cached {kind} table {arrowfile}" )
+        return polars.read_ipc( arrowfile, memory_map=True )
+
+
+    def _write_disk_cache( self, obj_class_name, kind, stamp, df ):
+        """Save a kind DataFrame, made from files described by stamp, to the on-disk cache (if there is one).
+
+        Failure to write the cache isn't fatal; it just logs a warning.
+
+        """
+        if self.head_cache_dir is None:
+            return
+
+        arrowfile, stampfile = self._disk_cache_files( obj_class_name, kind )
+        try:
+            self.head_cache_dir.mkdir( parents=True, exist_ok=True )
+            # Write to temporary files and rename so that another process
+            #   never sees a half-written cache.  Remove the stamp first so
+            #   that there's never a stamp that goes with a different table.
+            stampfile.unlink( missing_ok=True )
+            tmpfile = arrowfile.parent / f"{arrowfile.name}.{os.getpid()}.tmp"
+            df.write_ipc( tmpfile )
+            os.replace( tmpfile, arrowfile )
+            tmpfile = stampfile.parent / f"{stampfile.name}.{os.getpid()}.tmp"
+            with open( tmpfile, "w" ) as ofp:
+                json.dump( stamp, ofp )
+            os.replace( tmpfile, stampfile )
+            self.logger.info( f"Wrote {kind} cache {arrowfile}" )
+        except Exception as ex:
+            self.logger.warning( f"Failed to write {kind} cache {arrowfile}: {ex}" )
+
+
+    def _snid_index( self, obj_class_name ):
+        """Return the _SNIDIndex for a class, building (and maybe saving) it if necessary."""
+        if obj_class_name not in self.subdirs:
+            raise ValueError( f"Unknown object class name {obj_class_name}" )
+
+        if obj_class_name in self._snid_indices:
+            return self._snid_indices[ obj_class_name ]
+
+        index = None
+        if self.head_cache_dir is not None:
+            foundheads = self._find_head_files( obj_class_name )
+            stamp = self._files_stamp( foundheads )
+            indexfile = self.head_cache_dir / f"{self.dir_prefix}{obj_class_name}_SNIDINDEX.npz"
+            if indexfile.is_file():
+                try:
+                    index = _SNIDIndex.load( indexfile, stamp )
+                    if index is None:
+                        self.logger.info( f"SNID index {indexfile} is out of date" )
+                except Exception as ex:
+                    self.logger.warning( f"Failed to read SNID index {indexfile}: {ex}" )
+
+        if index is None:
+            index = _SNIDIndex.from_head( self.get_head( obj_class_name ) )
+            if self.head_cache_dir is not None:
+                try:
+                    self.head_cache_dir.mkdir( parents=True, exist_ok=True )
+                    tmpfile = indexfile.parent / f"{indexfile.name}.{os.getpid()}.tmp.npz"
+                    index.save( tmpfile, stamp )
+                    os.replace( tmpfile, indexfile )
+                except Exception as ex:
+                    self.logger.warning( f"Failed to write SNID index {indexfile}: {ex}" )
+
+        self._snid_indices[ obj_class_name ] = index
+        return index
 
 
     def get_head( self, obj_class_name, return_format='polars' ):
@@ -181,137 +1514,137 @@ class elasticc2_snana_reader:
             of the elements of the list self.obj_class_names
 
           return_format : str, default 'polars'
-            'polars' or 'pandas'
+            'polars', 'pandas', or 'lazy'
 
         Returns
         -------
-          Either a polars.DataFrame (if return_format is 'polars')
-          or a pandas.DataFrame (if return_format is 'pandas').
+          Either a polars.DataFrame (if return_format is 'polars'),
+          a pandas.DataFrame (if return_format is 'pandas'), or a
+          polars.LazyFrame (if return_format is 'lazy').
 
           Using return_format='polars' will generally be more efficient
           because polars is the format stored in internal caches.
 
+          If the reader was created with a head_cache_dir, the first
+          read of a class will also save the table there, and later
+          reads (by this or any other reader) will use that saved
+          table until the HEAD files change.
+
         """
         if obj_class_name not in self.subdirs:
             raise ValueError( f"Unknown object class name {obj_class_name}" )
-        if return_format not in ( 'polars', 'pandas' ):
+        if return_format not in ( 'polars', 'pandas', 'lazy' ):
             raise ValueError( f"Unknown return_format {return_format}" )
 
-        retdf = None
-
-        if self.waste_memory_on_heads:
-            if obj_class_name in self._heads_cache.keys():
-                retdf = self._heads_cache[ obj_class_name ]
-        else:
-            if self._head_cache_class == obj_class_name:
-                retdf = self._head_cache
+        retdf = self._head_cache.get( obj_class_name )
 
         if retdf is None:
-            self.logger.info( f"Reading HEAD files from {self.subdirs[obj_class_name]}" )
-
-            headparsere = re.compile( r'^(?P<base>.*)-(?P<num>\d+)_HEAD\.FITS(?P<gz>\.gz)?$' )
-
-            foundheads = {}
-            self.phots[ obj_class_name ] = {}
-            # First, look for non-gzipped files
-            headfiles = self.subdirs[obj_class_name].glob( "*HEAD.FITS" )
-            for headfile in headfiles:
-                match = headparsere.search( headfile.name )
-                if match is None:
-                    raise ValueError( f"Error parsing HEAD filename {headfile.name}" )
-                foundheads[match.group('num')] = headfile
-                self.phots[obj_class_name][match.group('num')] = (
-                    headfile.parent / f"{match.group('base')}-{match.group('num')}_PHOT.FITS" )
-            # Now, look for gzipped files
-            headfiles = self.subdirs[obj_class_name].glob( "*HEAD.FITS.gz" )
-            for headfile in headfiles:
-                match = headparsere.search( headfile.name )
-                if match is None:
-                    raise ValueError( f"Error parsing HEAD filename {headfile.name}" )
-                if match.group('num') not in foundheads.keys():
-                    foundheads[match.group('num')] = headfile
-                    self.phots[obj_class_name][match.group('num')] = (
-                        headfile.parent / f"{match.group('base')}-{match.group('num')}_PHOT.FITS.gz" )
-
-            # Read all the heads in order
-            heads = []
-            nums = list( foundheads.keys() )
-            nums.sort()
-            for num in nums:
-                atab = astropy.table.Table.read( foundheads[num] )
-                # Convert to polars DataFrame, also byteswapping as necessary.
-                # (FITS files are big-endian, and astropy just reads them as such.
-                # X86 Linux, at least, is little-endian.)
-                dtypes = [ atab[c].dtype if atab[c].dtype.isnative else  atab[c].dtype.name  for c in atab.columns ]
-                df = polars.from_dict( { c: polars.Series( atab[c].astype(d) )
-                                         for c, d in zip( atab.columns, dtypes ) } )
-
-                # SNID comes in as a b-string, convert it to an int (Polars cast chokes on the spaces)
-                df = df.with_columns( polars.col("SNID").cast( str ) )
-                df = df.with_columns( polars.col("SNID").str.strip_chars() )
-                df = df.with_columns( polars.col("SNID").cast( polars.Int64 ) )
-
-                # Convert all other "Binary" fields to strings, as that's what they really are
-                for col in [ c for c in df.columns if df[c].dtype == polars.Binary ]:
-                    df = df.with_columns( polars.col(col).cast( str ) )
-                    df = df.with_columns( polars.col(col).str.strip_chars() )
-
-                # Drop some columns that don't contain useful information
-                #  (Either it's null, or always the same because ELAsTiCC2 is
-                #  a catalog-based simulation, not a pixel-based simulation.)
-                df.drop_in_place( 'IAUC' )
-                df.drop_in_place( 'FAKE' )
-                df.drop_in_place( 'PIXSIZE' )
-                df.drop_in_place( 'NXPIX' )
-                df.drop_in_place( 'NYPIX' )
-                df.drop_in_place( 'SEARCH_TYPE' )
-
-                # Add the file_num and head_filename because we'll need that later
-                df = df.with_columns( file_num=polars.lit(num), head_filename=polars.lit(foundheads[num].name) )
-
-                heads.append( df )
-
-            retdf = polars.concat( heads )
-            if self.waste_memory_on_heads:
-                self._heads_cache[ obj_class_name ] = retdf
+            foundheads = self._find_head_files( obj_class_name )
+            if self._use_parquet( obj_class_name ):
+                self.logger.info( f"Reading {obj_class_name} HEAD from parquet" )
+                retdf = self._parquet.head( obj_class_name )
             else:
-                self._head_cache_class = obj_class_name
-                self._head_cache = retdf
+                retdf = self._read_disk_cache( obj_class_name, 'HEAD', self._files_stamp( foundheads ) )
+            if retdf is None:
+                with self._stats.stage( 'head' ) as stage:
+                    retdf = self._read_head_files( obj_class_name, foundheads )
+                    stage.count( retdf )
+                self._write_disk_cache( obj_class_name, 'HEAD', self._files_stamp( foundheads ), retdf )
+            self._head_cache.put( obj_class_name, retdf )
 
         if return_format == 'pandas':
             return retdf.to_pandas()
+        elif return_format == 'lazy':
+            return retdf.lazy()
         else:
             return retdf
 
 
-    def _read_one_phot_file( self, photfile, ptrmin=None, ptrmax=None, return_format='polars' ):
+    def _gzip_index_file( self, photfile, build=False ):
+        """Return the path of an up-to-date random-access index for gzipped photfile.
+
+        Looks in gzip_index_dir, then head_cache_dir, then next to
+        photfile.  If none of those has an index at least as new as
+        photfile and build is True, build one in gzip_index_dir (or
+        head_cache_dir, or next to photfile; the first of those that
+        was given).  Returns None if there's no index to be had.
+
+        """
+        photfile = pathlib.Path( photfile )
+        candidates = [ d / f"{photfile.name}.gzidx"
+                       for d in ( self.gzip_index_dir, self.head_cache_dir, photfile.parent ) if d is not None ]
+
+        photmtime = photfile.stat().st_mtime_ns
+        for indexfile in candidates:
+            if indexfile.is_file() and ( indexfile.stat().st_mtime_ns >= photmtime ):
+                return indexfile
+        if not build:
+            return None
+
+        indexfile = candidates[0]
+        indexfile.parent.mkdir( parents=True, exist_ok=True )
+        self.logger.debug( f"Building gzip index {indexfile}" )
+        build_gzip_index( photfile, indexfile )
+        return indexfile
+
+
+    def build_gzip_indexes( self, obj_class_name=None ):
+        """Build random-access indexes for gzipped PHOT files that don't have up-to-date ones.
+
+        See the gzip_index and gzip_index_dir arguments to the
+        constructor; the indexes are written to gzip_index_dir (or
+        head_cache_dir, or next to the PHOT files).  This builds them
+        all up front (e.g. once for a whole data set) so that
+        single-object reads are never slow; reads only use indexes, they
+        never build them.  Does nothing for files that aren't gzipped.
+
+        Parameters
+        ----------
+          obj_class_name : str or None
+            The class to build indexes for; None means all classes.
+
+        Returns
+        -------
+          A list of paths to the indexes (which may include ones that
+          already existed).
+
+        """
+        if fits_bintable.indexed_gzip is None:
+            raise RuntimeError( "Building gzip indexes requires the indexed_gzip package" )
+        classes = self.obj_class_names if obj_class_name is None else [ obj_class_name ]
+        indexes = []
+        for cls in classes:
+            if cls not in self.subdirs:
+                raise ValueError( f"Unknown object class name {cls}" )
+            self._find_head_files( cls )
+            for num in sorted( self.phots[cls].keys() ):
+                photfile = self.phots[cls][num]
+                if photfile.name.endswith( '.gz' ):
+                    indexfile = self._gzip_index_file( photfile, build=True )
+                    if indexfile is not None:
+                        indexes.append( indexfile )
+        return indexes
+
+
+    def _read_one_phot_file( self, photfile, ptrmin=None, ptrmax=None, rows=None, columns=None,
+                             return_format='polars' ):
+        """Read rows ptrmin:ptrmax (0-offset, python slice), or the row numbers in array rows, or everything."""
         if ( ptrmin is None ) != ( ptrmax is None ):
             raise RuntimeError( "Pass either both or neither of ptrmin and ptrmax" )
+        if ( ptrmin is not None ) and ( rows is not None ):
+            raise RuntimeError( "Pass at most one of ptrmin/ptrmax and rows" )
         if return_format not in ('polars', 'pandas'):
             raise ValueError( f"Unknown return_format {return_format}" )
 
-        with fits.open( photfile, memmap=True ) as phothdu:
-            if ptrmin is not None:
-                photrows = phothdu[1].data[ ptrmin:ptrmax ]
-            else:
-                photrows = phothdu[1].data
+        # Only worth seeking for part of a file; a whole-file read inflates everything anyway
+        gzip_index = None
+        if ( self.gzip_index and ( self.fits_reader == 'native' ) and pathlib.Path( photfile ).name.endswith( '.gz' )
+             and ( ( ptrmin is not None ) or ( rows is not None ) ) ):
+            gzip_index = self._gzip_index_file( photfile )
 
-        # Keep only the columns meaningful for ELAsTiCC
-        # photrows.keep_columns( ['MJD', 'BAND', 'PHOTFLAG', 'PHOTPROB', 'FLUXCAL', 'FLUXCALERR',
-        #                         'PSF_SIG1', 'SKY_SIG', 'RDNOISE', 'ZEROPT', 'ZEROPT_ERR', 'GAIN', 'SIM_MAGOBS'] )
-
-        # Convert to polars DataFrame, byteswapping as necessary
-        dtypes = [ photrows[c].dtype if photrows[c].dtype.isnative else photrows[c].dtype.name
-                   for c in photrows.dtype.names ]
-        df = polars.from_dict( { c: polars.Series( photrows[c].astype(d) )
-                                 for c, d in zip( photrows.dtype.names, dtypes ) } )
-        # Because FITS has fixed-width strings, strip the meaningless spaces from
-        #   the end of the BAND field
-        df = df.with_columns( polars.col('BAND').str.strip_chars() )
-
-        # Remove some columns we don't care about:
-        df = df.select( 'MJD', 'BAND', 'PHOTFLAG', 'PHOTPROB', 'FLUXCAL', 'FLUXCALERR',
-                        'PSF_SIG1', 'SKY_SIG', 'RDNOISE', 'ZEROPT', 'ZEROPT_ERR', 'GAIN', 'SIM_MAGOBS' )
+        df = _read_phot_file( photfile, ptrmin=ptrmin, ptrmax=ptrmax, rows=rows, columns=columns,
+                              fits_reader=self.fits_reader, gzip_index=gzip_index, pool=self._phot_pool,
+                              stats=self._stats )
 
         if return_format == 'pandas':
             return df.to_pandas()
@@ -319,27 +1652,37 @@ class elasticc2_snana_reader:
             return df
 
 
-    def get_ltcv( self, obj_class_name, snid, return_format='polars' ):
+    def get_ltcv( self, obj_class_name, snid, return_format='polars', columns=None ):
         """Read the lightcurve of a single object.
 
         Don't write a for loop where you read thousands of lightcurves
-        by calling this function repeatedly.  For bulk processing of all
+        by calling this function repeatedly.  To read a list of specific
+        objects, use get_ltcvs().  For bulk processing of all
         lightcurves, look at get_all_ltcvs().
 
         Speed notes:
 
           * The first time you call this for a given class, it will be
             slower, because it has to read all the HEAD files (unless
-            you preceeded this with a call to get_head).  Subsequent
-            calls *for the same class* will be faster, because the head
-            file is cached.
-
-          * This will be relatively slow if you are using gzipped SNANA
-            files, because it has to read and ungzip the entier PHOT
-            file.  If you're using FITS files that aren't gzipped, then
-            if your filesystem supports it, memory-mapping will allow
-            the reader to skip to the line of the object you're looking
-            for, and the read should be faster.
+            you preceeded this with a call to get_head) to build an
+            index of SNIDs.  Subsequent calls *for the same class* will
+            be faster, because the index is kept.  If the reader has a
+            head_cache_dir, the index is saved there, and then even the
+            first call doesn't need to read the HEAD files.
+
+          * If you're using FITS files that aren't gzipped, then if your
+            filesystem supports it, memory-mapping will allow the reader
+            to skip to the line of the object you're looking for.  For
+            gzipped SNANA files, the same is true once the PHOT file has
+            a random-access index (see the gzip_index argument to the
+            constructor and build_gzip_indexes).  Without an index (or
+            without indexed_gzip installed), every read has to ungzip
+            the whole PHOT file.
+
+          * The reader keeps the last few PHOT files it read from open
+            (see max_open_phot_files in the constructor), so looking
+            at several objects from the same file one after another
+            only opens and parses the file once.
 
         Parameters
         ----------
@@ -352,6 +1695,12 @@ class elasticc2_snana_reader:
             'SNID' field of the data frame returned by get_head().  (Our
             supernova bias can be seen by the name of this field.)
 
+          columns : list of str or None
+            If not None, only read these lightcurve columns (a subset
+            of the ones listed under "Returns"), in this order.  Columns
+            that aren't asked for are never decoded, so reading fewer
+            columns uses less time and memory.
+
         Returns
         --------
           pandas DataFrame with the multi-band lightcurve of the requested object.
@@ -362,26 +1711,251 @@ class elasticc2_snana_reader:
 
         """
 
-        head = self.get_head( obj_class_name )
-        headrow = head.filter( polars.col("SNID") == snid )
-        if len( headrow ) == 0:
+        if return_format not in ( 'polars', 'pandas' ):
+            raise ValueError( f"Unknown return_format {return_format}" )
+
+        count, file_num, ptrmin, ptrmax = self._snid_index( obj_class_name ).lookup( [ snid ] )
+        if count[0] == 0:
             raise ValueError( f"Unknown {obj_class_name} object id {snid}" )
-        if len( headrow ) > 1:
+        if count[0] > 1:
             raise RuntimeError( f"Found multiple {obj_class_name} with object id {snid}; this shouldn't happen!" )
 
+        if self._use_parquet( obj_class_name ):
+            df = _read_parquet_phot_file( self._parquet.phot_file( obj_class_name, file_num[0] ),
+                                          columns=_check_phot_columns( columns ), snids=[ snid ],
+                                          stats=self._stats )
+            df = df.drop( 'SNID' )
+            return df if return_format == 'polars' else df.to_pandas()
+
         # Off by one: FITS starts counting at 1, but we index arrays from 0
-        ptrmin = headrow['PTROBS_MIN'][0] - 1
+        ptrmin = int( ptrmin[0] ) - 1
         # ptrmax is actually one past the max (hence no -1 here)
-        ptrmax = headrow['PTROBS_MAX'][0]
+        ptrmax = int( ptrmax[0] )
 
-        photfile = self.phots[obj_class_name][headrow['file_num'][0]]
+        photfile = self.phots[obj_class_name][file_num[0]]
         self.logger.info( f"Reading lightcurve from {photfile}" )
-        df = self._read_one_phot_file( photfile, ptrmin, ptrmax, return_format=return_format )
+        df = self._read_one_phot_file( photfile, ptrmin, ptrmax, columns=_check_phot_columns( columns ),
+                                       return_format=return_format )
         return df
 
 
+    def _aggregate_ltcvs( self, df, obj_class_name, head, include_header, include_truth, truth=None,
+                          include_features=False ):
+        """Turn a one-row-per-point DataFrame (sorted by SNID) into a one-row-per-object DataFrame sorted by SNID.
+
+        head is the HEAD table (or the part of it covering the objects
+        in df) to join if include_header is True.  truth is the truth
+        table to join if include_truth is True; if it's None, it will
+        be read with get_object_truth.  If include_features is True,
+        join the get_features table.
+
+        df may be a LazyFrame, in which case so is the return value, and
+        none of the work is done until it's collected.
+        (For a LazyFrame, the agg and join stages in read_stats only
+        count the time to set up the query.)
+
+        """
+        lazy = isinstance( df, polars.LazyFrame )
+        self.logger.debug( "Aggregating" )
+        with self._stats.stage( 'agg' ) as stage:
+            cols = [ polars.col(c) for c in df.collect_schema().names() if c != 'SNID' ]
+            # df is sorted by SNID, so keeping the order means the result is too
+            df = df.group_by( 'SNID', maintain_order=True ).agg( *cols )
+            if not lazy:
+                stage.count( df )
+        if include_truth and ( truth is None ):
+            self.logger.debug( "Getting truth" )
+            truth = self.get_object_truth( obj_class_name )
+        features = self.get_features( obj_class_name ) if include_features else None
+        if not ( include_header or include_truth or include_features ):
+            return df
+
+        with self._stats.stage( 'join' ) as stage:
+            if include_header:
+                self.logger.debug( "Joining head" )
+                df = df.join( head.lazy() if lazy else head, on='SNID' )
+                df = df.drop( [ 'file_num', 'head_filename' ] )
+            if include_truth:
+                self.logger.debug( "Joning truth" )
+                df = df.join( truth.lazy() if lazy else truth, on='SNID' )
+            if include_features:
+                self.logger.debug( "Joining features" )
+                df = df.join( features.lazy() if lazy else features, on='SNID' )
+            # polars doesn't promise that joins keep the order of the
+            #   left side, so check (it's usually a no-op)
+            if lazy:
+                df = df.sort( 'SNID' )
+            elif not df['SNID'].is_sorted():
+                self.logger.debug( "Sorting" )
+                df = df.sort( 'SNID' )
+            if not lazy:
+                stage.count( df )
+        return df
+
+
+    def _read_objects( self, obj_class_name, snids, file_nums, ptrmin, ptrmax, columns=None ):
+        """Read the lightcurve points of specific objects, opening each PHOT file only once.
+
+        snids, file_nums, ptrmin, and ptrmax are arrays with the SNID,
+        file_num, PTROBS_MIN, and PTROBS_MAX of each object (e.g. from
+        the HEAD table or from _SNIDIndex.lookup).  self.phots must
+        already be filled in for the class.
+
+        columns is the list of PHOT columns to read (None for all).
+
+        Returns a polars DataFrame with one row per point, with an SNID
+        column, sorted by SNID, BAND, MJD.
+
+        """
+        columns = _check_phot_columns( columns )
+        snids = numpy.asarray( snids, dtype=numpy.int64 )
+        file_nums = numpy.asarray( file_nums )
+        ptrmin = numpy.asarray( ptrmin, dtype=numpy.int64 )
+        ptrmax = numpy.asarray( ptrmax, dtype=numpy.int64 )
+
+        dfs = []
+        for num in numpy.unique( file_nums ):
+            infile = file_nums == num
+            if self._use_parquet( obj_class_name ):
+                photfile = self._parquet.phot_file( obj_class_name, num )
+                self.logger.info( f"Reading {infile.sum()} lightcurves from {photfile}" )
+                dfs.append( _read_parquet_phot_file( photfile, columns=columns, snids=snids[ infile ], sort=True,
+                                                     stats=self._stats ) )
+                continue
+            # Take the objects in order of SNID, so that only the points within each object need sorting
+            infile = numpy.flatnonzero( infile )
+            infile = infile[ numpy.argsort( snids[ infile ], kind='stable' ) ]
+            # Off by one: FITS starts counting at 1, but we index arrays from 0
+            starts = ptrmin[ infile ] - 1
+            lens = ptrmax[ infile ] - starts
+            # Row numbers of all points of all the objects we want from this file
+            offsets = numpy.cumsum( lens ) - lens
+            rows = numpy.arange( lens.sum(), dtype=numpy.int64 ) + numpy.repeat( starts - offsets, lens )
+
+            photfile = self.phots[obj_class_name][num]
+            self.logger.info( f"Reading {len(starts)} lightcurves from {photfile}" )
+            df = self._read_one_phot_file( photfile, rows=rows, columns=columns )
+            with self._stats.stage( 'tag' ) as stage:
+                df = df.with_columns( polars.Series( name='SNID', values=numpy.repeat( snids[ infile ], lens ) ) )
+                stage.count( df )
+            with self._stats.stage( 'sort' ) as stage:
+                dfs.append( _sort_within_objects( df, lens ) )
+                stage.count( dfs[-1] )
+
+        if len( dfs ) == 0:
+            # No objects; read no rows of one of the class's files to get the right schema
+            if self._use_parquet( obj_class_name ):
+                return _read_parquet_phot_file( self._parquet.phot_file( obj_class_name, '*' ), columns=columns,
+                                                snids=[] )
+            if obj_class_name not in self.phots:
+                self._find_head_files( obj_class_name )
+            photfile = self.phots[obj_class_name][ min( self.phots[obj_class_name].keys() ) ]
+            df = _read_phot_file( photfile, rows=numpy.array( [], dtype=numpy.int64 ), columns=columns,
+                                  fits_reader=self.fits_reader, stream=True )
+            return df.with_columns( polars.Series( name='SNID', values=snids ) )
+
+        with self._stats.stage( 'concat' ) as stage:
+            df = _merge_by_snid( dfs )
+            stage.count( df )
+        return df
+
+
+    def _phot_file_reads( self, obj_class_name, nums, head, columns ):
+        """Figure out how to read whole PHOT files for get_all_ltcvs and iter_ltcvs.
+
+        Returns ( func, arglist, processes, photfiles ).  func( *args )
+        for each args in arglist reads one file (the one in photfiles
+        with the same index) into a DataFrame of points with an SNID
+        column and without separator rows, sorted by SNID, BAND, MJD.
+        (Each file is sorted by whoever reads it, so with several
+        workers the sorting is spread out too.)  processes is True if
+        the reads are CPU bound enough to be worth doing in separate
+        processes.
+
+        """
+        if self._use_parquet( obj_class_name ):
+            photfiles = [ self._parquet.phot_file( obj_class_name, num ) for num in nums ]
+            # polars already uses multiple threads decompressing parquet
+            return ( _read_parquet_phot_file, [ ( p, columns, None, True ) for p in photfiles ],
+                     False, photfiles )
+
+        photfiles = [ self.phots[obj_class_name][num] for num in nums ]
+        # Decompressing gzipped files is CPU bound, so use processes for those;
+        #   memory-mapped uncompressed files are mostly I/O, so threads are fine.
+        processes = any( p.name.endswith( '.gz' ) for p in photfiles )
+        # The pool of open files can be shared by threads, but not sent to processes
+        pool = None if processes else self._phot_pool
+        arglist = []
+        for num, photfile in zip( nums, photfiles ):
+            filehead = head.filter( polars.col('file_num') == num )
+            arglist.append( ( photfile, filehead['PTROBS_MIN'].to_numpy(), filehead['PTROBS_MAX'].to_numpy(),
+                              filehead['SNID'].to_numpy(), columns, self.fits_reader, True, pool ) )
+        return _read_tagged_phot_file, arglist, processes, photfiles
+
+
+    def get_ltcvs( self, obj_class_name, snids, return_format='polars', agg=False,
+                   include_header=False, include_truth=False, columns=None, include_features=False ):
+        """Read the lightcurves of a list of objects of one class.
+
+        Use this instead of calling get_ltcv in a loop.  All of the
+        requested objects are found at once in the SNID index (see
+        get_ltcv), and each PHOT file is opened only once, reading all
+        the rows needed from it in a single pass.  (If the PHOT files
+        are gzipped, each PHOT file that has any of the requested
+        objects will be decompressed once.)
+
+        Parameters
+        ----------
+          obj_class_name : str
+            The object class name, e.g. "AGN", "SNIa-SALT3".  Must be one
+            of the elements of the list self.obj_class_names
+
+          snids : list or array of int
+            The object IDs of the objects to read.  Duplicates are
+            ignored.  All must be objects of class obj_class_name.
+
+          return_format, agg, include_header, include_truth, columns, include_features
+            See get_all_ltcvs
+
+        Returns
+        -------
+          A pandas or polars DataFrame (based on return_format) in the
+          same format as get_all_ltcvs, but with only the requested
+          objects.
+
+        """
+        if return_format not in ( 'polars', 'pandas' ):
+            raise ValueError( f"Unknown return_format {return_format}" )
+
+        snids = numpy.unique( numpy.asarray( snids, dtype=numpy.int64 ) )
+        count, file_nums, ptrmin, ptrmax = self._snid_index( obj_class_name ).lookup( snids )
+        if ( count == 0 ).any():
+            missing = snids[ count == 0 ]
+            raise ValueError( f"Unknown {obj_class_name} object id{'s' if len(missing) > 1 else ''} "
+                              f"{', '.join( str(i) for i in missing[:10] )}"
+                              f"{' ...' if len(missing) > 10 else ''}" )
+        if ( count > 1 ).any():
+            raise RuntimeError( f"Found multiple {obj_class_name} with object id {snids[count > 1][0]}; "
+                                f"this shouldn't happen!" )
+
+        df = self._read_objects( obj_class_name, snids, file_nums, ptrmin, ptrmax, columns=columns )
+
+        if agg:
+            head = None
+            if include_header:
+                head = self.get_head( obj_class_name ).filter( polars.col('SNID').is_in( snids ) )
+            df = self._aggregate_ltcvs( df, obj_class_name, head, include_header, include_truth,
+                                        include_features=include_features )
+
+        if return_format == 'pandas':
+            return df.to_pandas()
+        else:
+            return df
+
+
     def get_all_ltcvs( self, obj_class_name, file_num=None, return_format='polars', agg=False,
-                       include_header=False, include_truth=False ):
+                       include_header=False, include_truth=False, workers=None, max_files_in_flight=None,
+                       columns=None, include_features=False ):
         """Get all lightcuvres of a class (optionally from one PHOT file)
 
         You probably want to set file_num; otherwise, this is likely to
@@ -392,11 +1966,11 @@ class elasticc2_snana_reader:
         PHOT files.  (This means, for instance, that reading all
         lightcurves for SNIa-SALT3 will take up to tens of minutes.)
 
-        If you really need to go through all the lightcurves, do this
-        inside a "for file_num in range(1,41)" loop, or something like
-        that.  You'll still end up having to read everything, so it will
-        still take a long time, but you won't ever use as much memory at
-        once.
+        If you really need to go through all the lightcurves, use
+        iter_ltcvs() (or do this inside a "for file_num in range(1,41)"
+        loop, or something like that).  You'll still end up having to
+        read everything, so it will still take a long time, but you
+        won't ever use as much memory at once.
 
         Parameters
         ----------
@@ -416,7 +1990,16 @@ class elasticc2_snana_reader:
             phot file.
 
           return_format : str, default 'polars'
-            One of 'polars' or 'pandas'
+            One of 'polars', 'pandas', or 'lazy'.  'lazy' returns a
+            polars LazyFrame where nothing has been read yet (except
+            the HEAD table), so that filters and column selections you
+            chain on to it are done before sorting, aggregation, and
+            the head/truth joins by the query optimizer.  When the
+            LazyFrame is collected, each PHOT file is read with only
+            the columns the query uses (from the parquet dataset if
+            the class is in one; see parquet_dir in the constructor).
+            workers and max_files_in_flight don't apply; polars
+            decides how many files to read at once.
 
           agg : bool, default False
             If False, get back a data frame with one row per photometry
@@ -438,6 +2021,35 @@ class elasticc2_snana_reader:
             will be columns PEAKMAG_g and SIM_PEAKMAG_g that have the
             same information.)
 
+          include_features : bool, default False
+            Like include_header, but for the per-object lightcurve
+            summaries from get_features.  The first time this is used
+            for a class, it computes features for the whole class.
+
+          workers : int or None
+            If None or 1, read the PHOT files one after another.
+            Otherwise, read (and assign SNIDs in) this many PHOT files
+            at once.  If any of the PHOT files are gzipped, this uses a
+            pool of worker processes (because decompression is CPU
+            bound); otherwise, it uses threads.  The result is the same
+            either way.  Only matters when file_num is None.
+
+          max_files_in_flight : int or None
+            With workers, the most PHOT files that will be being read,
+            or read but not yet added to the result, at once.  Each
+            PHOT file being read temporarily needs several times its
+            decoded size in memory, so lower this to reduce peak memory
+            use.  Defaults to workers.
+
+          columns : list of str or None
+            If not None, only read these lightcurve columns (a subset of
+            the ones listed under "Returns"); SNID is always included.
+            Columns that aren't asked for are never decoded, so e.g.
+            columns=['MJD', 'BAND', 'FLUXCAL', 'FLUXCALERR'] needs
+            roughly a third of the time and memory of reading
+            everything.  If BAND or MJD aren't included, the points
+            within each object are sorted by whichever of the two is.
+
         Returns
         -------
           A pandas or polars DataFrame (based on return_format)
@@ -471,8 +2083,9 @@ class elasticc2_snana_reader:
 
         """
 
-        if return_format not in ( 'polars', 'pandas', 'polars_nested' ):
-            raise ValueError( "Unknown return_format {return_format}" )
+        if return_format not in ( 'polars', 'pandas', 'lazy' ):
+            raise ValueError( f"Unknown return_format {return_format}" )
+        columns = _check_phot_columns( columns )
 
         head = self.get_head( obj_class_name )
         if file_num is not None:
@@ -481,62 +2094,297 @@ class elasticc2_snana_reader:
                 raise ValueError( f"No {obj_class_name} with file_num {file_num}" )
             nums = [ f'{int(file_num):04d}' ]
         else:
-            nums = [ f'{i:04d}' for i in range(1,41) ]
-
-        dfs = []
-        for num in nums:
-            photfile = self.phots[obj_class_name][num]
-            self.logger.info( f"Reading {photfile}..." )
-            df = self._read_one_phot_file( photfile )
-            self.logger.info( "...assigning SNID" )
-            # This is incredibly slow.
-            # Is there a faster way than the with_columns and scatter business?
-            # I'm just looking for an equivalent to pandas df.loc[ptrmin:ptrmax, 'SNID'] = snid
-            # df = df.with_columns( SNID=polars.lit( -999, dtype=polars.Int64 ) )
-            # for row in head.filter( polars.col('file_num') == f'{int(num):04d}' ).iter_rows( named=True ):
-            #     ptrmin = row['PTROBS_MIN'] - 1
-            #     ptrmax = row['PTROBS_MAX']
-            #     df = df.with_columns( df['SNID'].scatter( range(ptrmin, ptrmax ), row['SNID'] ) )
-            snids = []
-            for row in head.filter( polars.col('file_num') == f'{int(num):04d}' ).iter_rows( named=True ):
-                ptrmin = row['PTROBS_MIN'] - 1
-                ptrmax = row['PTROBS_MAX']
-                snids.extend( [row['SNID']] * (ptrmax-ptrmin) )
-                snids.append( -999 )
-            df = df.with_columns( polars.Series( name='SNID', values=snids ) )
-
-            # The phot file will have had a bunch of "separator" rows where (among other things)
-            #   MJD was -777.  Those should all have SNID=-999; trim them out.
-            df = df.filter( polars.col('SNID') >= 0 )
-
-            dfs.append( df )
-
-        self.logger.debug( f"Concatenating {len(dfs)} dataframes" )
-        df = polars.concat( [ d for d in dfs if len(d) > 0 ] ) if len(dfs) > 1 else dfs[0]
-        self.logger.debug( f"Sorting" )
-        df = df.sort( [ 'SNID', 'BAND', 'MJD' ] )
+            nums = sorted( self.phots[obj_class_name].keys() )
+
+        if ( return_format == 'lazy' ) and self._use_parquet( obj_class_name ):
+            df = _merge_by_snid( [ polars.scan_parquet( self._parquet.phot_file( obj_class_name, num ) )
+                                   .select( columns + [ 'SNID' ] ).sort( _phot_sort_columns( columns ) )
+                                   for num in nums ] )
+        elif return_format == 'lazy':
+            # Each PHOT file is read (with only the columns the query needs) when the LazyFrame is collected
+            readfunc, arglist, processes, photfiles = self._phot_file_reads( obj_class_name, nums, head, columns )
+            df = _merge_by_snid( [ _scan_tagged_phot_file( *args[:6], pool=self._phot_pool, stats=self._stats )
+                                   for args in arglist ] )
+        else:
+            readfunc, arglist, processes, photfiles = self._phot_file_reads( obj_class_name, nums, head, columns )
+            if ( workers is not None ) and ( workers > 1 ):
+                self.logger.info( f"Reading {len(photfiles)} PHOT files with {workers} worker "
+                                  f"{'processes' if processes else 'threads'}" )
+            dfs = []
+            for photfile, ( df, stats ) in zip( photfiles,
+                                                _ordered_map( _call_with_stats,
+                                                              [ ( readfunc, *args ) for args in arglist ],
+                                                              workers=workers, processes=processes,
+                                                              max_in_flight=max_files_in_flight ) ):
+                self.logger.info( f"...read {photfile}" )
+                self._stats.merge( stats )
+                dfs.append( df )
+
+            # Each file is already sorted, and no object is in more than one file
+            self.logger.debug( f"Merging {len(dfs)} dataframes" )
+            with self._stats.stage( 'concat' ) as stage:
+                df = _merge_by_snid( dfs )
+                stage.count( df )
 
         if agg:
-            self.logger.debug( "Aggregating" )
-            cols = [ polars.col(c) for c in df.columns if c != 'SNID' ]
-            df = df.group_by( 'SNID' ).agg( *cols )
-            if include_header:
-                self.logger.debug( "Joining head" )
-                df = df.join( head, on='SNID' )
-                df.drop_in_place( 'file_num' )
-                df.drop_in_place( 'head_filename' )
-            if include_truth:
-                self.logger.debug( "Getting truth" )
-                truth = self.get_object_truth( obj_class_name )
-                self.logger.debug( "Joning truth" )
-                df = df.join( truth, on='SNID' )
-            self.logger.debug( "Sorting" )
-            df = df.sort( 'SNID' )
+            df = self._aggregate_ltcvs( df, obj_class_name, head, include_header, include_truth,
+                                        include_features=include_features )
 
         self.logger.debug( "Returning" )
-        if return_format == 'polars':
+        if return_format == 'pandas':
+            return df.to_pandas()
+        else:
             return df
-        elif return_format == 'pandas':
+
+
+    def get_features( self, obj_class_name=None, return_format='polars', workers=None ):
+        """Get per-object lightcurve summaries (detections, peak flux, etc.).
+
+        These are computed from all of the lightcurve points of a class
+        in one pass over its PHOT files, and cached (in memory, and in
+        head_cache_dir if the reader has one), so after the first time
+        they're a cheap table to join to the HEAD table or to
+        lightcurves (see include_features in get_all_ltcvs).
+
+        Parameters
+        ----------
+          obj_class_name : str or None
+            The object class name.  If None, get the features of all
+            classes, with an extra column obj_class_name.
+
+          return_format : str, default 'polars'
+            'polars' or 'pandas'
+
+          workers : int or None
+            Compute features of this many PHOT files at once (see
+            get_all_ltcvs).  Only matters when the features of a class
+            aren't already cached.
+
+        Returns
+        -------
+          A polars or pandas DataFrame with one row per object that has
+          lightcurve points, sorted by SNID (or, if obj_class_name is
+          None, by class and then SNID).  Columns are SNID plus:
+
+            LC_NPOINTS : number of lightcurve points
+            LC_NDET : number of detections (points with photflag_detect)
+            LC_NDET_{band} : number of detections in band (u, g, r, i, z, Y)
+            LC_FLUXCAL_MAX : highest FLUXCAL of any point
+            LC_FLUXCAL_MAX_{band} : highest FLUXCAL in band
+            LC_MJD_FLUXCAL_MAX : MJD of the point with the highest FLUXCAL
+            LC_SNR_MAX : highest FLUXCAL/FLUXCALERR
+            LC_MJD_FIRST, LC_MJD_LAST : MJD of the first and last points
+            LC_MJD_FIRST_DET, LC_MJD_LAST_DET : MJD of the first and last detections
+            LC_DET_SPAN : time between the first and last detections
+            LC_MJD_TRIGGER : MJD of the point with photflag_trigger
+            LC_NSATURATED : number of points with photflag_saturate
+
+          The counts (LC_NDET, LC_NDET_{band}, LC_NSATURATED) are 0
+          for objects with none of those points.  LC_FLUXCAL_MAX_{band}
+          is null for objects with no points in that band;
+          LC_MJD_FIRST_DET, LC_MJD_LAST_DET, and LC_DET_SPAN are null
+          for objects with no detections, and LC_MJD_TRIGGER for objects
+          with no trigger.
+
+        """
+        if return_format not in ( 'polars', 'pandas' ):
+            raise ValueError( f"Unknown return_format {return_format}" )
+
+        if obj_class_name is None:
+            df = polars.concat( [ self.get_features( cls, workers=workers )
+                                  .with_columns( obj_class_name=polars.lit( cls ) )
+                                  for cls in self.obj_class_names ] )
+            return df.to_pandas() if return_format == 'pandas' else df
+
+        if obj_class_name not in self.subdirs:
+            raise ValueError( f"Unknown object class name {obj_class_name}" )
+
+        df = self._feature_cache.get( obj_class_name )
+
+        if df is None:
+            foundheads = self._find_head_files( obj_class_name )
+            nums = sorted( self.phots[obj_class_name].keys() )
+            if self._use_parquet( obj_class_name ):
+                files = { num: self._parquet.phot_file( obj_class_name, num ) for num in nums }
+            else:
+                files = { **{ f'HEAD{num}': h for num, h in foundheads.items() },
+                          **{ f'PHOT{num}': self.phots[obj_class_name][num] for num in nums } }
+            stamp = [ [ 'version', _features_version ] ] + self._files_stamp( files )
+            df = self._read_disk_cache( obj_class_name, 'FEATURES', stamp )
+            if df is None:
+                self.logger.info( f"Computing {obj_class_name} features" )
+                head = None if self._use_parquet( obj_class_name ) else self.get_head( obj_class_name )
+                readfunc, arglist, processes, photfiles = self._phot_file_reads( obj_class_name, nums, head,
+                                                                                  _feature_phot_columns )
+                dfs = []
+                for photfile, ( filedf, stats ) in zip( photfiles,
+                                                        _ordered_map( _call_with_stats,
+                                                                      [ ( _read_file_features, readfunc, *args )
+                                                                        for args in arglist ],
+                                                                      workers=workers, processes=processes ) ):
+                    self.logger.debug( f"...did features of {photfile}" )
+                    self._stats.merge( stats )
+                    dfs.append( filedf )
+                with self._stats.stage( 'concat' ) as stage:
+                    df = _merge_by_snid( dfs )
+                    stage.count( df )
+                self._write_disk_cache( obj_class_name, 'FEATURES', stamp, df )
+            self._feature_cache.put( obj_class_name, df )
+
+        if return_format == 'pandas':
             return df.to_pandas()
         else:
-            raise RuntimeError( "This should never happen" )
+            return df
+
+
+    def iter_ltcvs( self, obj_class_name, batch_size=10000, return_format='polars',
+                    include_header=False, include_truth=False, prefetch=1, columns=None,
+                    include_features=False ):
+        """Iterate over all the lightcurves of a class in batches.
+
+        Use this instead of get_all_ltcvs when you want to go through
+        every object of a big class (e.g. SNIa-SALT3) without having all
+        of them in memory at once.  PHOT files are read one at a time;
+        while you're working on one batch, the next PHOT file is being
+        read in the background.
+
+        Parameters
+        ----------
+          obj_class_name : str
+            The object class name, e.g. "AGN", "SNIa-SALT3".  Must be one
+            of the elements of the list self.obj_class_names
+
+          batch_size : int, default 10000
+            The number of objects in each batch.  (The last batch will
+            usually be smaller.)
+
+          return_format : str, default 'polars'
+            One of 'polars' or 'pandas'
+
+          include_header, include_truth, include_features : bool, default False
+            See get_all_ltcvs with agg=True.
+
+          prefetch : int, default 1
+            The number of PHOT files to read ahead in the background.
+            Each one that's been read but not yet yielded takes memory,
+            so keep this small.  0 means don't read anything in the
+            background.
+
+          columns : list of str or None
+            See get_all_ltcvs
+
+        Returns
+        -------
+          A generator that yields pandas or polars DataFrames (based on
+          return_format), each with (up to) batch_size rows in the same
+          format as get_all_ltcvs( ..., agg=True ).  Within a batch,
+          objects are sorted by SNID, but batches are in PHOT file
+          order, so SNIDs aren't sorted across batches.
+
+        """
+        if return_format not in ( 'polars', 'pandas' ):
+            raise ValueError( f"Unknown return_format {return_format}" )
+        if batch_size < 1:
+            raise ValueError( f"batch_size must be at least 1" )
+        columns = _check_phot_columns( columns )
+
+        head = self.get_head( obj_class_name )
+        truth = self.get_object_truth( obj_class_name ) if include_truth else None
+        nums = sorted( self.phots[obj_class_name].keys() )
+        fileheads = [ head.filter( polars.col('file_num') == num ) for num in nums ]
+        readfunc, arglist, _, _ = self._phot_file_reads( obj_class_name, nums, head, columns )
+
+        leftover = None
+        for filehead, ( df, stats ) in zip( fileheads,
+                                            _ordered_map( _call_with_stats, [ ( readfunc, *args ) for args in arglist ],
+                                                          workers=prefetch+1, max_in_flight=prefetch+1 ) ):
+            self._stats.merge( stats )
+            df = self._aggregate_ltcvs( df, obj_class_name, filehead, include_header, include_truth, truth=truth,
+                                        include_features=include_features )
+            if leftover is not None:
+                # The first batch from this file straddles two files, so needs re-sorting
+                nfill = batch_size - len(leftover)
+                first = polars.concat( [ leftover, df.slice( 0, nfill ) ] ).sort( 'SNID' )
+                df = polars.concat( [ first, df.slice( nfill ) ] )
+                leftover = None
+            for i in range( 0, len(df), batch_size ):
+                batch = df.slice( i, batch_size )
+                if len( batch ) < batch_size:
+                    leftover = batch
+                else:
+                    yield batch if return_format == 'polars' else batch.to_pandas()
+
+        if leftover is not None:
+            yield leftover if return_format == 'polars' else leftover.to_pandas()
+
+
+    def scan_ltcvs( self, predicate, obj_class_names=None, return_format='polars', agg=False,
+                    include_header=False, include_truth=False, workers=None, columns=None,
+                    include_features=False ):
+        """Read the lightcurves of all objects, across classes, whose HEAD information passes a filter.
+
+        The filter is applied to the HEAD table of each class first, and
+        then only the PHOT files (and rows in them) of the objects that
+        pass are read.  For example, to get all low-redshift objects
+        with lots of points:
+
+          esr.scan_ltcvs( ( polars.col('SIM_REDSHIFT_CMB') < 0.3 ) & ( polars.col('NOBS') > 20 ) )
+
+        Parameters
+        ----------
+          predicate : polars expression
+            A boolean expression on the columns of the HEAD table (see
+            get_head).  Every class scanned must have all the columns
+            used.
+
+          obj_class_names : list of str or None
+            The classes to scan.  If None, scan all of
+            self.obj_class_names.
+
+          return_format, agg, include_header, include_truth, columns, include_features
+            See get_all_ltcvs
+
+          workers : int or None
+            If None or 1, do one class after another.  Otherwise, do
+            this many classes at once in threads.  Each class being
+            worked on has its whole HEAD table in memory.
+
+        Returns
+        -------
+          A dictionary of obj_class_name -> DataFrame (pandas or polars,
+          based on return_format).  Each DataFrame is in the same format
+          as what get_all_ltcvs would return for that class, but with
+          only the objects that passed the filter.  Classes with no
+          objects passing the filter aren't in the dictionary.  (The
+          classes are kept separate because their HEAD tables don't all
+          have the same columns.)
+
+        """
+        if return_format not in ( 'polars', 'pandas' ):
+            raise ValueError( f"Unknown return_format {return_format}" )
+        columns = _check_phot_columns( columns )
+        obj_class_names = self.obj_class_names if obj_class_names is None else list( obj_class_names )
+        for obj_class_name in obj_class_names:
+            if obj_class_name not in self.subdirs:
+                raise ValueError( f"Unknown object class name {obj_class_name}" )
+
+        def scan_one_class( obj_class_name ):
+            head = self.get_head( obj_class_name ).filter( predicate )
+            self.logger.info( f"{len(head)} {obj_class_name} objects pass the filter" )
+            if len( head ) == 0:
+                return None
+            df = self._read_objects( obj_class_name, head['SNID'].to_numpy(), head['file_num'].to_numpy(),
+                                     head['PTROBS_MIN'].to_numpy(), head['PTROBS_MAX'].to_numpy(),
+                                     columns=columns )
+            if agg:
+                df = self._aggregate_ltcvs( df, obj_class_name, head, include_header, include_truth,
+                                            include_features=include_features )
+            return df if return_format == 'polars' else df.to_pandas()
+
+        results = {}
+        for obj_class_name, df in zip( obj_class_names,
+                                       _ordered_map( scan_one_class, [ ( c, ) for c in obj_class_names ],
+                                                     workers=workers ) ):
+            if df is not None:
+                results[ obj_class_name ] = df
+        return results
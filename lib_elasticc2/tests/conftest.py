@@ -0,0 +1,46 @@
+import io
+import gzip
+import random
+import tarfile
+import pytest
+
+
+def write_alert_tarball( tarpath, night=60300, nexps=4, nperexp=5, seed=42 ):
+    """Write NITE{night}-like tarball tarpath, with nexps exposures of nperexp alerts.
+
+    The alerts are just random bytes (nothing here is Avro), gzipped
+    like the real ones.  The members aren't in order of name, and
+    there's a member that isn't an alert.
+
+    Returns ( dict of member name -> member data, dict of member name ->
+    gunzipped alert ).
+
+    """
+    rng = random.Random( seed )
+    payloads = {}
+    for mjd in sorted( night + rng.random() for _ in range( nexps ) ):
+        for _ in range( nperexp ):
+            name = f"NITE{night}/alert_mjd{mjd:.4f}_obj{rng.randint(1, 10**7)}_src{rng.randint(1, 10**12)}.avro.gz"
+            payloads[ name ] = rng.randbytes( rng.randint( 0, 2000 ) )
+    members = { name: gzip.compress( payload ) for name, payload in payloads.items() }
+    names = list( members )
+    rng.shuffle( names )
+    with tarfile.open( tarpath, "w:gz" ) as tar:
+        info = tarfile.TarInfo( f"NITE{night}" )
+        info.type = tarfile.DIRTYPE
+        tar.addfile( info )
+        for name in names:
+            info = tarfile.TarInfo( name )
+            info.size = len( members[name] )
+            tar.addfile( info, io.BytesIO( members[name] ) )
+        info = tarfile.TarInfo( f"NITE{night}/README" )
+        info.size = 5
+        tar.addfile( info, io.BytesIO( b"hello" ) )
+    return members, payloads
+
+
+@pytest.fixture
+def alert_tarball( tmp_path ):
+    """( tarpath, members, payloads ) of a tarball from write_alert_tarball."""
+    tarpath = tmp_path / "NITE60300.tar.gz"
+    return ( tarpath, *write_alert_tarball( tarpath ) )
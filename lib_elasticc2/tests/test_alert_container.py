@@ -0,0 +1,135 @@
+# Tests of alert_container.py on small made-up alert tarballs (see conftest.py).
+#
+# Run these tests from the lib_elasticc2 directory with
+#  PYTHONPATH=$PWD:$PYTHONPATH python -m pytest -v tests/test_alert_container.py
+
+import os
+import pytest
+import numpy
+
+import alert_index
+import alert_container
+
+from conftest import write_alert_tarball
+
+
+@pytest.fixture( params=[ 'zstd', 'none' ] )
+def compression( request ):
+    if request.param == 'zstd':
+        pytest.importorskip( "zstandard" )
+    return request.param
+
+
+def test_container_path():
+    assert alert_container.container_path( "/a/NITE60300.tar.gz" ).as_posix() == "/a/NITE60300.alerts"
+    assert alert_container.container_path( "/a/NITE60300.tar" ).as_posix() == "/a/NITE60300.alerts"
+    assert ( alert_container.container_index_path( "/a/NITE60300.alerts" ).as_posix()
+             == "/a/NITE60300.alerts.index.npz" )
+
+
+def test_repack_and_read( alert_tarball, compression ):
+    tarpath, members, payloads = alert_tarball
+    path = alert_container.container_path( tarpath )
+    assert alert_container.read_container_index( path ) is None
+    assert alert_container.repack_tarball( tarpath, compression=compression ) == len( payloads )
+    # Already there and up to date
+    assert alert_container.repack_tarball( tarpath, compression=compression ) is None
+
+    index = alert_container.read_container_index( path )
+    names = sorted( payloads )
+    assert index['version'] == alert_container._container_version
+    assert index['compression'] == compression
+    assert index['datasize'] == path.stat().st_size
+    assert index['tarname'] == tarpath.name
+    assert index['name'].tolist() == names
+    assert index['size'].tolist() == [ len( payloads[n] ) for n in names ]
+    assert numpy.array_equal( index['mjd'], alert_index.index_tarball( tarpath )['mjd'] )
+    assert len( index['exposure_mjd'] ) == 4
+    assert numpy.array_equal( index['exposure_mjd'][ index['exposure'] ], index['mjd'] )
+    if compression == 'none':
+        assert index['datasize'] == sum( len( p ) for p in payloads.values() )
+        assert numpy.array_equal( index['exposure_size'], index['exposure_rawsize'] )
+
+    assert alert_container.read_container( path ) == [ ( n, payloads[n] ) for n in names ]
+    exposures = list( alert_container.iter_exposures( path, index ) )
+    assert [ mjd for mjd, _, _ in exposures ] == index['exposure_mjd'].tolist()
+    for mjd, expnames, exppayloads in exposures:
+        assert len( expnames ) == 5
+        assert all( alert_index._nameparse.search( n ).group(1) == f"{mjd:.4f}" for n in expnames )
+        assert exppayloads == [ payloads[n] for n in expnames ]
+
+
+def test_repack_from_index( alert_tarball ):
+    # If the tarball has an index, the container is built from it, and comes out the same
+    tarpath, members, payloads = alert_tarball
+    alert_container.repack_tarball( tarpath, compression='none' )
+    path = alert_container.container_path( tarpath )
+    expected = path.read_bytes()
+    alert_index.build_index( tarpath )
+    assert alert_container.repack_tarball( tarpath, compression='none', overwrite=True ) == len( payloads )
+    assert path.read_bytes() == expected
+
+
+def test_repack_outpath_and_errors( alert_tarball, tmp_path ):
+    tarpath, members, payloads = alert_tarball
+    outpath = tmp_path / "elsewhere" / "night.alerts"
+    outpath.parent.mkdir()
+    assert alert_container.repack_tarball( tarpath, outpath=outpath, compression='none' ) == len( payloads )
+    assert not alert_container.container_path( tarpath ).exists()
+    # The tarball isn't next to the container, so it's not checked unless it's passed
+    assert alert_container.read_container_index( outpath ) is not None
+    assert alert_container.read_container_index( outpath, tarpath ) is not None
+    assert [ n for n, _ in alert_container.read_container( outpath ) ] == sorted( payloads )
+
+    with pytest.raises( ValueError, match="Unknown compression" ):
+        alert_container.repack_tarball( tarpath, compression='gzip' )
+    with pytest.raises( ValueError, match="not a usable alert container" ):
+        list( alert_container.iter_exposures( tmp_path / "nothere.alerts" ) )
+
+
+def test_container_invalidation( alert_tarball ):
+    tarpath, members, payloads = alert_tarball
+    path = alert_container.container_path( tarpath )
+    idxpath = alert_container.container_index_path( path )
+    alert_container.repack_tarball( tarpath, compression='none' )
+    assert alert_container.read_container_index( path ) is not None
+
+    # The container's size doesn't match the index
+    with open( path, "ab" ) as ofp:
+        ofp.write( b"x" )
+    assert alert_container.read_container_index( path ) is None
+    assert alert_container.repack_tarball( tarpath, compression='none' ) == len( payloads )
+    assert alert_container.read_container_index( path ) is not None
+
+    # The tarball's mtime changed
+    st = tarpath.stat()
+    os.utime( tarpath, ns=( st.st_atime_ns, st.st_mtime_ns + 10**9 ) )
+    assert alert_container.read_container_index( path ) is None
+    assert alert_container.repack_tarball( tarpath, compression='none' ) == len( payloads )
+    assert alert_container.read_container_index( path ) is not None
+
+    # The tarball was rewritten, with the same mtime but different alerts
+    st = tarpath.stat()
+    members, payloads = write_alert_tarball( tarpath, nperexp=6, seed=43 )
+    os.utime( tarpath, ns=( st.st_atime_ns, st.st_mtime_ns ) )
+    assert tarpath.stat().st_size != st.st_size
+    assert alert_container.read_container_index( path ) is None
+    assert alert_container.repack_tarball( tarpath, compression='none' ) == len( payloads )
+    assert alert_container.read_container( path ) == sorted( payloads.items() )
+
+    # Written by an older version
+    with numpy.load( idxpath ) as npz:
+        old = { k: npz[k] for k in npz.files }
+    old['version'] = alert_container._container_version - 1
+    numpy.savez( idxpath, **old )
+    assert alert_container.read_container_index( path ) is None
+    assert alert_container.repack_tarball( tarpath, compression='none' ) == len( payloads )
+    assert alert_container.read_container_index( path ) is not None
+
+    # The tarball's gone; the container is used as is
+    tarpath.unlink()
+    assert alert_container.read_container( path ) == sorted( payloads.items() )
+
+    # The index isn't an npz file
+    idxpath.write_bytes( b"garbage" )
+    assert alert_container.read_container_index( path ) is None
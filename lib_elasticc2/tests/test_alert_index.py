@@ -0,0 +1,99 @@
+# Tests of alert_index.py on small made-up alert tarballs (see conftest.py).
+#
+# Run these tests from the lib_elasticc2 directory with
+#  PYTHONPATH=$PWD:$PYTHONPATH python -m pytest -v tests/test_alert_index.py
+
+import os
+import numpy
+
+import alert_index
+
+
+def test_index_tarball( alert_tarball ):
+    tarpath, members, _ = alert_tarball
+    index = alert_index.index_tarball( tarpath )
+    names = sorted( members )
+    assert index['name'].tolist() == names
+    assert index['size'].tolist() == [ len( members[n] ) for n in names ]
+    for i, name in enumerate( names ):
+        match = alert_index._nameparse.search( name )
+        assert index['mjd'][i] == float( match.group(1) )
+        assert index['objectId'][i] == int( match.group(2) )
+        assert index['sourceId'][i] == int( match.group(3) )
+    assert numpy.all( numpy.diff( index['mjd'] ) >= 0 )
+    # The members weren't written in order of name, so neither are the offsets
+    assert not numpy.all( numpy.diff( index['offset'] ) > 0 )
+
+
+def test_build_and_read_index( alert_tarball ):
+    tarpath, members, _ = alert_tarball
+    assert alert_index.read_index( tarpath ) is None
+    assert alert_index.build_index( tarpath ) == len( members )
+    assert alert_index.index_path( tarpath ).is_file()
+    # Already there and up to date
+    assert alert_index.build_index( tarpath ) is None
+    assert alert_index.build_index( tarpath, overwrite=True ) == len( members )
+
+    index = alert_index.read_index( tarpath )
+    expected = alert_index.index_tarball( tarpath )
+    assert index.keys() == expected.keys()
+    for k in expected:
+        assert numpy.array_equal( index[k], expected[k] )
+
+    data = alert_index.read_indexed_members( tarpath, index )
+    assert data == [ members[n] for n in index['name'] ]
+
+
+def test_read_indexed_members_subset( alert_tarball ):
+    tarpath, members, _ = alert_tarball
+    alert_index.build_index( tarpath )
+    index = alert_index.read_index( tarpath )
+    # Any subset, in any order
+    dex = numpy.array( [ 7, 2, 19, 3 ] )
+    subset = { k: v[dex] for k, v in index.items() }
+    assert alert_index.read_indexed_members( tarpath, subset ) == [ members[n] for n in subset['name'] ]
+
+
+def test_index_invalidation( alert_tarball ):
+    tarpath, members, _ = alert_tarball
+    alert_index.build_index( tarpath )
+    assert alert_index.read_index( tarpath ) is not None
+
+    # Same size, different mtime
+    st = tarpath.stat()
+    os.utime( tarpath, ns=( st.st_atime_ns, st.st_mtime_ns + 10**9 ) )
+    assert alert_index.read_index( tarpath ) is None
+    assert alert_index.build_index( tarpath ) == len( members )
+    assert alert_index.read_index( tarpath ) is not None
+
+    # Same mtime, different size
+    st = tarpath.stat()
+    with open( tarpath, "ab" ) as ofp:
+        ofp.write( b"\0" * 512 )
+    os.utime( tarpath, ns=( st.st_atime_ns, st.st_mtime_ns ) )
+    assert alert_index.read_index( tarpath ) is None
+    alert_index.build_index( tarpath )
+    assert alert_index.read_index( tarpath ) is not None
+
+    # Written by an older version
+    idxpath = alert_index.index_path( tarpath )
+    with numpy.load( idxpath ) as npz:
+        old = { k: npz[k] for k in npz.files }
+    old['version'] = alert_index._index_version - 1
+    del old['tarmtime']
+    numpy.savez( idxpath, **old )
+    assert alert_index.read_index( tarpath ) is None
+    assert alert_index.build_index( tarpath ) == len( members )
+    assert alert_index.read_index( tarpath ) is not None
+
+    # Not an npz file at all
+    idxpath.write_bytes( b"garbage" )
+    assert alert_index.read_index( tarpath ) is None
+
+
+def test_find_tarballs( tmp_path ):
+    ( tmp_path / "a" / "b" ).mkdir( parents=True )
+    for p in ( "a/NITE1.tar.gz", "a/b/NITE2.tar.gz", "a/b/other.tar.gz" ):
+        ( tmp_path / p ).touch()
+    assert alert_index.find_tarballs( [ tmp_path / "a", tmp_path / "x/NITE3.tar.gz" ] ) == [
+        tmp_path / "a/NITE1.tar.gz", tmp_path / "a/b/NITE2.tar.gz", tmp_path / "x/NITE3.tar.gz" ]
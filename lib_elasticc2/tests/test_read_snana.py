@@ -2,14 +2,35 @@
 #
 # Run these tests from the lib_elasticc2 directory with
 #  TD=<tddir> PYTHONPATH=$PWD:$PYTHONPATH python -m pytest -v tests/test_read_snana.py
+#
+# Set ELASTICC2_PARQUET=<dir> to run them against a parquet copy of the
+#  data made with write_snana_parquet.py.
+#
+# For timings that don't need the actual data, see
+#  benchmarks/bench_read_snana.py, which runs on synthetic files written
+#  by benchmarks/synthetic_snana.py.
 
+import sys
+import pathlib
 import pytest
 import pandas
 import polars
 import numpy
 import time
+import gzip
+
+import astropy.table
 
-from read_snana import elasticc2_snana_reader
+from read_snana import ( elasticc2_snana_reader, _phot_row_snids, _SNIDIndex, _merge_by_snid, _read_dump_file,
+                         _PhotFilePool, _phot_snid_rows, _sort_within_objects, _read_tagged_phot_file,
+                         _ltcv_features )
+import fits_bintable
+from fits_bintable import FITSBinTable, build_gzip_index
+from write_snana_parquet import convert_class
+
+# The synthetic data writer lives with the benchmarks
+sys.path.insert( 0, str( pathlib.Path( __file__ ).resolve().parent.parent / "benchmarks" ) )
+from synthetic_snana import write_dataset
 
 @pytest.fixture
 def esr():
@@ -68,6 +89,57 @@ def test_get_object_truth( esr ):
     assert truth.ZCMB.min() == pytest.approx( 0.1, abs=0.001 )
     assert truth.ZCMB.max() == pytest.approx( 2.9, abs=0.001 )
 
+    # Cached, so asking again doesn't reparse
+    assert esr.get_object_truth( 'AGN' ) is esr.get_object_truth( 'AGN' )
+
+
+def test_read_dump_file( tmp_path ):
+    # Doesn't need the data files
+    dumpfile = tmp_path / "test.DUMP"
+    with open( dumpfile, "w" ) as ofp:
+        ofp.write( "# A comment\n\n  VARNAMES: CID GENTYPE  ZCMB\tNAME\n\n"
+                   "SN:     12   10  0.5   abc\n"
+                   "SN: 13\t11 1 de   # trailing comment\n"
+                   "\n"
+                   "SN:   14 12   2.25 fg  \n" )
+    truth = _read_dump_file( dumpfile )
+    assert truth.columns == [ 'SNID', 'GENTYPE', 'ZCMB', 'NAME' ]
+    assert truth.dtypes == [ polars.Int64, polars.Int64, polars.Float64, polars.String ]
+    assert truth['SNID'].to_list() == [ 12, 13, 14 ]
+    assert truth['ZCMB'].to_list() == [ 0.5, 1., 2.25 ]
+    assert truth['NAME'].to_list() == [ 'abc', 'de', 'fg' ]
+
+    # A row with an extra field is an error, not silently truncated
+    with open( dumpfile, "w" ) as ofp:
+        ofp.write( "VARNAMES: CID GENTYPE ZCMB\nSN: 12 10 0.5\n\nSN: 13 11 1.0 extra\nSN: 14 12 2.25\n" )
+    with pytest.raises( ValueError, match="Line 4 of .* has 5 fields, but VARNAMES has 4" ):
+        _read_dump_file( dumpfile )
+
+    # Same as what pandas.read_csv (which this replaced) makes of it
+    def pandas_read( dumpfile ):
+        df = pandas.read_csv( dumpfile, sep=r'\s+', header=0, comment='#' )
+        return polars.from_pandas( df.drop( columns='VARNAMES:' ).rename( columns={ 'CID': 'SNID' } ) )
+
+    # Missing values (nan, NA, or the end of a short line) in float, int, and string columns
+    with open( dumpfile, "w" ) as ofp:
+        ofp.write( "VARNAMES: CID GENTYPE ZCMB NAME\n"
+                   "SN: 12 10 nan abc\n"
+                   "SN: 13 NaN 1.5 NA\n"
+                   "SN: 14 12 2.25\n"
+                   "SN: 15 13 -nan de\n" )
+    truth = _read_dump_file( dumpfile )
+    assert truth.equals( pandas_read( dumpfile ) )
+    assert truth.dtypes == [ polars.Int64, polars.Float64, polars.Float64, polars.String ]
+    assert truth['ZCMB'].to_list() == [ None, 1.5, 2.25, None ]
+    assert truth['NAME'].to_list() == [ 'abc', None, None, 'de' ]
+
+    # Lines that aren't SN: are still rows
+    with open( dumpfile, "w" ) as ofp:
+        ofp.write( "VARNAMES: CID GENTYPE ZCMB\nSN: 12 10 0.5\nNVAR: 3 4 5.\n\nSN: 14 12 2.25\n" )
+    truth = _read_dump_file( dumpfile )
+    assert truth.equals( pandas_read( dumpfile ) )
+    assert truth['SNID'].to_list() == [ 12, 3, 14 ]
+
 
 def test_get_head( esr, wastefulesr ):
     with pytest.raises( ValueError, match='Unknown object class name nonexistent' ):
@@ -75,12 +147,11 @@ def test_get_head( esr, wastefulesr ):
     with pytest.raises( ValueError, match="Unknown return_format foo" ):
         esr.get_head( 'AGN', return_format='foo' )
 
-    assert esr._head_cache is None;
-    assert esr._head_cache_class is None
+    assert len( esr._head_cache ) == 0
 
     head = esr.get_head( 'AGN' )
     assert len(head) == 108556
-    assert id(head) == id(esr._head_cache)
+    assert id(head) == id(esr._head_cache.peek('AGN'))
     assert head['SNID'].dtype == polars.Int64
     assert head['SNID'].min() == 1002462
     assert head['SNID'].max() == 159511074
@@ -90,7 +161,7 @@ def test_get_head( esr, wastefulesr ):
     head = wastefulesr.get_head( 'AGN' )
     dt_first = time.perf_counter() - t0
     assert len(head) == 108556
-    firstcache = wastefulesr._heads_cache['AGN']
+    firstcache = wastefulesr._head_cache.peek('AGN')
     assert id( firstcache ) == id( head )
 
     t0 = time.perf_counter()
@@ -98,20 +169,73 @@ def test_get_head( esr, wastefulesr ):
     dt_second = time.perf_counter() - t0
     # What's a good timing test?  This isn't going to be easily reproducible, as it depends on filesystem speed.
     assert dt_second < dt_first / 2.
-    assert id( wastefulesr._heads_cache['AGN'] ) == id( firstcache )
+    assert id( wastefulesr._head_cache.peek('AGN') ) == id( firstcache )
 
     head = wastefulesr.get_head( 'CART' )
     assert len(head) == 8926
-    assert id( wastefulesr._heads_cache['CART'] ) == id( head )
+    assert id( wastefulesr._head_cache.peek('CART') ) == id( head )
 
     head = wastefulesr.get_head( 'AGN' )
-    assert id( wastefulesr._heads_cache['AGN'] ) == id( firstcache )
+    assert id( wastefulesr._head_cache.peek('AGN') ) == id( firstcache )
 
     pahead = esr.get_head( 'AGN', return_format='pandas' )
     assert isinstance( pahead, pandas.DataFrame )
     assert len(head) == 108556
 
 
+def test_head_cache_budget():
+    # Budget of 0: only the last class is kept
+    esr = elasticc2_snana_reader()
+    esr.get_head( 'CART' )
+    esr.get_head( 'ILOT' )
+    assert 'ILOT' in esr._head_cache
+    assert 'CART' not in esr._head_cache
+    assert esr.head_cache_stats == { 'hits': 0, 'misses': 2, 'evictions': 1, 'entries': 1,
+                                     'bytes': esr._head_cache.peek('ILOT').estimated_size() }
+
+    # A budget big enough for two of these three small classes
+    cartsize = esr.get_head( 'CART' ).estimated_size()
+    esr = elasticc2_snana_reader( head_cache_bytes=3 * cartsize )
+    esr.get_head( 'CART' )
+    esr.get_head( 'ILOT' )
+    esr.get_head( 'CART' )
+    assert esr.head_cache_stats['hits'] == 1
+    assert esr.head_cache_stats['evictions'] == 0
+    esr.get_head( 'KN_K17' )
+    # ILOT was the least recently used
+    assert esr.head_cache_stats['evictions'] >= 1
+    assert 'ILOT' not in esr._head_cache
+    assert 'KN_K17' in esr._head_cache
+    assert esr.head_cache_stats['bytes'] <= 3 * cartsize or len( esr._head_cache ) == 1
+
+
+def test_head_disk_cache( tmp_path ):
+    cachedir = tmp_path / "headcache"
+    esr = elasticc2_snana_reader( head_cache_dir=cachedir )
+    t0 = time.perf_counter()
+    head = esr.get_head( 'CART' )
+    dt_first = time.perf_counter() - t0
+    assert len(head) == 8926
+    assert ( cachedir / "ELASTICC2_FINAL_CART_HEAD.arrow" ).is_file()
+    assert ( cachedir / "ELASTICC2_FINAL_CART_HEAD.json" ).is_file()
+
+    # A new reader should get the head from the cache, without reading the FITS files
+    otheresr = elasticc2_snana_reader( head_cache_dir=cachedir )
+    t0 = time.perf_counter()
+    cachedhead = otheresr.get_head( 'CART' )
+    dt_second = time.perf_counter() - t0
+    assert dt_second < dt_first / 2.
+    assert cachedhead.equals( head )
+    assert otheresr.phots['CART'] == esr.phots['CART']
+
+    # If the stamp doesn't match the files, the cache must not be used
+    stampfile = cachedir / "ELASTICC2_FINAL_CART_HEAD.json"
+    stampfile.write_text( "[]" )
+    otheresr = elasticc2_snana_reader( head_cache_dir=cachedir )
+    assert otheresr.get_head( 'CART' ).equals( head )
+    assert stampfile.read_text() != "[]"
+
+
 def test_get_ltcv( esr ):
     with pytest.raises( ValueError, match='Unknown object class name nonexistent' ):
         esr.get_ltcv( 'nonexistent', 1 )
@@ -136,6 +260,161 @@ def test_get_ltcv( esr ):
     assert ( ltcv['FLUXCAL'] / ltcv['FLUXCALERR'] ).max() == pytest.approx( 5.0, abs=0.1 )
 
 
+def test_get_ltcv_snid_index( tmp_path ):
+    cachedir = tmp_path / "headcache"
+    esr = elasticc2_snana_reader( head_cache_dir=cachedir )
+    ltcv = esr.get_ltcv( 'CART', 10388951 )
+    assert len(ltcv) == 126
+    assert ( cachedir / "ELASTICC2_FINAL_CART_SNIDINDEX.npz" ).is_file()
+
+    # A new reader should be able to use the saved index without reading the HEAD table
+    otheresr = elasticc2_snana_reader( head_cache_dir=cachedir )
+    otherltcv = otheresr.get_ltcv( 'CART', 10388951 )
+    assert otheresr.head_cache_stats['misses'] == 0
+    assert otherltcv.equals( ltcv )
+    with pytest.raises( ValueError, match='Unknown CART object id 1' ):
+        otheresr.get_ltcv( 'CART', 1 )
+
+
+def test_columns( esr ):
+    cols = [ 'MJD', 'BAND', 'FLUXCAL', 'FLUXCALERR' ]
+    with pytest.raises( ValueError, match='Unknown PHOT column FOO' ):
+        esr.get_all_ltcvs( 'ILOT', file_num=23, columns=[ 'MJD', 'FOO' ] )
+
+    ltcv = esr.get_ltcv( 'CART', 10388951, columns=cols )
+    assert ltcv.columns == cols
+    assert ltcv.equals( esr.get_ltcv( 'CART', 10388951 ).select( cols ) )
+
+    ltcvs23 = esr.get_all_ltcvs( 'ILOT', file_num=23, columns=cols )
+    assert ltcvs23.columns == cols + [ 'SNID' ]
+    assert ltcvs23.equals( esr.get_all_ltcvs( 'ILOT', file_num=23 ).select( cols + [ 'SNID' ] ) )
+
+    aggltcvs = esr.get_ltcvs( 'ILOT', ltcvs23['SNID'].unique(), agg=True, columns=cols )
+    assert aggltcvs.columns == [ 'SNID' ] + cols
+
+    batch = next( esr.iter_ltcvs( 'ILOT', batch_size=10, columns=[ 'FLUXCAL' ] ) )
+    assert batch.columns == [ 'SNID', 'FLUXCAL' ]
+
+
+def test_iter_ltcvs( esr ):
+    allltcvs = esr.get_all_ltcvs( 'ILOT', agg=True, include_header=True )
+    batches = list( esr.iter_ltcvs( 'ILOT', batch_size=100, include_header=True ) )
+    assert len(batches) == 12
+    assert all( len(b) == 100 for b in batches[:-1] )
+    assert len(batches[-1]) == 43
+    assert all( b['SNID'].is_sorted() for b in batches )
+    assert polars.concat( batches ).sort( 'SNID' ).equals( allltcvs )
+
+    batch = next( esr.iter_ltcvs( 'ILOT', batch_size=10, return_format='pandas', prefetch=0 ) )
+    assert isinstance( batch, pandas.DataFrame )
+    assert len(batch) == 10
+
+
+def test_get_ltcvs( esr ):
+    with pytest.raises( ValueError, match='Unknown CART object ids 1, 2' ):
+        esr.get_ltcvs( 'CART', [ 1, 2, 10388951 ] )
+
+    allltcvs = esr.get_all_ltcvs( 'ILOT' )
+    snids = allltcvs['SNID'].unique().sample( 100, seed=42 )
+    ltcvs = esr.get_ltcvs( 'ILOT', snids )
+    assert ltcvs.equals( allltcvs.filter( polars.col('SNID').is_in( snids ) ) )
+
+    aggltcvs = esr.get_ltcvs( 'ILOT', snids, agg=True, include_header=True )
+    assert len(aggltcvs) == 100
+    assert len(aggltcvs.columns) == 175
+    assert aggltcvs.equals( esr.get_all_ltcvs( 'ILOT', agg=True, include_header=True )
+                            .filter( polars.col('SNID').is_in( snids ) ) )
+
+    ltcvs = esr.get_ltcvs( 'CART', [ 10388951 ], return_format='pandas' )
+    assert isinstance( ltcvs, pandas.DataFrame )
+    assert len(ltcvs) == 126
+
+
+def test_scan_ltcvs( esr ):
+    pred = ( polars.col('SIM_REDSHIFT_CMB') < 0.3 ) & ( polars.col('NOBS') > 20 )
+    results = esr.scan_ltcvs( pred, obj_class_names=[ 'CART', 'ILOT' ], agg=True, include_header=True,
+                              workers=2 )
+    for obj_class_name in [ 'CART', 'ILOT' ]:
+        expected = esr.get_head( obj_class_name ).filter( pred )
+        if len( expected ) == 0:
+            assert obj_class_name not in results
+            continue
+        assert set( results[obj_class_name]['SNID'] ) == set( expected['SNID'] )
+        assert ( results[obj_class_name]['SIM_REDSHIFT_CMB'] < 0.3 ).all()
+        assert results[obj_class_name].equals( esr.get_ltcvs( obj_class_name, expected['SNID'], agg=True,
+                                                              include_header=True ) )
+
+    assert esr.scan_ltcvs( polars.col('NOBS') < 0, obj_class_names=[ 'CART' ] ) == {}
+
+
+def test_snid_index( tmp_path ):
+    index = _SNIDIndex( [ 30, 10, 20, 20 ], [ '0002', '0001', '0001', '0003' ], [ 1, 5, 1, 7 ], [ 4, 9, 3, 8 ] )
+    count, file_num, ptrmin, ptrmax = index.lookup( [ 10, 30, 15, 20 ] )
+    assert list( count ) == [ 1, 1, 0, 2 ]
+    assert list( file_num[:2] ) == [ '0001', '0002' ]
+    assert list( ptrmin[:2] ) == [ 5, 1 ]
+    assert list( ptrmax[:2] ) == [ 9, 4 ]
+
+    index.save( tmp_path / "index.npz", [ "stamp", 1 ] )
+    assert _SNIDIndex.load( tmp_path / "index.npz", [ "stamp", 2 ] ) is None
+    loaded = _SNIDIndex.load( tmp_path / "index.npz", [ "stamp", 1 ] )
+    for got, expected in zip( loaded.lookup( [ 10, 30, 15, 20 ] ), ( count, file_num, ptrmin, ptrmax ) ):
+        assert list( got ) == list( expected )
+
+
+def test_lazy( esr ):
+    head = esr.get_head( 'ILOT', return_format='lazy' )
+    assert isinstance( head, polars.LazyFrame )
+    assert head.collect().equals( esr.get_head( 'ILOT' ) )
+
+    lazy = esr.get_all_ltcvs( 'ILOT', file_num=23, return_format='lazy', agg=True, include_header=True )
+    assert isinstance( lazy, polars.LazyFrame )
+    eager = esr.get_all_ltcvs( 'ILOT', file_num=23, agg=True, include_header=True )
+    assert lazy.collect().equals( eager )
+    assert ( lazy.filter( polars.col('NOBS') > 20 ).select( 'SNID', 'FLUXCAL' ).collect()
+             .equals( eager.filter( polars.col('NOBS') > 20 ).select( 'SNID', 'FLUXCAL' ) ) )
+
+
+def test_get_features( tmp_path ):
+    esr = elasticc2_snana_reader( head_cache_dir=tmp_path )
+    features = esr.get_features( 'ILOT' )
+    assert features['SNID'].is_sorted()
+    assert len( features ) == len( esr.get_head( 'ILOT' ) )
+    assert ( tmp_path / "ELASTICC2_FINAL_ILOT_FEATURES.arrow" ).is_file()
+
+    ltcvs = esr.get_all_ltcvs( 'ILOT', file_num=23 )
+    for snid in features.filter( polars.col('SNID').is_in( ltcvs['SNID'] ) )['SNID'][:10]:
+        ltcv = ltcvs.filter( polars.col('SNID') == snid )
+        row = features.filter( polars.col('SNID') == snid ).row( 0, named=True )
+        det = ( ltcv['PHOTFLAG'] & esr.photflag_detect ) != 0
+        assert row['LC_NPOINTS'] == len( ltcv )
+        assert row['LC_NDET'] == det.sum()
+        assert row['LC_NDET_g'] == ( det & ( ltcv['BAND'] == 'g' ) ).sum()
+        assert row['LC_FLUXCAL_MAX'] == ltcv['FLUXCAL'].max()
+        assert row['LC_NSATURATED'] == ( ( ltcv['PHOTFLAG'] & esr.photflag_saturate ) != 0 ).sum()
+
+    # A new reader gets them from the disk cache
+    assert elasticc2_snana_reader( head_cache_dir=tmp_path ).get_features( 'ILOT' ).equals( features )
+
+    agg = esr.get_all_ltcvs( 'ILOT', file_num=23, agg=True, include_features=True )
+    assert agg.join( features, on='SNID' ).select( agg.columns ).equals( agg )
+
+
+def test_ltcv_features_missing():
+    # Doesn't need the data files
+    # Object 1 has only non-detections, in r; object 2 has a detection in g
+    df = polars.DataFrame( { 'SNID': [ 1, 1, 2 ], 'MJD': [ 60000., 60001., 60002. ], 'BAND': [ 'r', 'r', 'g' ],
+                             'PHOTFLAG': [ 0, 0, 4096 ], 'FLUXCAL': [ 1., 2., 30. ], 'FLUXCALERR': [ 1., 1., 1. ] } )
+    features = _ltcv_features( df )
+    assert features['LC_NDET'].to_list() == [ 0, 1 ]
+    assert features['LC_NDET_g'].to_list() == [ 0, 1 ]
+    assert features['LC_NDET_r'].to_list() == [ 0, 0 ]
+    assert features['LC_FLUXCAL_MAX_g'].to_list() == [ None, 30. ]
+    assert features['LC_MJD_FIRST_DET'].to_list() == [ None, 60002. ]
+    assert features['LC_DET_SPAN'].to_list() == [ None, 0. ]
+    assert features['LC_MJD_TRIGGER'].to_list() == [ None, None ]
+
+
 def test_get_all_ltcvs( esr ):
     # Use ILOT since there aren't very many so the test will go fast
     ltcvs23 = esr.get_all_ltcvs( 'ILOT', file_num=23 )
@@ -159,6 +438,9 @@ def test_get_all_ltcvs( esr ):
     for col in ltcv.columns:
         assert ( ltcv[col] == allltcvs.filter( polars.col('SNID') == snid )[col] ).all()
 
+    parallelltcvs = esr.get_all_ltcvs( 'ILOT', workers=4, max_files_in_flight=6 )
+    assert parallelltcvs.equals( allltcvs )
+
     allltcvs = esr.get_all_ltcvs( 'ILOT', agg=True )
     assert len(allltcvs) == 1143
     assert set( allltcvs.columns ) == { 'SNID', 'MJD', 'BAND', 'PHOTFLAG', 'PHOTPROB', 'FLUXCAL',
@@ -180,5 +462,306 @@ def test_get_all_ltcvs( esr ):
     assert allltcvs.select( a=(polars.col('SIM_PEAKMAG_g') - polars.col('PEAKMAG_g')).abs() < 0.0001 )['a'].all()
 
 
-
-
+def test_read_stats():
+    # FITS files, even if $ELASTICC2_PARQUET is set, since parquet reads don't have all the stages
+    esr = elasticc2_snana_reader( parquet_dir=None )
+    assert esr.read_stats == {}
+    ltcvs = esr.get_all_ltcvs( 'ILOT', file_num=23, agg=True, include_header=True )
+    stats = esr.read_stats
+    for stage in [ 'head', 'open', 'decode', 'tag', 'sort', 'concat', 'agg', 'join' ]:
+        assert stats[stage]['calls'] >= 1
+        assert stats[stage]['seconds'] >= 0.
+    assert stats['decode']['rows'] > stats['tag']['rows'] == 9827
+    assert stats['decode']['bytes'] > 0
+    assert stats['agg']['rows'] == len( ltcvs )
+
+    esr.reset_read_stats()
+    esr.get_ltcv( 'ILOT', ltcvs['SNID'][0] )
+    assert set( esr.read_stats.keys() ) == { 'open', 'decode' }
+
+
+def test_phot_row_snids():
+    # Doesn't need the data files.  Three objects with the usual one-row separators,
+    #   but with the HEAD rows out of PTROBS order.
+    snids = _phot_row_snids( 10, [ 6, 1, 4 ], [ 9, 2, 4 ], [ 30, 10, 20 ] )
+    assert snids.dtype == numpy.int64
+    assert list( snids ) == [ 10, 10, -999, 20, -999, 30, 30, 30, 30, -999 ]
+
+    assert list( _phot_row_snids( 3, [], [], [] ) ) == [ -999, -999, -999 ]
+
+    with pytest.raises( ValueError, match="overlap" ):
+        _phot_row_snids( 10, [ 1, 2 ], [ 3, 4 ], [ 10, 20 ] )
+
+
+def test_merge_by_snid():
+    # Doesn't need the data files
+    a = polars.DataFrame( { 'SNID': [ 1, 1, 5, 9 ], 'x': [ 2, 1, 0, 0 ] } )
+    b = polars.DataFrame( { 'SNID': [ 2, 3, 3, 10 ], 'x': [ 7, 9, 8, 1 ] } )
+    c = polars.DataFrame( { 'SNID': [ 20, 21 ], 'x': [ 0, 0 ] } )
+    # Overlapping ranges get merged, keeping the order within each SNID
+    merged = _merge_by_snid( [ a, b, c ] )
+    assert merged['SNID'].to_list() == [ 1, 1, 2, 3, 3, 5, 9, 10, 20, 21 ]
+    assert merged['x'].to_list() == [ 2, 1, 7, 9, 8, 0, 0, 1, 0, 0 ]
+    assert _merge_by_snid( [ a.lazy(), b.lazy(), c.lazy() ] ).collect().equals( merged )
+    # Non-overlapping ones just get put in order
+    assert _merge_by_snid( [ c, a.head(0), a ] ).equals( polars.concat( [ a, c ] ) )
+
+
+def test_sort_within_objects():
+    # Doesn't need the data files
+    # Objects 30, 10, 20 in the file (HEAD not in SNID order), separator rows between them
+    ptrmin = numpy.array( [ 2, 6, 9 ] )
+    ptrmax = numpy.array( [ 4, 7, 11 ] )
+    snids = numpy.array( [ 30, 10, 20 ] )
+    rows, sortedsnids, lens = _phot_snid_rows( 12, ptrmin, ptrmax, snids )
+    assert rows.tolist() == [ 5, 6, 8, 9, 10, 1, 2, 3 ]
+    assert sortedsnids.tolist() == [ 10, 20, 30 ]
+    assert lens.tolist() == [ 2, 3, 3 ]
+    with pytest.raises( ValueError, match="overlap" ):
+        _phot_snid_rows( 12, ptrmin, numpy.array( [ 6, 7, 11 ] ), snids )
+    with pytest.raises( ValueError, match="past the end" ):
+        _phot_snid_rows( 10, ptrmin, ptrmax, snids )
+
+    df = polars.DataFrame( { 'SNID': [ 10, 10, 10, 10, 20, 20, 20 ],
+                             'BAND': [ 'r', 'g', 'r', 'g', 'u', 'Y', 'u' ],
+                             'MJD': [ 1., 2., 3., 4., 1., 1., 2. ],
+                             'x': [ 0, 1, 2, 3, 4, 5, 6 ] } )
+    fullsort = df.sort( [ 'SNID', 'BAND', 'MJD' ] )
+    assert _sort_within_objects( df, [ 4, 3 ] ).equals( fullsort )
+    assert _sort_within_objects( df.drop( 'MJD' ), [ 4, 3 ] )['x'].to_list() == [ 1, 3, 0, 2, 5, 4, 6 ]
+    assert _sort_within_objects( df.drop( 'BAND', 'MJD' ), [ 4, 3 ] ).equals( df.drop( 'BAND', 'MJD' ) )
+    # Points not in time order still come out sorted
+    df = df.with_columns( MJD=polars.Series( [ 3., 2., 1., 4., 2., 1., 1. ] ) )
+    assert _sort_within_objects( df, [ 4, 3 ] ).equals( df.sort( [ 'SNID', 'BAND', 'MJD' ] ) )
+    assert _sort_within_objects( df.drop( 'BAND' ), [ 4, 3 ] ).equals( df.drop( 'BAND' ).sort( [ 'SNID', 'MJD' ] ) )
+
+
+def test_read_tagged_phot_file_sort( tmp_path ):
+    # Doesn't need the data files
+    write_dataset( tmp_path, classes=[ 'CART' ], nfiles=1, objects_per_file=200, mean_points=30 )
+    esr = elasticc2_snana_reader( tmp_path, parquet_dir=None )
+    head = esr.get_head( 'CART' ).sample( fraction=1., shuffle=True, seed=42 )
+    photfile = esr.phots['CART'][ head['file_num'][0] ]
+    args = ( photfile, head['PTROBS_MIN'].to_numpy(), head['PTROBS_MAX'].to_numpy(), head['SNID'].to_numpy() )
+    unsorted = _read_tagged_phot_file( *args )
+    for columns in ( None, [ 'MJD', 'FLUXCAL' ], [ 'BAND', 'FLUXCAL' ] ):
+        sortcols = [ 'SNID' ] + [ c for c in ( 'BAND', 'MJD' ) if columns is None or c in columns ]
+        expected = unsorted.select( ( columns if columns is not None else unsorted.columns[:-1] ) + [ 'SNID' ] )
+        assert ( _read_tagged_phot_file( *args, columns=columns, sort=True )
+                 .equals( expected.sort( sortcols, maintain_order=True ) ) )
+
+
+def test_fits_bintable( tmp_path ):
+    # Doesn't need the data files
+    tab = astropy.table.Table()
+    tab['MJD'] = numpy.array( [ 60800.5, -777., 60801.25 ] )
+    tab['BAND'] = numpy.array( [ b'g ', b'- ', b'Y ' ], dtype='S2' )
+    tab['SNID'] = numpy.array( [ b'  12345 ', b'', b'6' ], dtype='S8' )
+    tab['PHOTFLAG'] = numpy.array( [ 4096, 0, 6144 ], dtype=numpy.int32 )
+    tab['FLUXCAL'] = numpy.array( [ 1.5, 0., -2.25 ], dtype=numpy.float32 )
+    tab['CCDNUM'] = numpy.array( [ 1, 2, 3 ], dtype=numpy.int16 )
+    tab['VEC'] = numpy.array( [ [ 1, 2 ], [ 3, 4 ], [ 5, 6 ] ], dtype=numpy.int64 )
+    tab.write( tmp_path / "test.fits" )
+    with open( tmp_path / "test.fits", "rb" ) as ifp, gzip.open( tmp_path / "test.fits.gz", "wb" ) as ofp:
+        ofp.write( ifp.read() )
+
+    for fname in [ "test.fits", "test.fits.gz" ]:
+        with FITSBinTable( tmp_path / fname ) as fbt:
+            assert fbt.nrows == 3
+            assert fbt.columns == [ 'MJD', 'BAND', 'SNID', 'PHOTFLAG', 'FLUXCAL', 'CCDNUM', 'VEC' ]
+            df = polars.from_arrow( fbt.read() )
+            assert df['MJD'].dtype == polars.Float64
+            assert df['FLUXCAL'].dtype == polars.Float32
+            assert df['PHOTFLAG'].dtype == polars.Int32
+            assert df['CCDNUM'].dtype == polars.Int16
+            assert list( df['MJD'] ) == [ 60800.5, -777., 60801.25 ]
+            assert list( df['BAND'] ) == [ 'g', '-', 'Y' ]
+            assert list( df['SNID'] ) == [ '12345', '', '6' ]
+            assert list( df['PHOTFLAG'] ) == [ 4096, 0, 6144 ]
+            assert list( df['FLUXCAL'] ) == [ 1.5, 0., -2.25 ]
+            assert [ list(v) for v in df['VEC'] ] == [ [ 1, 2 ], [ 3, 4 ], [ 5, 6 ] ]
+
+            sub = polars.from_arrow( fbt.read( columns=[ 'BAND', 'MJD' ], ptrmin=1, ptrmax=3 ) )
+            assert sub.columns == [ 'BAND', 'MJD' ]
+            assert list( sub['BAND'] ) == [ '-', 'Y' ]
+            sub = polars.from_arrow( fbt.read( columns=[ 'FLUXCAL' ], rows=numpy.array( [ 2, 0 ] ) ) )
+            assert list( sub['FLUXCAL'] ) == [ -2.25, 1.5 ]
+
+    # Random access into the gzipped file through an index
+    build_gzip_index( tmp_path / "test.fits.gz", tmp_path / "test.fits.gz.gzidx" )
+    with FITSBinTable( tmp_path / "test.fits" ) as fbt, \
+         FITSBinTable( tmp_path / "test.fits.gz", gzip_index=tmp_path / "test.fits.gz.gzidx" ) as gzfbt:
+        assert gzfbt.columns == fbt.columns
+        assert gzfbt.read().equals( fbt.read() )
+        assert gzfbt.read( columns=[ 'BAND', 'VEC' ], ptrmin=1, ptrmax=3 ).equals(
+            fbt.read( columns=[ 'BAND', 'VEC' ], ptrmin=1, ptrmax=3 ) )
+        assert gzfbt.read( rows=numpy.array( [ 2, 0 ] ) ).equals( fbt.read( rows=numpy.array( [ 2, 0 ] ) ) )
+
+
+def test_phot_file_pool( tmp_path ):
+    # Doesn't need the data files
+    tab = astropy.table.Table()
+    tab['MJD'] = numpy.arange( 10, dtype=numpy.float64 )
+    for i in range( 3 ):
+        tab.write( tmp_path / f"test{i}.fits" )
+    with open( tmp_path / "test0.fits", "rb" ) as ifp, gzip.open( tmp_path / "test0.fits.gz", "wb" ) as ofp:
+        ofp.write( ifp.read() )
+
+    pool = _PhotFilePool( max_files=2 )
+    with pool.open( tmp_path / "test0.fits" ) as fbt:
+        first = fbt
+        assert list( polars.from_arrow( fbt.read( ptrmin=2, ptrmax=4 ) )['MJD'] ) == [ 2., 3. ]
+    with pool.open( tmp_path / "test0.fits" ) as fbt:
+        assert fbt is first
+    assert pool.stats == { 'hits': 1, 'misses': 1, 'evictions': 0, 'entries': 1 }
+
+    # A file that's in use when it's evicted stays usable until it's done
+    with pool.open( tmp_path / "test0.fits" ) as fbt:
+        with pool.open( tmp_path / "test1.fits" ), pool.open( tmp_path / "test2.fits" ):
+            pass
+        assert len( pool ) == 2
+        assert fbt.data is not None
+    assert first.data is None
+    assert pool.stats['evictions'] == 1
+
+    # Gzipped files without an index aren't kept
+    with pool.open( tmp_path / "test0.fits.gz" ) as fbt:
+        assert fbt.nrows == 10
+    assert len( pool ) == 2
+
+    pool.clear()
+    assert len( pool ) == 0
+
+
+def test_gzip_index_dir( tmp_path ):
+    # Doesn't need the data files
+    if fits_bintable.indexed_gzip is None:
+        pytest.skip( "indexed_gzip isn't installed" )
+    datadir = tmp_path / "data"
+    write_dataset( datadir, classes=[ 'CART' ], nfiles=2, objects_per_file=50, mean_points=20 )
+    snid = int( elasticc2_snana_reader( datadir, parquet_dir=None ).get_head( 'CART' )['SNID'][10] )
+
+    # Reads use indexes, but never build them
+    esr = elasticc2_snana_reader( datadir, parquet_dir=None, gzip_index_dir=tmp_path / "gzidx" )
+    ltcv = esr.get_ltcv( 'CART', snid )
+    assert list( datadir.glob( "**/*.gzidx" ) ) == []
+    assert not ( tmp_path / "gzidx" ).exists()
+
+    # build_gzip_indexes writes them to gzip_index_dir, not next to the data
+    indexes = esr.build_gzip_indexes( 'CART' )
+    assert len( indexes ) == 2
+    assert all( i.parent == tmp_path / "gzidx" for i in indexes )
+    assert list( datadir.glob( "**/*.gzidx" ) ) == []
+    esr.close_phot_files()
+    assert esr.get_ltcv( 'CART', snid ).equals( ltcv )
+    assert all( str( k[1] ).startswith( str( tmp_path / "gzidx" ) ) for k in esr._phot_pool._entries.keys() )
+    assert len( esr._phot_pool ) > 0
+
+
+def test_lazy_ltcvs_fits( tmp_path ):
+    # Doesn't need the data files
+    write_dataset( tmp_path, classes=[ 'CART' ], nfiles=3, objects_per_file=50, mean_points=20 )
+    esr = elasticc2_snana_reader( tmp_path, parquet_dir=None )
+    eager = esr.get_all_ltcvs( 'CART' )
+    esr.reset_read_stats()
+
+    # Nothing is read until it's collected, and then only the columns needed
+    lf = esr.get_all_ltcvs( 'CART', return_format='lazy' )
+    assert isinstance( lf, polars.LazyFrame )
+    assert 'decode' not in esr.read_stats
+    assert lf.collect().equals( eager )
+    allbytes = esr.read_stats['decode']['bytes']
+    esr.reset_read_stats()
+    snid = int( eager['SNID'][len(eager) // 2] )
+    assert ( lf.filter( polars.col('SNID') < snid ).select( 'SNID', 'FLUXCAL' ).collect()
+             .equals( eager.filter( polars.col('SNID') < snid ).select( 'SNID', 'FLUXCAL' ) ) )
+    assert esr.read_stats['decode']['bytes'] < allbytes / 2
+
+    assert ( esr.get_all_ltcvs( 'CART', return_format='lazy', agg=True, include_header=True ).collect()
+             .equals( esr.get_all_ltcvs( 'CART', agg=True, include_header=True ) ) )
+
+
+def test_lazy_ltcvs_fits_no_io_plugins( tmp_path, monkeypatch ):
+    # Without polars' IO plugins, the files are read up front, but the results are the same
+    import read_snana
+    monkeypatch.setattr( read_snana, '_register_io_source', None )
+    write_dataset( tmp_path, classes=[ 'CART' ], nfiles=3, objects_per_file=50, mean_points=20 )
+    esr = elasticc2_snana_reader( tmp_path, parquet_dir=None )
+    lf = esr.get_all_ltcvs( 'CART', return_format='lazy' )
+    assert isinstance( lf, polars.LazyFrame )
+    assert lf.collect().equals( esr.get_all_ltcvs( 'CART' ) )
+    assert ( lf.filter( polars.col('FLUXCAL') > 0 ).select( 'SNID', 'MJD' ).collect()
+             .equals( esr.get_all_ltcvs( 'CART' ).filter( polars.col('FLUXCAL') > 0 ).select( 'SNID', 'MJD' ) ) )
+
+
+def test_get_ltcvs_empty( tmp_path ):
+    # Doesn't need the data files
+    write_dataset( tmp_path, classes=[ 'CART' ], nfiles=2, objects_per_file=20, mean_points=10 )
+    esr = elasticc2_snana_reader( tmp_path, parquet_dir=None )
+    full = esr.get_ltcvs( 'CART', esr.get_head( 'CART' )['SNID'][:3] )
+
+    df = esr.get_ltcvs( 'CART', [] )
+    assert len( df ) == 0
+    assert df.schema == full.schema
+    df = esr.get_ltcvs( 'CART', [], columns=[ 'MJD', 'FLUXCAL' ] )
+    assert df.columns == [ 'MJD', 'FLUXCAL', 'SNID' ]
+    assert len( esr.get_ltcvs( 'CART', numpy.array( [], dtype=numpy.int64 ), agg=True, include_header=True ) ) == 0
+    assert len( esr.get_ltcvs( 'CART', [], return_format='pandas' ) ) == 0
+
+
+def test_parquet_incomplete( tmp_path ):
+    # Doesn't need the data files
+    fitsdir = tmp_path / "fits"
+    pqdir = tmp_path / "parquet"
+    write_dataset( fitsdir, classes=[ 'CART' ], nfiles=3, objects_per_file=20, mean_points=10 )
+    fitsesr = elasticc2_snana_reader( fitsdir, parquet_dir=None )
+    assert convert_class( 'CART', pqdir, elasticc2_snana_dir=fitsdir )[0] > 0
+    assert ( pqdir / "complete" / "class=CART" ).is_file()
+    pqesr = elasticc2_snana_reader( fitsdir, parquet_dir=pqdir )
+    assert pqesr._use_parquet( 'CART' )
+    assert pqesr.get_head( 'CART' ).equals( fitsesr.get_head( 'CART' ) )
+
+    snid = fitsesr.get_head( 'CART' )['SNID'][0]
+    for esr in ( fitsesr, pqesr ):
+        with pytest.raises( ValueError, match="Unknown return_format" ):
+            esr.get_ltcv( 'CART', snid, return_format='foo' )
+
+    # A conversion that didn't finish isn't used
+    ( pqdir / "complete" / "class=CART" ).unlink()
+    next( ( pqdir / "phot" / "class=CART" ).glob( "*/data.parquet" ) ).unlink()
+    pqesr = elasticc2_snana_reader( fitsdir, parquet_dir=pqdir )
+    assert not pqesr._use_parquet( 'CART' )
+    assert pqesr.get_head( 'CART' ).equals( fitsesr.get_head( 'CART' ) )
+    assert pqesr.get_all_ltcvs( 'CART' ).equals( fitsesr.get_all_ltcvs( 'CART' ) )
+
+    # Resuming the conversion finishes it
+    assert convert_class( 'CART', pqdir, elasticc2_snana_dir=fitsdir ) == ( 2, 5 )
+    pqesr = elasticc2_snana_reader( fitsdir, parquet_dir=pqdir )
+    assert pqesr._use_parquet( 'CART' )
+    assert pqesr.get_all_ltcvs( 'CART' ).equals( fitsesr.get_all_ltcvs( 'CART' ) )
+
+
+def test_native_fits_reader( esr ):
+    astropyesr = elasticc2_snana_reader( fits_reader='astropy' )
+    assert esr.get_head( 'CART' ).equals( astropyesr.get_head( 'CART' ) )
+    assert esr.get_all_ltcvs( 'CART', file_num=7 ).equals( astropyesr.get_all_ltcvs( 'CART', file_num=7 ) )
+
+
+def test_parquet_backend( tmp_path ):
+    fitsesr = elasticc2_snana_reader( parquet_dir=None )
+    assert convert_class( 'ILOT', tmp_path ) == ( 81, 0 )
+    # Resumes rather than redoing things
+    assert convert_class( 'ILOT', tmp_path ) == ( 0, 81 )
+
+    pqesr = elasticc2_snana_reader( parquet_dir=tmp_path )
+    assert pqesr.get_head( 'ILOT' ).equals( fitsesr.get_head( 'ILOT' ) )
+    assert pqesr.get_object_truth( 'ILOT' ).equals( fitsesr.get_object_truth( 'ILOT' ) )
+    snids = fitsesr.get_head( 'ILOT' )['SNID'][ ::500 ]
+    for snid in snids[:5]:
+        assert pqesr.get_ltcv( 'ILOT', snid ).equals( fitsesr.get_ltcv( 'ILOT', snid ) )
+    assert pqesr.get_ltcvs( 'ILOT', snids, agg=True ).equals( fitsesr.get_ltcvs( 'ILOT', snids, agg=True ) )
+    assert ( pqesr.get_all_ltcvs( 'ILOT', file_num=23, columns=[ 'MJD', 'FLUXCAL' ] )
+             .equals( fitsesr.get_all_ltcvs( 'ILOT', file_num=23, columns=[ 'MJD', 'FLUXCAL' ] ) ) )
+
+    # Classes not in the parquet dataset come from the FITS files
+    assert pqesr.get_head( 'CART' ).equals( fitsesr.get_head( 'CART' ) )
@@ -1,30 +1,190 @@
 import sys
+import os
+import json
 import logging
 import pathlib
+import argparse
+import multiprocessing
+import concurrent.futures
 
 import polars
 
-from read_snana import elasticc2_snana_reader
+from read_snana import elasticc2_snana_reader, _read_tagged_phot_file, _phot_columns, _logger
+
+
+# The dataset written looks like
+#
+#   {outdir}/phot/class={class}/file_num={file_num}/data.parquet
+#   {outdir}/head/class={class}/file_num={file_num}/data.parquet
+#   {outdir}/truth/class={class}/data.parquet
+#   {outdir}/complete/class={class}
+#
+# i.e. hive-partitioned by object class and by which SNANA file the
+# objects came from.  (file_num is the zero-padded string, e.g. 0001.)
+# Within each PHOT file, rows are sorted by SNID (keeping the points of
+# each object in the order SNANA wrote them), and row groups carry min/max
+# statistics, so a reader looking for particular SNIDs only has to
+# decompress the row groups that can hold them.  HEAD rows are kept in
+# the same order as in the FITS files.  The partition columns aren't
+# stored in the files themselves.  Read it back with
+# elasticc2_snana_reader( parquet_dir=outdir ).
+#
+# Each output file is written to a temporary name and then renamed into
+# place, so a file that exists is complete.  Re-running the conversion
+# skips anything already written, which makes it resumable after a crash
+# or a failure in one class.  complete/class={class} (a JSON list of the
+# class's file_nums) is written last, once everything else for the class
+# is there; the reader ignores a class without it.
+
+
+def _write_atomic( df, path, row_group_size, compression ):
+    """Write df to parquet file path via a temporary file, so path never holds a partial file."""
+    path.parent.mkdir( parents=True, exist_ok=True )
+    tmppath = path.parent / f".{path.name}.{os.getpid()}.tmp"
+    try:
+        df.write_parquet( tmppath, compression=compression, statistics=True, row_group_size=row_group_size )
+        os.replace( tmppath, path )
+    finally:
+        tmppath.unlink( missing_ok=True )
+
+
+def convert_class( obj_class_name, outdir, elasticc2_snana_dir=None, dir_prefix='ELASTICC2_FINAL_',
+                   row_group_size=65536, compression='zstd', overwrite=False ):
+    """Convert one class of SNANA FITS files to the parquet dataset in outdir.
+
+    Reads one HEAD/PHOT file pair at a time, so memory use is set by the
+    biggest single PHOT file, not by the class.
+
+    Parameters
+    ----------
+      obj_class_name : str
+        The class to convert
+
+      outdir : Path
+        Top of the parquet dataset
+
+      elasticc2_snana_dir, dir_prefix
+        Passed on to elasticc2_snana_reader (elasticc2_snana_dir=None
+        means use its default).
+
+      row_group_size : int
+        Maximum rows per parquet row group
+
+      compression : str
+        Parquet compression codec
+
+      overwrite : bool
+        If False, skip output files that already exist
+
+    Returns
+    -------
+      ( nwritten, nskipped ) : number of files written and skipped
+
+    """
+    # Make sure to read the FITS files even if $ELASTICC2_PARQUET is set
+    kwargs = { 'dir_prefix': dir_prefix, 'parquet_dir': None }
+    if elasticc2_snana_dir is not None:
+        kwargs['elasticc2_snana_dir'] = elasticc2_snana_dir
+    esr = elasticc2_snana_reader( **kwargs )
+    if obj_class_name not in esr.obj_class_names:
+        raise ValueError( f"Unknown object class name {obj_class_name}" )
+
+    outdir = pathlib.Path( outdir )
+    nwritten = 0
+    nskipped = 0
+
+    # Until this is written again at the end, the class is incomplete
+    completefile = outdir / "complete" / f"class={obj_class_name}"
+    if overwrite:
+        completefile.unlink( missing_ok=True )
+
+    truthfile = outdir / "truth" / f"class={obj_class_name}" / "data.parquet"
+    if overwrite or not truthfile.is_file():
+        try:
+            truth = esr.get_object_truth( obj_class_name )
+            _write_atomic( truth, truthfile, row_group_size, compression )
+            nwritten += 1
+        except FileNotFoundError as ex:
+            esr.logger.warning( f"{obj_class_name}: {ex}; not writing truth" )
+    else:
+        nskipped += 1
+
+    foundheads = esr._find_head_files( obj_class_name )
+    for num in sorted( foundheads.keys() ):
+        headfile = outdir / "head" / f"class={obj_class_name}" / f"file_num={num}" / "data.parquet"
+        photfile = outdir / "phot" / f"class={obj_class_name}" / f"file_num={num}" / "data.parquet"
+        if ( not overwrite ) and headfile.is_file() and photfile.is_file():
+            nskipped += 2
+            continue
+
+        head = esr._read_head_files( obj_class_name, { num: foundheads[num] } )
+        phot = _read_tagged_phot_file( esr.phots[obj_class_name][num], head['PTROBS_MIN'].to_numpy(),
+                                       head['PTROBS_MAX'].to_numpy(), head['SNID'].to_numpy(),
+                                       fits_reader=esr.fits_reader )
+        phot = phot.select( [ 'SNID' ] + _phot_columns ).sort( 'SNID', maintain_order=True )
+        _write_atomic( phot, photfile, row_group_size, compression )
+        _write_atomic( head.drop( 'file_num' ), headfile, row_group_size, compression )
+        nwritten += 2
+        esr.logger.debug( f"{obj_class_name} file {num}: {len(head)} objects, {len(phot)} points" )
+
+    completefile.parent.mkdir( parents=True, exist_ok=True )
+    tmppath = completefile.parent / f".{completefile.name}.{os.getpid()}.tmp"
+    try:
+        tmppath.write_text( json.dumps( sorted( foundheads.keys() ) ) )
+        os.replace( tmppath, completefile )
+    finally:
+        tmppath.unlink( missing_ok=True )
+
+    return nwritten, nskipped
 
 
 def main():
-    esr = elasticc2_snana_reader()
-    esr.logger.setLevel( logging.DEBUG )
-    outdir = pathlib.Path( "/data/raknop/ELASTICC2_parquet" )
-
-    for objclass in [ 'AGN', 'CART', 'Cepheid', 'EB', 'ILOT', 'KN_B19', 'KN_K17',
-                      'Mdwarf-flare', 'PISN-MOSFIT', 'PISN-STELLA_HECORE',
-                      'PISN-STELLA_HYDROGENIC', 'RRL', 'SL-SN1a', 'SL-SNII', 'SL-SNIb',
-                      'SL-SNIc', 'SLSN-I+host', 'SLSN-I_no_host', 'SNII+HostXT_V19',
-                      'SNII-NMF', 'SNII-Templates', 'SNIIb+HostXT_V19', 'SNIIn+HostXT_V19',
-                      'SNIIn-MOSFIT', 'SNIa-91bg', 'SNIa-SALT3', 'SNIax', 'SNIb+HostXT_V19',
-                      'SNIb-Templates', 'SNIc+HostXT_V19', 'SNIc-Templates',
-                      'SNIcBL+HostXT_V19', 'TDE', 'd-Sct', 'dwarf-nova', 'uLens-Binary',
-                      'uLens-Single-GenLens', 'uLens-Single_PyLIMA' ]:
-    # for objclass in [ 'KN_K17' ]:
-        ltcvs = esr.get_all_ltcvs( objclass, agg=True, include_header=True )
-        ltcvs.write_parquet( outdir / f'{objclass}.parquet' )
-        sys.stderr.write( f"Did {objclass}\n" )
+    parser = argparse.ArgumentParser( description="Convert ELAsTiCC2 SNANA FITS files to a parquet dataset",
+                                      formatter_class=argparse.ArgumentDefaultsHelpFormatter )
+    parser.add_argument( "-o", "--outdir", required=True, help="Directory to write the parquet dataset to" )
+    parser.add_argument( "-d", "--snana-dir", default=None,
+                         help="Directory with the SNANA class subdirectories (default: the reader's default)" )
+    parser.add_argument( "-p", "--dir-prefix", default="ELASTICC2_FINAL_",
+                         help="Prefix of the class subdirectories" )
+    parser.add_argument( "-c", "--classes", nargs='+', default=None,
+                         help="Classes to convert (default: all of them)" )
+    parser.add_argument( "-n", "--processes", type=int, default=1, help="Number of classes to convert at once" )
+    parser.add_argument( "-r", "--row-group-size", type=int, default=65536, help="Maximum rows per row group" )
+    parser.add_argument( "-z", "--compression", default="zstd", help="Parquet compression codec" )
+    parser.add_argument( "--overwrite", action='store_true', default=False,
+                         help="Rewrite files that already exist (default: skip them, i.e. resume)" )
+    parser.add_argument( "-v", "--verbose", action='store_true', default=False, help="Show debug log messages" )
+    args = parser.parse_args()
+
+    _logger.setLevel( logging.DEBUG if args.verbose else logging.INFO )
+
+    kwargs = { 'dir_prefix': args.dir_prefix, 'parquet_dir': None }
+    if args.snana_dir is not None:
+        kwargs['elasticc2_snana_dir'] = args.snana_dir
+    classes = args.classes if args.classes is not None else elasticc2_snana_reader( **kwargs ).obj_class_names
+
+    convargs = { 'outdir': pathlib.Path( args.outdir ), 'elasticc2_snana_dir': args.snana_dir,
+                 'dir_prefix': args.dir_prefix, 'row_group_size': args.row_group_size,
+                 'compression': args.compression, 'overwrite': args.overwrite }
+
+    failed = []
+    # polars doesn't like being forked, so spawn fresh interpreters
+    with concurrent.futures.ProcessPoolExecutor( max_workers=max( args.processes, 1 ),
+                                                 mp_context=multiprocessing.get_context( 'spawn' ) ) as pool:
+        futures = { pool.submit( convert_class, cls, **convargs ): cls for cls in classes }
+        for future in concurrent.futures.as_completed( futures ):
+            cls = futures[future]
+            try:
+                nwritten, nskipped = future.result()
+                _logger.info( f"Did {cls}: wrote {nwritten} files, {nskipped} already there" )
+            except Exception as ex:
+                _logger.exception( f"Failed converting {cls}: {ex}" )
+                failed.append( cls )
+
+    if len( failed ) > 0:
+        _logger.error( f"Failed classes (re-run to resume): {' '.join( sorted( failed ) )}" )
+        sys.exit( 1 )
+
 
 # ======================================================================
 if __name__ == "__main__":
@@ -1,7 +1,9 @@
-raise RuntimeError( "Deprecated.  See elasticc2/management/commands/send_elasticc2_alerts.py in desc-tom" )
+import os
+if os.getenv( "ELASTICC_ALLOW_DEPRECATED" ) is None:
+    raise RuntimeError( "Deprecated.  See elasticc2/management/commands/send_elasticc2_alerts.py in desc-tom "
+                        "(set ELASTICC_ALLOW_DEPRECATED to run this anyway)" )
 
 import sys
-import os
 import re
 import io
 import time
@@ -14,11 +16,23 @@ import dateutil.parser
 import pathlib
 import tarfile
 import gzip
+import queue
+import threading
+import concurrent.futures
+import functools
 import fastavro
 import confluent_kafka
 
+# These are in lib_elasticc2 (which must be in PYTHONPATH when running outside the Docker image)
+import alert_index
+import alert_container
+
 _logger = logging.getLogger(__name__)
-_logout = logging.handlers.TimedRotatingFileHandler( "/nightcache/stream-to-zads.log", when='d', interval=1 )
+if pathlib.Path( "/nightcache" ).is_dir():
+    _logout = logging.handlers.TimedRotatingFileHandler( "/nightcache/stream-to-zads.log", when='d', interval=1 )
+else:
+    # Not in the Docker image (e.g. running tests)
+    _logout = logging.StreamHandler( sys.stderr )
 _logger.addHandler( _logout )
 _formatter = logging.Formatter( f'[%(asctime)s - %(levelname)s] - %(message)s',
                                 datefmt='%Y-%m-%d %H:%M:%S' )
@@ -26,13 +40,174 @@ _logout.setFormatter( _formatter )
 _logger.setLevel( logging.INFO )
 # _logger.setLevel( logging.DEBUG )
 
+_nameparse = re.compile( r'alert_mjd([0-9]+\.[0-9]+)_obj([0-9]+)_src([0-9]+).avro.gz' )
+
+
+def _avro_leading_long( buf ):
+    """Decode the Avro long (a zigzag varint) at the start of bytes buf."""
+    n = 0
+    for i in range( min( len(buf), 10 ) ):
+        n |= ( buf[i] & 0x7f ) << ( 7 * i )
+        if ( buf[i] & 0x80 ) == 0:
+            return ( n >> 1 ) ^ -( n & 1 )
+    raise ValueError( "Failed to decode an Avro long from the start of the alert" )
+
+
+def _scan_tarball( tarpath ):
+    """Yield ( member name, member data ) for the alert files in tarball tarpath, in tarball order."""
+    with tarfile.open( tarpath, "r" ) as tar:
+        for member in tar.getmembers():
+            if not _nameparse.search( member.name ):
+                continue
+            yield member.name, tar.extractfile( member ).read()
+
+
+def _read_night_file( tarpath, schema, passthrough=False ):
+    """Read and decode all the alerts in one NITE{n}.tar.gz or NITE{n}.alerts.
+
+    Returns a list of ( alert file name, alert dict ), sorted by file
+    name (which is the same as sorting by mjd).  If passthrough is
+    True, the alerts aren't decoded; instead of an alert dict, there's
+    the (gunzipped) schemaless Avro bytes of the alert.  This is a
+    module-level function so that it can be run in a worker process.
+
+    A NITE{n}.alerts container (written by alert_container.py) is read
+    one exposure at a time.  If a tarball has an index (written by
+    alert_index.py), the alerts are read straight from the offsets in
+    the index, which is already sorted; otherwise, the tarball has to be
+    listed and the names parsed.
+
+    """
+    if tarpath.suffix == ".alerts":
+        alerts = alert_container.read_container( tarpath )
+        if not passthrough:
+            alerts = [ ( name, fastavro.schemaless_reader( io.BytesIO( alertbytes ), schema ) )
+                       for name, alertbytes in alerts ]
+        return alerts
+
+    index = alert_index.read_index( tarpath )
+    if index is not None:
+        members = zip( index['name'].tolist(), alert_index.read_indexed_members( tarpath, index ) )
+    else:
+        _logger.warning( f"{tarpath} has no index, listing it; run lib_elasticc2/alert_index.py on it to make loading faster." )
+        members = _scan_tarball( tarpath )
+
+    alerts = []
+    for name, data in members:
+        # Decompress the whole (small) alert at once; fastavro makes lots of
+        #   tiny reads, which are slow straight out of a gzip stream
+        alertbytes = gzip.decompress( data )
+        if passthrough:
+            alerts.append( ( name, alertbytes ) )
+        else:
+            alerts.append( ( name, fastavro.schemaless_reader( io.BytesIO( alertbytes ), schema ) ) )
+    if index is None:
+        alerts.sort( key=lambda a: a[0] )
+    return alerts
+
+
+class _TomNotifier:
+    """Tell the TOM which alerts were sent, from a background thread.
+
+    Use functools.partial( on_delivery, alertId ) as the kafka
+    producer's delivery callback for each alert; it collects the
+    alertIds of delivered alerts.  submit() hands the ones
+    collected so far to a worker thread, which coalesces everything
+    waiting in its queue into one markalertsent POST with a single
+    logged-in session (via streamer.notify_tom), so producing alerts
+    doesn't wait on the TOM.  The queue holds at most maxqueue batches;
+    submit() only blocks if the TOM gets that far behind.  close()
+    waits for the queue to empty.  If notifying the TOM fails (after
+    notify_tom's retries), the next submit() or close() raises.
+
+    """
+
+    def __init__( self, streamer, rqs=None, maxqueue=1000, maxbatch=100000, logger=_logger ):
+        self.streamer = streamer
+        self.rqs = rqs
+        self.maxbatch = maxbatch
+        self.logger = logger
+        self.delivered = []
+        self.nnotified = 0
+        self._error = None
+        self._queue = queue.Queue( maxsize=maxqueue )
+        self._thread = threading.Thread( target=self._run, name="tom-notifier", daemon=True )
+        self._thread.start()
+
+    def on_delivery( self, alertid, err, msg ):
+        if err is not None:
+            self.logger.error( f"Failed to deliver alert {alertid}: {err}" )
+        else:
+            self.delivered.append( alertid )
+
+    def _check( self ):
+        if self._error is not None:
+            raise RuntimeError( f"Failed to notify the TOM of sent alerts: {self._error}" ) from self._error
+
+    def submit( self ):
+        self._check()
+        if len( self.delivered ) == 0:
+            return
+        if self._queue.full():
+            self.logger.warning( "TOM notification queue is full; waiting for the TOM to catch up." )
+        self._queue.put( self.delivered )
+        self.delivered = []
+
+    def close( self ):
+        self.submit()
+        self._queue.put( None )
+        self._thread.join()
+        self._check()
+
+    def _run( self ):
+        done = False
+        while not done:
+            ids = self._queue.get()
+            if ids is None:
+                break
+            # Coalesce whatever else is waiting into one POST
+            while len( ids ) < self.maxbatch:
+                try:
+                    more = self._queue.get_nowait()
+                except queue.Empty:
+                    break
+                if more is None:
+                    done = True
+                    break
+                ids.extend( more )
+            if self._error is not None:
+                continue
+            try:
+                self.rqs = self.streamer.notify_tom( self.rqs, ids )
+                self.nnotified += len( ids )
+            except Exception as ex:
+                self.logger.exception( f"Giving up notifying the TOM: {ex}" )
+                self._error = ex
+
+
 class AlertStreamer:
     def __init__( self, alertdirs=None, schemafile=None, kafka_broker='brahms.lbl.gov:9092',
                   kafka_topic='elasticc-test-only-1', compression_factor=10,
                   campaign_start=datetime.datetime(2022,7,6,7,0,0), nights_done_cache="/nightcache/nightsdone.lis",
                   simnight0=60274, simnight1=61378,
                   tom_url='https://desc-tom.lbl.gov', tom_username='rknop', tom_passwdfile='/secrets/tom_passwd',
-                  dry_run=False, logger=_logger ):
+                  dry_run=False, pipelined=False, load_workers=None, passthrough=False, logger=_logger ):
+        """Stream ELAsTiCC alerts to kafka, a range of simulated nights each day.
+
+        If pipelined is True, the next night's alert files are read
+        and decoded in a pool of load_workers worker processes (default:
+        one per alert directory) while the current night is being
+        streamed, so the producer isn't left waiting on tar and gzip.
+        This means up to two nights of alerts are in memory at once.
+
+        If passthrough is True, alerts are sent exactly as they are in
+        the tarballs (gunzipped) instead of being decoded and then
+        re-encoded with the schema.  The alertId (needed to tell the
+        TOM what was sent) is read from the start of each alert, which
+        works because it's the first field of the alert schema.  The
+        alerts must have been written with schemafile's schema.
+
+        """
         self.logger = logger
         
         if alertdirs is None:
@@ -49,6 +224,14 @@ class AlertStreamer:
         self.logger.info( f"Reading schema from {self.schemafile}" )
         self.schema = fastavro.schema.load_schema( self.schemafile )
 
+        self.passthrough = passthrough
+        if self.passthrough:
+            firstfield = self.schema['fields'][0]
+            if ( firstfield['name'] != 'alertId' ) or ( firstfield['type'] != 'long' ):
+                raise ValueError( f"passthrough needs alertId (long) to be the first field of the alert schema, "
+                                  f"but it's {firstfield['name']} ({firstfield['type']})" )
+            self.logger.info( "Sending alerts as they are, without re-encoding" )
+
         self.kafka_broker = kafka_broker
         self.kafka_topic = kafka_topic
 
@@ -71,6 +254,11 @@ class AlertStreamer:
         self.logger.info( f"AlertStreamer: simnight0={self.totaln0}, simnight1={self.totaln1}" )
         self.logger.info( f"AlertStreamer: compression factor = {self.compression_factor} ; dry run = {self.dry_run}" )
 
+        self.pipelined = pipelined
+        self.load_workers = len( self.alertdirs ) if load_workers is None else load_workers
+        if self.pipelined:
+            self.logger.info( f"AlertStreamer: loading nights ahead with {self.load_workers} worker processes" )
+
         self.nights_done_cache = pathlib.Path( nights_done_cache )
         if self.nights_done_cache.is_file():
             self.logger.info( f"Reading nights done from {self.nights_done_cache}" )
@@ -103,8 +291,15 @@ class AlertStreamer:
         return rqs
 
     def notify_tom( self, rqs, ids ):
+        """POST ids to the TOM's markalertsent, retrying on failure.
+
+        rqs is a logged-in session from log_into_tom (or None to log
+        in); it's only replaced if something fails.  Returns the session
+        to use next time.
+
+        """
         if len(ids) == 0:
-            return
+            return rqs
 
         self.logger.debug( f"Notifying TOM of {len(ids)} alerts streamed." )
         self.logger.debug( f"type(rqs)={type(rqs)}, rqs={rqs}" )
@@ -113,7 +308,8 @@ class AlertStreamer:
         while outercountdown >= 0:
             countdown = 5
             try:
-                rqs = self.log_into_tom()
+                if rqs is None:
+                    rqs = self.log_into_tom()
                 while countdown >= 0:
                     try:
                         res = rqs.post( f'{self.tom_url}/elasticc/markalertsent', json=ids )
@@ -146,10 +342,77 @@ class AlertStreamer:
                     raise e
                 time.sleep( 1 )
                 self.logger.error( "Going to try logging back into the tom." )
-                rqs = self.log_into_tom()
+                rqs = None
                 outercountdown -= 1
         return rqs
     
+    def night_files( self, n ):
+        """The files to read night n from, one per alert directory.
+
+        That's NITE{n}.alerts if the tarball has been repacked with
+        alert_container.py (and the container is usable and up to date
+        with the tarball), otherwise NITE{n}.tar.gz.
+
+        """
+        tarpaths = []
+        for adir in self.alertdirs:
+            tarpath = pathlib.Path( adir ) / f"NITE{n}.tar.gz"
+            containerpath = alert_container.container_path( tarpath )
+            if alert_container.read_container_index( containerpath ) is not None:
+                tarpaths.append( containerpath )
+            elif tarpath.is_file():
+                tarpaths.append( tarpath )
+            else:
+                self.logger.error( f"{str(tarpath)} is not a regular file!  Moving on." )
+        return tarpaths
+
+    def submit_night( self, n, pool ):
+        """Start reading night n's files in pool; returns a list of ( tarpath, future )."""
+        tarpaths = self.night_files( n )
+        self.logger.info( f"Starting to read {len(tarpaths)} files for night {n} in the background" )
+        return [ ( tarpath, pool.submit( _read_night_file, tarpath, self.schema, self.passthrough ) )
+                 for tarpath in tarpaths ]
+
+    def load_night( self, n, futures=None ):
+        """Read all the alerts for night n.
+
+        If futures (from submit_night) is given, wait for those instead
+        of reading the files here.
+
+        Returns ( alertfilenames, alerts ), where alertfilenames is a
+        sorted (i.e. in order of mjd) list of alert file names, and
+        alerts is a dict of alert file name -> list of alert dicts (or,
+        with passthrough, of alert bytes).
+
+        """
+        # I'm assuming that no filename will be repeated in different
+        # tar files.  Since the source ID is embedded in the filename,
+        # this should be a good assumption.
+        alertfilenames = []
+        alerts = {}
+        if futures is None:
+            futures = [ ( tarpath, None ) for tarpath in self.night_files( n ) ]
+        for tarpath, future in futures:
+            if future is None:
+                self.logger.info( f"Reading {tarpath.name} from {tarpath.parent}..." )
+                filealerts = _read_night_file( tarpath, self.schema, self.passthrough )
+            else:
+                filealerts = future.result()
+            for alertfile, rawalert in filealerts:
+                if alertfile in alerts:
+                    self.logger.warning( f"alert['{alertfile}'] exists, and shouldn't!" )
+                else:
+                    alertfilenames.append( alertfile )
+                    alerts[ alertfile ] = []
+                alerts[ alertfile ].append( rawalert )
+            self.logger.info( f"...done reading {tarpath.name} from {tarpath.parent}; "
+                              f"up to {len(alertfilenames)} alert files." )
+
+        # Sort by mjd (which is the same as sorting by filename).  Each
+        #   file's list is already sorted, so this is mostly merging.
+        alertfilenames.sort()
+        return alertfilenames, alerts
+
     def stream_todays_batch( self, alert_delay=0, diffmjd_delay=0.05, diffnight_delay=5 ):
         now = datetime.datetime.now( datetime.timezone.utc )
         curday = ( now - self.t0 ).days
@@ -170,116 +433,113 @@ class AlertStreamer:
         self.logger.info( f"Will delay {alert_delay}s between alerts, {diffmjd_delay}s between "
                           f"exposures, and {diffnight_delay}s between nights." )
         
-        nameparse = re.compile( 'alert_mjd([0-9]+\.[0-9]+)_obj([0-9]+)_src([0-9]+).avro.gz' )
-
         if not self.dry_run:
             producer = confluent_kafka.Producer( { 'bootstrap.servers': self.kafka_broker,
                                                    'batch.size': self.kafka_batch_size_bytes,
                                                    'linger.ms': self.kafka_linger_ms
                                                   } )
-            rqs = self.log_into_tom()
-            
+            # Notifying the TOM happens in the background, as alerts are delivered
+            notifier = _TomNotifier( self, rqs=self.log_into_tom(), logger=self.logger )
+
         nstreamed = 0
         bytesstreamed = 0
-        idsproduced = []
 
-        # Do it one "night" at a time
+        nights = []
         for n in range( n0, n1+1 ):
-            nightnstreamed = 0
-            nightbytesstreamed = 0
-            
             if n in self.nights_done:
                 self.logger.warning( f"Night {n} already done, not doing it again." )
-                continue
-            self.logger.info( f"Doing night {n}" )
-
-            # Build the full list of alerts to stream
-            # I'm assuming that no filename will be repeated in different
-            # tar files.  Since the source ID is embedded in the filename,
-            # this should be a good assumption.
-            alertfilenames = []
-            alerts = {}
-            for adir in self.alertdirs:
-                self.logger.info( f"Looking in {adir}" )
-                tarpath = pathlib.Path( adir ) / f"NITE{n}.tar.gz"
-                if not tarpath.is_file():
-                    self.logger.error( f"{str(tarpath)} is not a regular file!  Moving on." )
-                    continue
-                self.logger.info( f"Reading {tarpath.name}..." )
-                with tarfile.open( tarpath, "r" ) as tar:
-                    members = [ m.name for m in tar.getmembers() if nameparse.search(m.name) ]
-                    for alertfile in members:
-                        alertfilenames.append( alertfile )
-                        if alertfile in alerts:
-                            self.logger.warning( f"alert['{alertfilename}'] exists, and shouldn't!" )
+            else:
+                nights.append( n )
+
+        # In pipelined mode, the next night is always being read while this one streams
+        pool = None
+        nextnight = None
+        if self.pipelined and ( len( nights ) > 0 ):
+            pool = concurrent.futures.ProcessPoolExecutor( max_workers=self.load_workers )
+            nextnight = self.submit_night( nights[0], pool )
+
+        try:
+            # Do it one "night" at a time
+            for i, n in enumerate( nights ):
+                nightnstreamed = 0
+                nightbytesstreamed = 0
+
+                self.logger.info( f"Doing night {n}" )
+
+                # Build the full list of alerts to stream
+                alertfilenames, alerts = self.load_night( n, nextnight )
+                if ( pool is not None ) and ( i+1 < len( nights ) ):
+                    nextnight = self.submit_night( nights[i+1], pool )
+
+                self.logger.info( f"Streaming {len(alertfilenames)} alerts for night {n}" )
+
+                lastmjd = ''
+                for alertfile in alertfilenames:
+                    match = _nameparse.search( alertfile )
+                    if not match:
+                        self.logger.error( f"Failed to parse {alertfile}; this should not happen!" )
+                        continue
+                    mjd = match.group(1)
+                    if mjd != lastmjd:
+                        if not self.dry_run:
+                            # Collect delivery reports, and pass the delivered alerts on to the TOM
+                            producer.poll( 0 )
+                            notifier.submit()
+                        self.logger.debug( f'Starting exposure mjd {mjd}; '
+                                           f'have {"fake-" if self.dry_run else " "}streamed '
+                                           f'{nightnstreamed} for night {n}; '
+                                           f'sleeping {diffmjd_delay} sec' )
+                        if diffmjd_delay > 0:
+                            time.sleep( diffmjd_delay )
+                        lastmjd = mjd
+                    for alert in alerts[ alertfile ]:
+                        if ( nightnstreamed % 500 ) == 0:
+                            self.logger.info( f'Have {"fake-" if self.dry_run else ""}streamed '
+                                              f'{nightnstreamed} for night {n}.' )
+                        if self.passthrough:
+                            alertbytes = alert
+                            alertid = _avro_leading_long( alert )
                         else:
-                            alerts[ alertfile ] = []
-                        fstream = gzip.open( tar.extractfile( alertfile ), 'rb' )
-                        rawalert = fastavro.schemaless_reader( fstream, self.schema )
-                        alerts[ alertfile ].append( rawalert )
-                        # reader = fastavro.reader( fstream )
-                        # for rawalert in reader:
-                        #     alerts[ alertfile ].append( rawalert )
-                        fstream.close()
-                self.logger.info( f"...done reading {tarpath.name}; up to {len(alertfilenames)} alert files." )
-
-            # Sort by mjd (which is the same as sorting by filename)
-            alertfilenames.sort()
-
-            self.logger.info( f"Streaming {len(alertfilenames)} alerts for night {n}" )
-
-            lastmjd = ''
-            idsproduced = []
-            for alertfile in alertfilenames:
-                match = nameparse.search( alertfile )
-                if not match:
-                    self.logger.error( f"Failed to parse {alertfile}; this should not happen!" )
-                    continue
-                mjd = match.group(1)
-                if mjd != lastmjd:
-                    if not self.dry_run:
-                        producer.flush()
-                        rqs = self.notify_tom( rqs, idsproduced )
-                        idsproduced = []
-                    self.logger.debug( f'Starting exposure mjd {mjd}; '
-                                       f'have {"fake-" if self.dry_run else " "}streamed '
-                                       f'{nightnstreamed} for night {n}; '
-                                       f'sleeping {diffmjd_delay} sec' )
-                    if diffmjd_delay > 0:
-                        time.sleep( diffmjd_delay )
-                    lastmjd = mjd
-                for alert in alerts[ alertfile ]:
-                    if ( nightnstreamed % 500 ) == 0:
-                        self.logger.info( f'Have {"fake-" if self.dry_run else ""}streamed '
-                                          f'{nightnstreamed} for night {n}.' )
-                    alertbytes = io.BytesIO()
-                    fastavro.write.schemaless_writer( alertbytes, self.schema, alert )
-                    if not self.dry_run:
-                        producer.produce( self.kafka_topic, alertbytes.getvalue() )
-                        idsproduced.append( alert['alertId'] )
-                    nightbytesstreamed += len( alertbytes.getvalue() )
-                    nightnstreamed += 1
-                    if alert_delay > 0:
-                        time.sleep( alert_delay )
-
-            if not self.dry_run:
-                producer.flush()
-                rqs = self.notify_tom( rqs, idsproduced )
-                idsproduced = []
-            self.logger.info( f'{"Fake-s" if self.dry_run else "S"}treamed {nightnstreamed} total alerts for night {n} '
-                              f'({nightbytesstreamed/1024/1024:.3f} MiB).' )
-            nstreamed += nightnstreamed
-            bytesstreamed += nightbytesstreamed
-            self.nights_done.append( n )
-            with open( self.nights_done_cache, "a" ) as ofp:
-                ofp.write( f"{n}\n" )
-            time.sleep( diffnight_delay )
+                            alertbytes = io.BytesIO()
+                            fastavro.write.schemaless_writer( alertbytes, self.schema, alert )
+                            alertbytes = alertbytes.getvalue()
+                            alertid = alert['alertId']
+                        if not self.dry_run:
+                            while True:
+                                try:
+                                    producer.produce( self.kafka_topic, alertbytes,
+                                                      on_delivery=functools.partial( notifier.on_delivery, alertid ) )
+                                    break
+                                except BufferError:
+                                    # The producer's local queue is full; wait for some deliveries
+                                    producer.poll( 0.1 )
+                        nightbytesstreamed += len( alertbytes )
+                        nightnstreamed += 1
+                        if alert_delay > 0:
+                            time.sleep( alert_delay )
+
+                if not self.dry_run:
+                    producer.flush()
+                    notifier.submit()
+                self.logger.info( f'{"Fake-s" if self.dry_run else "S"}treamed {nightnstreamed} total alerts '
+                                  f'for night {n} ({nightbytesstreamed/1024/1024:.3f} MiB).' )
+                nstreamed += nightnstreamed
+                bytesstreamed += nightbytesstreamed
+                self.nights_done.append( n )
+                with open( self.nights_done_cache, "a" ) as ofp:
+                    ofp.write( f"{n}\n" )
+                # In pipelined mode, the next night keeps loading during this sleep
+                time.sleep( diffnight_delay )
+        finally:
+            if pool is not None:
+                pool.shutdown( wait=False, cancel_futures=True )
 
         # This next flush is gratuitous, I think
         if not self.dry_run:
             producer.flush()
-            rqs = self.notify_tom( rqs, idsproduced )
-            idsproduced = []
+            self.logger.info( "Waiting for TOM notifications to finish..." )
+            notifier.close()
+            self.logger.info( f"Told the TOM about {notifier.nnotified} alerts." )
         self.logger.info( f"Done with today's batch.  {'Fake-s' if self.dry_run else 'S'}treamed {nstreamed} alerts "
                           f"({bytesstreamed/1024/1024:.3f} MiB)." )
 
@@ -301,6 +561,11 @@ def main():
     else:
         dry_run = False
 
+    pipelined = os.getenv( "ELASTICC_PIPELINED", None ) is not None
+    passthrough = os.getenv( "ELASTICC_PASSTHROUGH", None ) is not None
+    load_workers = os.getenv( "ELASTICC_LOAD_WORKERS", None )
+    load_workers = int( load_workers ) if load_workers is not None else None
+
     kafka_broker = os.getenv( "ELASTICC_ALERT_SERVER", default="brahms.lbl.gov:9092" )
     kafka_topic = os.getenv( "ELASTICC_ALERT_TOPIC", default="elasticc-test-only-1" )
     tom_url = os.getenv( "TOM_URL", default="https://desc-tom.lbl.gov" )
@@ -310,7 +575,8 @@ def main():
     streamer = AlertStreamer( compression_factor=compression_factor, campaign_start=t0,
                               simnight0=simnight0, simnight1=simnight1,
                               kafka_broker=kafka_broker, kafka_topic=kafka_topic, tom_url=tom_url,
-                              dry_run=dry_run )
+                              dry_run=dry_run, pipelined=pipelined, load_workers=load_workers,
+                              passthrough=passthrough )
     while True:
         streamer.stream_todays_batch()
         _logger.info( f'Sleeping 1 hour' )
@@ -0,0 +1,93 @@
+import sys
+import io
+import gzip
+import random
+import pathlib
+import tarfile
+import importlib.util
+import pytest
+
+_stzdir = pathlib.Path( __file__ ).resolve().parent.parent
+_schemafile = _stzdir.parent / "alert_schema/elasticc.v0_9_1.alert.avsc"
+
+
+@pytest.fixture( scope='session' )
+def stz():
+    # stream-to-zads.py isn't an importable name, so load it by path.  It
+    #   has to be in sys.modules for the pipelined loader's worker
+    #   processes to find _read_night_file.  (It's deprecated, so it
+    #   needs ELASTICC_ALLOW_DEPRECATED to load.)
+    spec = importlib.util.spec_from_file_location( "stream_to_zads", _stzdir / "stream-to-zads.py" )
+    mod = importlib.util.module_from_spec( spec )
+    with pytest.MonkeyPatch.context() as mp:
+        mp.setenv( "ELASTICC_ALLOW_DEPRECATED", "1" )
+        sys.modules[ spec.name ] = mod
+        spec.loader.exec_module( mod )
+    yield mod
+    del sys.modules[ spec.name ]
+
+
+@pytest.fixture( scope='session' )
+def schemafile():
+    return _schemafile
+
+
+@pytest.fixture( scope='session' )
+def schema():
+    fastavro = pytest.importorskip( "fastavro" )
+    return fastavro.schema.load_schema( str( _schemafile ) )
+
+
+def _source( rng, sourceid, objectid, mjd ):
+    return { 'diaSourceId': sourceid, 'diaObjectId': objectid, 'midPointTai': mjd,
+             'filterName': rng.choice( 'ugrizY' ), 'ra': rng.uniform( 0, 360 ), 'decl': rng.uniform( -60, 0 ),
+             'psFlux': rng.gauss( 100, 10 ), 'psFluxErr': 5., 'snr': 20. }
+
+
+@pytest.fixture
+def alertdirs( tmp_path, schema ):
+    """Two alert directories, each with NITE60300.tar.gz and NITE60301.tar.gz.
+
+    Returns ( list of directories, dict of alert file name -> gunzipped
+    schemaless Avro bytes ).  The tarball members are not in order of
+    name, and there's a member that isn't an alert.
+
+    """
+    fastavro = pytest.importorskip( "fastavro" )
+    rng = random.Random( 42 )
+    alertid = 2**40
+    dirs = []
+    alerts = {}
+    for d in range( 2 ):
+        adir = tmp_path / f"DIR{d}" / "ALERTS"
+        adir.mkdir( parents=True )
+        dirs.append( adir )
+        for night in ( 60300, 60301 ):
+            members = []
+            for mjd in sorted( night + rng.random() for _ in range( 4 ) ):
+                for _ in range( 5 ):
+                    alertid += rng.randint( 1, 5000 )
+                    objectid = rng.randint( 1, 10**7 )
+                    sourceid = alertid * 3
+                    alert = { 'alertId': alertid,
+                              'diaSource': _source( rng, sourceid, objectid, mjd ),
+                              'prvDiaSources': [ _source( rng, sourceid - j - 1, objectid, mjd - j - 1 )
+                                                 for j in range( rng.randint( 0, 5 ) ) ],
+                              'prvDiaForcedSources': None,
+                              'diaObject': { 'diaObjectId': objectid, 'simVersion': 'test', 'ra': 1., 'decl': 2. } }
+                    bio = io.BytesIO()
+                    fastavro.schemaless_writer( bio, schema, alert )
+                    name = f"NITE{night}/alert_mjd{mjd:.4f}_obj{objectid}_src{sourceid}.avro.gz"
+                    alerts[ name ] = bio.getvalue()
+                    members.append( name )
+            rng.shuffle( members )
+            with tarfile.open( adir / f"NITE{night}.tar.gz", "w:gz" ) as tar:
+                for name in members:
+                    data = gzip.compress( alerts[name] )
+                    info = tarfile.TarInfo( name )
+                    info.size = len( data )
+                    tar.addfile( info, io.BytesIO( data ) )
+                info = tarfile.TarInfo( f"NITE{night}/README" )
+                info.size = 5
+                tar.addfile( info, io.BytesIO( b"hello" ) )
+    return dirs, alerts
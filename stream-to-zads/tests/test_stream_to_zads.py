@@ -0,0 +1,178 @@
+# Tests of reading and streaming alert tarballs in stream-to-zads.py.
+#  Kafka and the TOM are faked; the alert tarballs are made by the
+#  alertdirs fixture in conftest.py.
+#
+# Run these tests from the stream-to-zads directory with
+#  PYTHONPATH=$PWD/../lib_elasticc2:$PYTHONPATH python -m pytest -v tests/test_stream_to_zads.py
+
+import io
+import os
+import json
+import types
+import datetime
+import concurrent.futures
+import pytest
+
+fastavro = pytest.importorskip( "fastavro" )
+pytest.importorskip( "requests" )
+pytest.importorskip( "confluent_kafka" )
+
+
+def _encode_long( val ):
+    bio = io.BytesIO()
+    fastavro.schemaless_writer( bio, "long", val )
+    return bio.getvalue()
+
+
+def test_avro_leading_long( stz ):
+    for val in ( 0, 1, -1, 63, -64, 64, -65, 300, -300, 2**31, -2**31 - 1, 2**40 + 12345, 2**63 - 1, -2**63 ):
+        enc = _encode_long( val )
+        assert stz._avro_leading_long( enc ) == val
+        # Whatever comes after doesn't matter
+        assert stz._avro_leading_long( enc + b'\xff\x01junk' ) == val
+    assert len( _encode_long( 2**40 ) ) > 1
+
+    # Truncated: nothing there, or the last byte still says there's more
+    for buf in ( b'', b'\x80', b'\xff\xff', _encode_long( 2**40 )[:-1] ):
+        with pytest.raises( ValueError, match="Failed to decode" ):
+            stz._avro_leading_long( buf )
+    # More than the 10 bytes an Avro long can have
+    with pytest.raises( ValueError, match="Failed to decode" ):
+        stz._avro_leading_long( b'\x80' * 11 + b'\x01' )
+
+
+def test_read_night_file( stz, schema, alertdirs ):
+    dirs, alerts = alertdirs
+    tarpath = dirs[0] / "NITE60300.tar.gz"
+    decoded = stz._read_night_file( tarpath, schema )
+    passthrough = stz._read_night_file( tarpath, schema, passthrough=True )
+    # 20 alerts, not the README
+    assert len( decoded ) == 20
+    assert [ name for name, _ in decoded ] == sorted( name for name, _ in decoded )
+    assert [ name for name, _ in passthrough ] == [ name for name, _ in decoded ]
+
+    for ( name, alert ), ( _, alertbytes ) in zip( decoded, passthrough ):
+        # Passthrough gives the gunzipped bytes as they are in the tarball...
+        assert alertbytes == alerts[name]
+        # ...and decoding and re-encoding gives the same bytes back
+        bio = io.BytesIO()
+        fastavro.schemaless_writer( bio, schema, alert )
+        assert bio.getvalue() == alertbytes
+        assert stz._avro_leading_long( alertbytes ) == alert['alertId']
+        assert f"_src{alert['diaSource']['diaSourceId']}." in name
+
+
+def test_read_night_file_indexed( stz, schema, alertdirs ):
+    dirs, alerts = alertdirs
+    tarpath = dirs[0] / "NITE60300.tar.gz"
+    decoded = stz._read_night_file( tarpath, schema )
+    passthrough = stz._read_night_file( tarpath, schema, passthrough=True )
+    assert stz.alert_index.build_index( tarpath ) == 20
+    assert stz.alert_index.read_index( tarpath ) is not None
+    assert stz._read_night_file( tarpath, schema ) == decoded
+    assert stz._read_night_file( tarpath, schema, passthrough=True ) == passthrough
+
+
+@pytest.mark.parametrize( "compression", [ 'zstd', 'none' ] )
+def test_read_night_file_container( stz, schemafile, schema, alertdirs, tmp_path, compression ):
+    if compression == 'zstd':
+        pytest.importorskip( "zstandard" )
+    dirs, alerts = alertdirs
+    streamer = _streamer( stz, schemafile, dirs, tmp_path )
+    expected = streamer.load_night( 60300 )
+    passthrough = stz._read_night_file( dirs[1] / "NITE60300.tar.gz", schema, passthrough=True )
+
+    # Only repack one directory's tarball; the other is still read from the tarball
+    assert stz.alert_container.repack_tarball( dirs[1] / "NITE60300.tar.gz", compression=compression ) == 20
+    containerpath = dirs[1] / "NITE60300.alerts"
+    assert streamer.night_files( 60300 ) == [ dirs[0] / "NITE60300.tar.gz", containerpath ]
+    assert stz._read_night_file( containerpath, schema, passthrough=True ) == passthrough
+    assert streamer.load_night( 60300 ) == expected
+
+    # If the tarball changes, the container is ignored
+    st = ( dirs[1] / "NITE60300.tar.gz" ).stat()
+    os.utime( dirs[1] / "NITE60300.tar.gz", ns=( st.st_atime_ns, st.st_mtime_ns + 10**9 ) )
+    assert streamer.night_files( 60300 ) == [ dirs[0] / "NITE60300.tar.gz", dirs[1] / "NITE60300.tar.gz" ]
+
+
+class _FakeProducer:
+    """Records what's produced, and reports it all delivered on poll or flush."""
+
+    def __init__( self, conf ):
+        self.produced = []
+        self.pending = []
+
+    def produce( self, topic, value, on_delivery=None ):
+        self.produced.append( bytes( value ) )
+        self.pending.append( ( value, on_delivery ) )
+
+    def poll( self, timeout=0 ):
+        pending = self.pending
+        self.pending = []
+        for value, on_delivery in pending:
+            on_delivery( None, types.SimpleNamespace( value=lambda: value ) )
+        return len( pending )
+
+    def flush( self, timeout=None ):
+        return self.poll()
+
+
+def _streamer( stz, schemafile, dirs, tmp_path, **kwargs ):
+    passwdfile = tmp_path / "passwd"
+    passwdfile.write_text( "password\n" )
+    # Each streamer needs its own nights done cache, or it won't do the nights again
+    cachename = "_".join( [ "nightsdone" ] + sorted( kwargs ) )
+    return stz.AlertStreamer( alertdirs=[ str( d ) for d in dirs ], schemafile=str( schemafile ),
+                              compression_factor=2, campaign_start=datetime.datetime.now( datetime.timezone.utc ),
+                              nights_done_cache=str( tmp_path / f"{cachename}.lis" ),
+                              simnight0=60300, simnight1=60301, tom_passwdfile=str( passwdfile ), **kwargs )
+
+
+def _stream( stz, streamer, monkeypatch ):
+    """Stream today's batch; returns ( list of alert bytes sent, list of alertIds the TOM was told about )."""
+    producers = []
+    notified = []
+    monkeypatch.setattr( stz.confluent_kafka, "Producer",
+                         lambda conf: producers.append( _FakeProducer( conf ) ) or producers[-1], raising=False )
+    streamer.log_into_tom = lambda: "session"
+    streamer.notify_tom = lambda rqs, ids: notified.extend( ids ) or rqs
+    streamer.stream_todays_batch( diffmjd_delay=0, diffnight_delay=0 )
+    assert len( producers ) == 1
+    return producers[0].produced, notified
+
+
+def test_load_night_pipelined( stz, schemafile, alertdirs, tmp_path ):
+    dirs, alerts = alertdirs
+    for passthrough in ( False, True ):
+        streamer = _streamer( stz, schemafile, dirs, tmp_path, passthrough=passthrough )
+        names, nightalerts = streamer.load_night( 60301 )
+        assert names == sorted( name for name in alerts if name.startswith( "NITE60301/" ) )
+        assert len( names ) == 40
+        assert all( len( nightalerts[name] ) == 1 for name in names )
+        with concurrent.futures.ProcessPoolExecutor( max_workers=2 ) as pool:
+            futures = streamer.submit_night( 60301, pool )
+            assert len( futures ) == 2
+            assert streamer.load_night( 60301, futures ) == ( names, nightalerts )
+
+
+def test_stream_passthrough( stz, schemafile, alertdirs, tmp_path, monkeypatch ):
+    dirs, alerts = alertdirs
+    sent, notified = _stream( stz, _streamer( stz, schemafile, dirs, tmp_path ), monkeypatch )
+    assert len( sent ) == 80
+    assert sorted( sent ) == sorted( alerts.values() )
+    assert notified == [ stz._avro_leading_long( b ) for b in sent ]
+
+    for kwargs in ( { 'passthrough': True }, { 'pipelined': True }, { 'passthrough': True, 'pipelined': True } ):
+        assert _stream( stz, _streamer( stz, schemafile, dirs, tmp_path, **kwargs ), monkeypatch ) == ( sent, notified )
+
+
+def test_passthrough_needs_alertid_first( stz, alertdirs, tmp_path ):
+    dirs, alerts = alertdirs
+    schemafile = tmp_path / "reordered.avsc"
+    schemafile.write_text( json.dumps( { 'type': 'record', 'name': 'alert', 'namespace': 'test',
+                                         'fields': [ { 'name': 'x', 'type': 'int' },
+                                                     { 'name': 'alertId', 'type': 'long' } ] } ) )
+    with pytest.raises( ValueError, match="passthrough needs alertId" ):
+        _streamer( stz, schemafile, dirs, tmp_path, passthrough=True )
+    # Without passthrough the alertId comes from the decoded alert, so the order doesn't matter
+    _streamer( stz, schemafile, dirs, tmp_path )
@@ -0,0 +1,219 @@
+# Tests of the background TOM notification in stream-to-zads.py, against
+#  a stub TOM web server running in a thread.
+#
+# Run these tests from the stream-to-zads directory with
+#  PYTHONPATH=$PWD/../lib_elasticc2:$PYTHONPATH python -m pytest -v tests/test_tom_notifier.py
+#
+# (stream-to-zads.py is deprecated; conftest.py sets ELASTICC_ALLOW_DEPRECATED to load it.)
+
+import time
+import json
+import types
+import threading
+import functools
+import http.server
+import pytest
+
+pytest.importorskip( "fastavro" )
+pytest.importorskip( "requests" )
+pytest.importorskip( "confluent_kafka" )
+
+
+class _StubTom:
+    """Just enough of the TOM's login and markalertsent for AlertStreamer."""
+
+    def __init__( self ):
+        self.logins = 0
+        self.posts = []
+        self.nfail = 0
+        # Clear this to make markalertsent hang until it's set again
+        self.go = threading.Event()
+        self.go.set()
+        self.posting = threading.Event()
+
+        tom = self
+
+        class Handler( http.server.BaseHTTPRequestHandler ):
+            def log_message( self, *args ):
+                pass
+
+            def _send( self, code, body ):
+                body = body.encode()
+                self.send_response( code )
+                self.send_header( 'Set-Cookie', 'csrftoken=csrf; Path=/' )
+                self.send_header( 'Content-Length', str( len( body ) ) )
+                self.end_headers()
+                self.wfile.write( body )
+
+            def do_GET( self ):
+                self._send( 200, "login page" )
+
+            def do_POST( self ):
+                body = self.rfile.read( int( self.headers['Content-Length'] ) )
+                if self.path == '/accounts/login/':
+                    tom.logins += 1
+                    return self._send( 200, "logged in" )
+                assert self.path == '/elasticc/markalertsent'
+                assert self.headers['X-CSRFToken'] == 'csrf'
+                tom.posting.set()
+                tom.go.wait()
+                if tom.nfail > 0:
+                    tom.nfail -= 1
+                    return self._send( 500, "oops" )
+                tom.posts.append( json.loads( body ) )
+                self._send( 200, json.dumps( { 'status': 'ok' } ) )
+
+        self.server = http.server.ThreadingHTTPServer( ( '127.0.0.1', 0 ), Handler )
+        self.url = f'http://127.0.0.1:{self.server.server_address[1]}'
+        self.thread = threading.Thread( target=self.server.serve_forever, daemon=True )
+        self.thread.start()
+
+    def shutdown( self ):
+        self.go.set()
+        self.server.shutdown()
+        self.server.server_close()
+
+
+class _FakeProducer:
+    """Holds produced alerts until poll or flush, then calls their delivery callbacks."""
+
+    def __init__( self ):
+        self.pending = []
+
+    def produce( self, topic, value, on_delivery=None ):
+        self.pending.append( ( value, on_delivery ) )
+
+    def poll( self, timeout=0, err=None ):
+        pending = self.pending
+        self.pending = []
+        for value, on_delivery in pending:
+            on_delivery( err, types.SimpleNamespace( value=lambda: value ) )
+        return len( pending )
+
+    def flush( self, timeout=None ):
+        return self.poll()
+
+
+@pytest.fixture( autouse=True )
+def _nosleep( stz, monkeypatch ):
+    # Don't really wait between notify_tom retries
+    monkeypatch.setattr( stz, "time", types.SimpleNamespace( sleep=lambda t: None ) )
+
+
+@pytest.fixture
+def tom():
+    tom = _StubTom()
+    yield tom
+    tom.shutdown()
+
+
+@pytest.fixture
+def streamer( stz, schemafile, tom, tmp_path ):
+    passwdfile = tmp_path / "passwd"
+    passwdfile.write_text( "password\n" )
+    return stz.AlertStreamer( alertdirs=[ str( tmp_path ) ],
+                              schemafile=str( schemafile ),
+                              nights_done_cache=str( tmp_path / "nightsdone.lis" ),
+                              tom_url=tom.url, tom_passwdfile=str( passwdfile ) )
+
+
+def _send( producer, notifier, alertids, err=None ):
+    """Produce, deliver, and submit one exposure's worth of alerts."""
+    for alertid in alertids:
+        producer.produce( 'topic', b'alert', on_delivery=functools.partial( notifier.on_delivery, alertid ) )
+    producer.poll( err=err )
+    notifier.submit()
+
+
+def _wait_for( condition, timeout=10 ):
+    t0 = time.monotonic()
+    while not condition():
+        if time.monotonic() - t0 > timeout:
+            raise TimeoutError( "Timed out waiting" )
+        time.sleep( 0.01 )
+
+
+def test_notify_coalesces_and_drains( stz, tom, streamer ):
+    producer = _FakeProducer()
+    notifier = stz._TomNotifier( streamer, rqs=streamer.log_into_tom() )
+
+    # Hold up the first POST; everything submitted meanwhile should go in one more POST
+    tom.go.clear()
+    _send( producer, notifier, [ 1, 2 ] )
+    assert tom.posting.wait( 10 )
+    for i in range( 10 ):
+        _send( producer, notifier, [ 10*i + 3, 10*i + 4 ] )
+    # Alerts that failed to deliver aren't reported to the TOM
+    _send( producer, notifier, [ 999 ], err="delivery failed" )
+    _send( producer, notifier, [] )
+    tom.go.set()
+    notifier.close()
+
+    assert len( tom.posts ) == 2
+    assert tom.posts[0] == [ 1, 2 ]
+    assert tom.posts[1] == [ i for j in range( 10 ) for i in ( 10*j + 3, 10*j + 4 ) ]
+    assert notifier.nnotified == 22
+    assert tom.logins == 1
+
+
+def test_notify_backpressure( stz, tom, streamer ):
+    producer = _FakeProducer()
+    notifier = stz._TomNotifier( streamer, rqs=streamer.log_into_tom(), maxqueue=2 )
+
+    tom.go.clear()
+    _send( producer, notifier, [ 1 ] )
+    assert tom.posting.wait( 10 )
+    # The worker is stuck on the first POST, so the queue fills up after two more
+    _send( producer, notifier, [ 2 ] )
+    _send( producer, notifier, [ 3 ] )
+    blocked = threading.Thread( target=_send, args=( producer, notifier, [ 4 ] ) )
+    blocked.start()
+    blocked.join( 0.5 )
+    assert blocked.is_alive()
+
+    tom.go.set()
+    blocked.join( 10 )
+    assert not blocked.is_alive()
+    notifier.close()
+    assert [ i for post in tom.posts for i in post ] == [ 1, 2, 3, 4 ]
+    assert tom.logins == 1
+
+
+def test_notify_retries( stz, tom, streamer ):
+    producer = _FakeProducer()
+    notifier = stz._TomNotifier( streamer, rqs=streamer.log_into_tom() )
+
+    # A couple of 500s are retried with the same session
+    tom.nfail = 2
+    _send( producer, notifier, [ 1, 2, 3 ] )
+    notifier.close()
+    assert tom.posts == [ [ 1, 2, 3 ] ]
+    assert tom.logins == 1
+
+    # Enough of them that the inner retries give up means logging in again
+    tom.posts = []
+    notifier = stz._TomNotifier( streamer, rqs=streamer.log_into_tom() )
+    tom.nfail = 7
+    _send( producer, notifier, [ 4, 5 ] )
+    notifier.close()
+    assert tom.posts == [ [ 4, 5 ] ]
+    assert tom.logins == 3
+
+
+def test_notify_failure( stz, tom, streamer ):
+    producer = _FakeProducer()
+
+    # A failure is raised by the next submit...
+    notifier = stz._TomNotifier( streamer, rqs=streamer.log_into_tom() )
+    tom.nfail = 10**6
+    _send( producer, notifier, [ 1 ] )
+    _wait_for( lambda: notifier._error is not None )
+    with pytest.raises( RuntimeError, match="Failed to notify the TOM of sent alerts" ):
+        _send( producer, notifier, [ 2 ] )
+
+    # ...or by close, if it happens while draining the queue
+    notifier = stz._TomNotifier( streamer, rqs=streamer.log_into_tom() )
+    _send( producer, notifier, [ 3 ] )
+    with pytest.raises( RuntimeError, match="status_code=500" ):
+        notifier.close()
+    assert tom.posts == []
@@ -1,4 +1,7 @@
-raise RuntimeError( "Deprecated.  See elasticc2/management/commands/load_snana_fits.py in desc-tom" )
+import os
+if os.getenv( "ELASTICC_ALLOW_DEPRECATED" ) is None:
+    raise RuntimeError( "Deprecated.  See elasticc2/management/commands/load_snana_fits.py in desc-tom "
+                        "(set ELASTICC_ALLOW_DEPRECATED to run this anyway)" )
 
 import sys
 import io
@@ -14,6 +17,9 @@ import fastavro
 
 from tomconnection import TomConnection
 
+# In lib_elasticc2, which needs to be in PYTHONPATH
+import alert_container
+
 class AlertLoader(TomConnection):
     def __init__( self, *args, dryrun=False, **kwargs ):
         super().__init__( *args, **kwargs )
@@ -93,6 +99,15 @@ class AlertLoader(TomConnection):
                     fstream = gzip.open( alertfile, "rb")
                 elif ( len(alertfile.name) > 5 ) and ( alertfile.name[-5:] == ".avro" ):
                     fstream = open( alertfile, "rb")
+                elif alertfile.suffix == ".alerts":
+                    # If the tarball is here too, loading it will load the container
+                    if any( ( alertfile.parent / f"{alertfile.stem}{ext}" ).is_file() for ext in ( ".tar.gz", ".tar" ) ):
+                        continue
+                    self.logger.debug( f'Loading alert container {alertfile}' )
+                    self.load_container( alertfile )
+                    continue
+                elif alertfile.name.endswith( ".alerts.index.npz" ):
+                    continue
                 elif ( ( len(alertfile.name) > 7 ) and ( alertfile.name[-7:] == ".tar.gz" ) or
                        ( len(alertfile.name) > 4 ) and ( alertfile.name[-4:] == ".tar" ) ):
                     self.logger.debug( f'Loading tar file {alertfile}' )
@@ -111,6 +126,13 @@ class AlertLoader(TomConnection):
             self.flush_alert_cache()
 
     def load_tarfile( self, tarfilename ):
+        # If the tarball has been repacked (with lib_elasticc2/alert_container.py), read that instead
+        containerpath = alert_container.container_path( tarfilename )
+        if alert_container.read_container_index( containerpath ) is not None:
+            self.logger.debug( f'Loading {containerpath} in place of {tarfilename}' )
+            self.load_container( containerpath )
+            return
+
         with tarfile.open( tarfilename, 'r' ) as tar:
             members = tar.getmembers()
             for member in members:
@@ -127,7 +149,17 @@ class AlertLoader(TomConnection):
                 if len(self.alertcache) >= self.alert_cache_size:
                     self.flush_alert_cache( )
         self.flush_alert_cache()
-                
+
+    def load_container( self, containerpath ):
+        # Each exposure's alerts are one contiguous read of the container
+        for mjd, names, payloads in alert_container.iter_exposures( containerpath ):
+            for payload in payloads:
+                alert = fastavro.schemaless_reader( io.BytesIO( payload ), self.schema )
+                self.alertcache.append( alert )
+                if len(self.alertcache) >= self.alert_cache_size:
+                    self.flush_alert_cache( )
+        self.flush_alert_cache()
+
 def main():
     logger = logging.getLogger("main")
     logout = logging.StreamHandler( sys.stderr )
@@ -137,7 +169,8 @@ def main():
 
     parser = argparse.ArgumentParser()
     parser.add_argument( "-d", "--directory", default=None, help="Directory of alerts to load" )
-    parser.add_argument( "-t", "--tarfile", default=None, help="Tar file of alerts to load" )
+    parser.add_argument( "-t", "--tarfile", default=None,
+                         help="Tar file (or NITE*.alerts container) of alerts to load" )
     parser.add_argument( "-u", "--urlbase", default="https://desc-tom.lbl.gov",
                          help="URL of TOM (no trailing / ; default https://desc-tom.lbl.gov)" )
     parser.add_argument( "-U", "--username", default="root", help="TOM username" )
@@ -161,7 +194,9 @@ def main():
 
     loader = AlertLoader( args.urlbase, args.username, args.password, dryrun=args.dry_run, logger=logger )
 
-    if ( args.tarfile is not None ):
+    if ( args.tarfile is not None ) and ( pathlib.Path( args.tarfile ).suffix == ".alerts" ):
+        loader.load_container( args.tarfile )
+    elif ( args.tarfile is not None ):
         loader.load_tarfile( args.tarfile )
     else:
         loader.load_directory( args.directory )